@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark the orchestration layer against a fake Athena and a local S3 stand-in.
+
+Runs run_cc_query.main end to end, the result read paths and the export
+download for 1K/100K/10M-domain scenarios, and writes latency, overhead
+(wall time minus Athena's simulated busy time), API call counts and
+throughput as JSON. Commit the JSON next to a change to show its effect;
+--compare prints the difference against an earlier file.
+
+Usage:
+  python scripts/benchmark.py                                   # all scenarios -> benchmarks/results.json
+  python scripts/benchmark.py --scenarios 1k,100k --compare benchmarks/results.json -o /tmp/new.json
+  python scripts/benchmark.py --latency QUEUED=0.5 --latency unload=5 --max-concurrent 5
+"""
+
+import sys
+import os
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.bench.fake_athena import DEFAULT_LATENCIES  # noqa: E402
+from src.bench.harness import SCENARIOS, Benchmark  # noqa: E402
+
+# (section, metric, higher is better)
+COMPARED = [
+    ("end_to_end", "seconds", False),
+    ("end_to_end", "overhead_s", False),
+    ("end_to_end", "poll_lag_mean_s", False),
+    ("results", ("api", "rows_per_s"), True),
+    ("results", ("s3", "rows_per_s"), True),
+    ("download", "records_per_s", True),
+]
+
+
+def parse_latency(value):
+    kind, _, seconds = value.partition("=")
+    if kind not in DEFAULT_LATENCIES or not seconds:
+        raise argparse.ArgumentTypeError(f"expected KIND=SECONDS with KIND in {', '.join(DEFAULT_LATENCIES)}")
+    return kind, float(seconds)
+
+
+def metric(scenario, section, key):
+    value = scenario[section]
+    for part in key if isinstance(key, tuple) else (key,):
+        value = value.get(part) if value else None
+    return value
+
+
+def print_results(results, previous=None):
+    before = {s["scenario"]: s for s in (previous or {}).get("scenarios", [])}
+    for scenario in results["scenarios"]:
+        e2e = scenario["end_to_end"]
+        print(f"\n📊 {scenario['scenario']}: {scenario['domains']:,} domains, {scenario['shards']} shard(s)")
+        print(f"   End to end: {e2e['seconds']:.2f}s (Athena busy {e2e['athena_busy_s']:.2f}s, "
+              f"overhead {e2e['overhead_s']:.2f}s, poll lag mean {e2e['poll_lag_mean_s']}s)")
+        print(f"   Athena calls: {sum(e2e['athena_calls'].values())} {e2e['athena_calls']}")
+        print(f"   S3 calls: {sum(e2e['s3_calls'].values())} {e2e['s3_calls']}")
+        res = scenario["results"]
+        print(f"   Results ({res['rows']:,} rows): API {res['api']['rows_per_s']:,} rows/s "
+              f"({res['api']['api_calls']} calls), S3 CSV {res['s3']['rows_per_s']:,} rows/s")
+        dl = scenario["download"]
+        print(f"   Download: {dl['records']:,} records, {dl['records_per_s']:,} records/s, {dl['mb_per_s']} MB/s")
+        old = before.get(scenario["scenario"])
+        if old:
+            for section, key, higher_better in COMPARED:
+                new_value, old_value = metric(scenario, section, key), metric(old, section, key)
+                if not new_value or not old_value:
+                    continue
+                change = (new_value - old_value) / old_value * 100
+                worse = change < -5 if higher_better else change > 5
+                name = key if isinstance(key, str) else ".".join(key)
+                print(f"   {'⚠️ ' if worse else '  '} {section}.{name}: {old_value} -> {new_value} ({change:+.1f}%)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark orchestration overhead against fake Athena/S3")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: {','.join(SCENARIOS)})")
+    parser.add_argument("-o", "--output", default="benchmarks/results.json", help="JSON results file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    parser.add_argument("--latency", type=parse_latency, action="append", default=[],
+                        help="Fake Athena latency override, KIND=SECONDS (repeatable)")
+    parser.add_argument("--max-concurrent", type=int, default=20, help="Fake Athena running slots")
+    parser.add_argument("--max-output-records", type=int, default=1_000_000,
+                        help="Cap on records written by the fake UNLOAD per scenario")
+    parser.add_argument("--result-rows", type=int, default=1_000_000, help="Cap on rows for the results path")
+    parser.add_argument("--verbose", action="store_true", help="Show run_cc_query output")
+    args = parser.parse_args(argv)
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+
+    print(f"⏱️  Benchmarking {', '.join(names)}")
+    bench = Benchmark(latencies=dict(args.latency), max_concurrent=args.max_concurrent,
+                      max_output_records=args.max_output_records, result_rows=args.result_rows,
+                      quiet=not args.verbose)
+    results = bench.run(names)
+    print_results(results, previous)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"\n💾 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+One entry point for the pipeline: `cc-crawl <command> [options]`.
+
+Each command is one of the scripts in this directory, imported only when it
+runs, so `cc-crawl check` doesn't load the export or download code and
+boto3 is only imported once a command creates its first AWS client (from
+the shared cache in src/aws/clients.py). Options after the command are the
+script's own; `cc-crawl <command> --help` lists them.
+
+Usage:
+  alias cc-crawl="python scripts/cc_crawl.py"
+  cc-crawl setup
+  cc-crawl upload --format parquet data/domains.csv.gz
+  cc-crawl export --shards 8
+  cc-crawl check
+  cc-crawl fetch ./cdx-results/ -o ./warc-records/
+"""
+
+import sys
+import os
+import importlib
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPTS_DIR))
+sys.path.append(SCRIPTS_DIR)
+
+# command -> (script module, summary)
+COMMANDS = {
+    "setup": ("create_bucket", "Create the S3 bucket, its folders and a billing alert"),
+    "upload": ("upload_data", "Upload the domain list (CSV, or deduplicated Parquet shards)"),
+    "export": ("run_cc_query", "Export CDX records for the domain list via Athena"),
+    "check": ("check_s3_results", "List the last export's files and sizes"),
+    "download": ("download_results", "Download and re-shard an export"),
+    "report": ("report_export", "One-pass statistics over an export"),
+    "fetch": ("fetch_warc", "Fetch the WARC records listed in a local export"),
+    "extract": ("extract_text", "Extract text from fetched WARC records"),
+    "index": ("cdx_index", "Build or query a local CDX index"),
+    "schedule": ("schedule_exports", "Queue and run many exports at once"),
+}
+
+
+def usage():
+    lines = ["usage: cc-crawl <command> [options]", "", "commands:"]
+    lines += [f"  {name:<10} {summary}" for name, (_, summary) in COMMANDS.items()]
+    lines += ["", "Run `cc-crawl <command> --help` for a command's options."]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return 0
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"cc-crawl: unknown command '{command}'\n\n{usage()}", file=sys.stderr)
+        return 2
+
+    module = importlib.import_module(COMMANDS[command][0])
+    # The scripts parse sys.argv themselves; the prog name shows up in their --help
+    sys.argv = [f"cc-crawl {command}", *args]
+    return module.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Build and query a local, memory-mapped CDX index over downloaded exports.
+
+`build` sorts export records (JSONL or Parquet) by urlkey into one file;
+`query` binary-searches it for a URL, URL prefix, host or host subtree
+(`--match domain`: the host and its subdomains, on any port) without
+loading it, and prints matching records as JSON lines (the export's record
+shape, so the output feeds scripts/fetch_warc.py).
+
+Usage:
+  python scripts/cdx_index.py build ./cdx-results/ -o .cache/cdx.idx
+  python scripts/cdx_index.py query .cache/cdx.idx example.com --match domain --limit 10
+  python scripts/cdx_index.py query .cache/cdx.idx https://example.com/blog/ --match prefix -o blog.jsonl
+  python scripts/cdx_index.py query .cache/cdx.idx example.com --match host --count
+  python scripts/cdx_index.py info .cache/cdx.idx
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cdx.index import MATCH_TYPES, CdxIndex, IndexBuilder, iter_export_records  # noqa: E402
+
+
+def format_bytes(bytes_val):
+    """Convert bytes to human readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_val < 1024.0:
+            return f"{bytes_val:.2f} {unit}"
+        bytes_val /= 1024.0
+    return f"{bytes_val:.2f} PB"
+
+
+def build(args):
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    builder = IndexBuilder(run_records=args.run_records, tmp_dir=args.tmp_dir)
+    print(f"🔨 Indexing {', '.join(args.inputs)}")
+    start = time.time()
+    stats = builder.build(iter_export_records(args.inputs), args.output,
+                          on_run=lambda runs, records: print(f"   💾 Sorted run {runs} ({records:,} records)"))
+    print(f"✅ {stats['records']:,} records from {stats['filenames']:,} WARC files, "
+          f"{stats['runs']} run(s) merged in {time.time() - start:.1f}s")
+    print(f"📁 {args.output} ({format_bytes(stats['bytes'])})")
+    return 0
+
+
+def query(args):
+    with CdxIndex(args.index) as index:
+        if args.count:
+            print(index.count_matches(args.url, args.match))
+            return 0
+        out = open(args.output, "w") if args.output else sys.stdout
+        try:
+            matched = 0
+            for record in index.lookup(args.url, args.match, limit=args.limit,
+                                       from_ts=args.from_ts, to_ts=args.to_ts):
+                out.write(json.dumps(record) + "\n")
+                matched += 1
+        finally:
+            if args.output:
+                out.close()
+    if args.output:
+        print(f"📁 {matched:,} record(s) written to {args.output}")
+    return 0
+
+
+def info(args):
+    with CdxIndex(args.index) as index:
+        stats = index.info()
+    print(f"📊 {stats['path']}: {stats['records']:,} records, {format_bytes(stats['bytes'])}, "
+          f"{stats['filenames']:,} WARC files")
+    if stats["records"]:
+        print(f"   urlkeys {stats['first_urlkey']} .. {stats['last_urlkey']}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local memory-mapped CDX index over downloaded exports")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_cmd = commands.add_parser("build", help="Sort export files into an index")
+    build_cmd.add_argument("inputs", nargs="+", help="Local export files or directories (JSONL or Parquet)")
+    build_cmd.add_argument("-o", "--output", required=True, help="Index file to write")
+    build_cmd.add_argument("--run-records", type=int, default=500_000,
+                           help="Records sorted in memory per run before spilling (default: 500000)")
+    build_cmd.add_argument("--tmp-dir", help="Directory for sorted runs (default: system temp)")
+
+    query_cmd = commands.add_parser("query", help="Print records matching a URL, prefix, host or domain")
+    query_cmd.add_argument("index", help="Index file")
+    query_cmd.add_argument("url", help="URL, URL prefix, host or domain")
+    query_cmd.add_argument("--match", choices=MATCH_TYPES, default="exact",
+                           help="exact URL, URL prefix, exact host, or the host's subtree: it and its "
+                                "subdomains on any port (default: exact)")
+    query_cmd.add_argument("--limit", type=int, help="At most N records")
+    query_cmd.add_argument("--from", dest="from_ts", metavar="TIMESTAMP", help="Earliest capture, e.g. 2025 or 20250701")
+    query_cmd.add_argument("--to", dest="to_ts", metavar="TIMESTAMP", help="Latest capture (inclusive)")
+    query_cmd.add_argument("--count", action="store_true", help="Only print the number of matching records")
+    query_cmd.add_argument("-o", "--output", help="Write JSON lines here instead of stdout")
+
+    info_cmd = commands.add_parser("info", help="Summarize an index")
+    info_cmd.add_argument("index", help="Index file")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        return build(args)
+    try:
+        return query(args) if args.command == "query" else info(args)
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
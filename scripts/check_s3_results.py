@@ -3,13 +3,14 @@
 Check S3 export results size and details
 """
 
-import boto3
+import sys
+import os
 import json
-from dotenv import load_dotenv
-from botocore.exceptions import ClientError
+import argparse
 
-# Load environment variables
-load_dotenv()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.aws.clients import get_client  # noqa: E402
 
 def format_bytes(bytes_val):
     """Convert bytes to human readable format"""
@@ -19,7 +20,9 @@ def format_bytes(bytes_val):
         bytes_val /= 1024.0
     return f"{bytes_val:.2f} PB"
 
-def main():
+def main(argv=None):
+    argparse.ArgumentParser(description="List the files and sizes of the last CDX export").parse_args(argv)
+    from botocore.exceptions import ClientError
     print("📊 Checking S3 Export Results")
     print("=" * 50)
     
@@ -43,7 +46,7 @@ def main():
     
     print(f"🔍 Checking: {s3_path}\n")
     
-    s3 = boto3.client('s3', region_name=config['region'])
+    s3 = get_client('s3', config['region'])
     
     try:
         # List all objects with the prefix
@@ -80,15 +83,11 @@ def main():
             print(f"     Size: {format_bytes(file_info['size'])} ({file_info['size']:,} bytes)")
             print(f"     Modified: {file_info['modified']}")
         
-        # Estimate records count (if gzipped JSON)
-        if files and files[0]['name'].endswith('.gz'):
-            print(f"\n📈 Estimated content:")
-            print(f"   Compressed data (.gz files)")
-            print(f"   Likely contains millions of CDX JSON records")
-            print(f"   Each record is one crawled URL from your domains")
+        print(f"\n📈 Exact record count, distinct digests, WARC files and bytes to fetch:")
+        print(f"   python scripts/report_export.py {s3_path}")
         
         print(f"\n💾 To download and inspect:")
-        print(f"   aws s3 cp {s3_path} ./results/ --recursive")
+        print(f"   python scripts/download_results.py {s3_path} -o ./results/ --shards 16")
         print(f"   zcat ./results/*.gz | head -n 10")
         
     except ClientError as e:
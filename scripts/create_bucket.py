@@ -6,15 +6,13 @@ Create S3 bucket using configuration
 import sys
 import os
 import json
-from dotenv import load_dotenv
+import argparse
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Load environment variables
-load_dotenv()
-
 from src.aws.setup import CommonCrawlAWSSetup
 
-def main():
+def main(argv=None):
+    argparse.ArgumentParser(description="Create the S3 bucket and folders from the configuration").parse_args(argv)
     print("🪣 Create S3 Bucket")
     print("=" * 25)
     
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Download a CDX export from S3 in parallel and re-shard it locally.
+
+Objects are fetched with parallel ranged GETs, decompressed while streaming
+and written to a fixed number of gzipped JSONL shards by hash of the
+domain (default) or of the WARC filename (groups records of one WARC file,
+which suits scripts/fetch_warc.py).
+
+Usage:
+  python scripts/download_results.py                          # last export from the config
+  python scripts/download_results.py s3://bucket/results/CC-MAIN-2025-30-cdx-json/ -o ./cdx-results/ --shards 64
+  python scripts/download_results.py --by filename --workers 16
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.aws.clients import get_client  # noqa: E402
+from src.aws.download import SHARD_KEYS, ExportDownloader  # noqa: E402
+
+
+def format_bytes(bytes_val):
+    """Convert bytes to human readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_val < 1024.0:
+            return f"{bytes_val:.2f} {unit}"
+        bytes_val /= 1024.0
+    return f"{bytes_val:.2f} PB"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download and re-shard a CDX export")
+    parser.add_argument("s3_url", nargs="?", help="Export prefix (default: last_cdx_export in the config)")
+    parser.add_argument("-o", "--output-dir", default="cdx-results", help="Local output directory")
+    parser.add_argument("--shards", type=int, default=16, help="Number of local output files")
+    parser.add_argument("--by", choices=SHARD_KEYS, default="domain", help="Shard key (default: domain)")
+    parser.add_argument("--workers", type=int, default=8, help="Objects downloaded at once")
+    parser.add_argument("--prefetch", type=int, default=4, help="Ranged GETs in flight per object")
+    parser.add_argument("--chunk-mb", type=int, default=8, help="Size of each ranged GET")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open("src/config/aws_config.json", "r") as f:
+        config = json.load(f)
+    s3_url = args.s3_url or config.get("last_cdx_export", {}).get("output_location")
+    if not s3_url:
+        print("❌ No export prefix given and no last_cdx_export in the config")
+        return 1
+
+    # One pooled client shared by every download thread
+    s3 = get_client("s3", config["region"], max_pool_connections=args.workers * args.prefetch + 4)
+    downloader = ExportDownloader(s3, args.output_dir, num_shards=args.shards, by=args.by,
+                                  workers=args.workers, chunk_size=args.chunk_mb * 1024 * 1024,
+                                  prefetch=args.prefetch)
+
+    print(f"📥 Downloading {s3_url} -> {args.output_dir}/ ({args.shards} shards by {args.by})")
+    start = time.time()
+    done = [0]
+
+    def on_object(key, records):
+        done[0] += 1
+        print(f"   ✅ [{done[0]}/{downloader.stats['total_objects']}] {key.rsplit('/', 1)[-1]}: {records:,} records")
+
+    stats = downloader.run(s3_url, on_object=on_object)
+    if not stats["total_objects"]:
+        print("📭 No results found at this location")
+        return 1
+
+    seconds = time.time() - start
+    print(f"\n🎉 {stats['records']:,} records from {stats['objects']} objects "
+          f"({format_bytes(stats['bytes_downloaded'])} in {seconds:.1f}s, "
+          f"{format_bytes(stats['bytes_downloaded'] / max(seconds, 1e-6))}/s)")
+    print(f"📁 Shards: {args.output_dir}/shard-NNNNN.jsonl.gz")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Fetch the WARC records listed in a local CDX export (JSONL or Parquet) using
+offset+length Range requests, merging nearby records into one request.
+
+Output: <output-dir>/part-NNNNN.warc.gz — each record is written as the raw
+gzip member fetched from Common Crawl, so the files are valid .warc.gz.
+Parts are written as .tmp files and renamed once complete; fetched ranges are
+checkpointed only then, so a rerun after a crash fetches the records of the
+unfinished parts again (their .tmp files are deleted) without duplicates.
+
+Usage:
+  python scripts/fetch_warc.py ./cdx-results/ -o ./warc-records/
+  python scripts/fetch_warc.py ./cdx-results/ -o ./warc-records/ --base-url http://localhost:8000/
+"""
+
+import sys
+import os
+import re
+import argparse
+import itertools
+import threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cdx.records import iter_records  # noqa: E402
+from src.warc.decoder import decode_record  # noqa: E402
+from src.warc.fetcher import DEFAULT_BASE_URL, WarcFetcher  # noqa: E402
+
+FETCH_COLUMNS = ["url", "digest", "filename", "offset", "length"]
+PART_NAME = re.compile(r"part-(\d+)\.warc\.gz$")
+
+
+class Part:
+    __slots__ = ("path", "file", "marks", "committed")
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path + ".tmp", "wb")
+        self.marks = []
+        self.committed = 0  # file size after the last complete range
+
+
+class PartWriter:
+    """One output file per worker thread (no lock contention), renamed into place when complete.
+
+    The fetcher's on_range marks are held until the part holding the range's
+    records has been renamed, so the checkpoint never covers records that
+    could still be lost. Records of a range that failed partway (on_discard)
+    are cut off again, since the range is fetched again on the next run.
+    """
+
+    def __init__(self, output_dir, part_bytes=256 * 1024 * 1024):
+        self.output_dir = output_dir
+        self.part_bytes = part_bytes
+        self.local = threading.local()
+        numbers = [-1]
+        for name in os.listdir(output_dir):
+            if name.endswith(".warc.gz.tmp"):
+                os.remove(os.path.join(output_dir, name))  # unfinished part of a crashed run
+            elif PART_NAME.match(name):
+                numbers.append(int(PART_NAME.match(name).group(1)))
+        self.counter = itertools.count(max(numbers) + 1)
+        self.parts = set()
+        self.lock = threading.Lock()
+
+    def write(self, record, payload):
+        part = getattr(self.local, "part", None)
+        if part is None:
+            part = Part(os.path.join(self.output_dir, f"part-{next(self.counter):05d}.warc.gz"))
+            self.local.part = part
+            with self.lock:
+                self.parts.add(part)
+        part.file.write(payload)
+
+    def on_range(self, mark):
+        part = getattr(self.local, "part", None)
+        if part is None:
+            mark()
+            return
+        part.marks.append(mark)
+        part.committed = part.file.tell()
+        if part.committed >= self.part_bytes:
+            self.local.part = None
+            self.finish(part)
+
+    def on_discard(self):
+        part = getattr(self.local, "part", None)
+        if part is not None:
+            part.file.seek(part.committed)
+            part.file.truncate()
+
+    def finish(self, part):
+        with self.lock:
+            self.parts.discard(part)
+        part.file.truncate(part.committed)
+        part.file.close()
+        if not part.committed:
+            os.remove(part.path + ".tmp")  # only ever held records of failed ranges
+            return
+        os.replace(part.path + ".tmp", part.path)
+        for mark in part.marks:
+            mark()
+
+    def close(self):
+        with self.lock:
+            parts = list(self.parts)
+        for part in parts:
+            self.finish(part)
+
+
+class DigestVerifier:
+    """Decode each fetched record and check its payload digest against the export"""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.lock = threading.Lock()
+        self.checked = 0
+        self.mismatched = []
+
+    def __call__(self, record, payload):
+        decoded = decode_record(payload, record.get("digest"))
+        with self.lock:
+            self.checked += 1
+            if decoded.digest_ok is False:
+                self.mismatched.append(record["url"])
+        self.sink(record, payload)
+
+
+def format_bytes(bytes_val):
+    """Convert bytes to human readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_val < 1024.0:
+            return f"{bytes_val:.2f} {unit}"
+        bytes_val /= 1024.0
+    return f"{bytes_val:.2f} PB"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch WARC records by offset+length from a CDX export")
+    parser.add_argument("inputs", nargs="+", help="Export files or directories (JSONL .gz or Parquet)")
+    parser.add_argument("-o", "--output-dir", default="warc-records", help="Output directory")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL,
+                        help=f"Where WARC files are served from (default: {DEFAULT_BASE_URL})")
+    parser.add_argument("--concurrency", type=int, default=16, help="Parallel Range requests")
+    parser.add_argument("--max-gap", type=int, default=64 * 1024,
+                        help="Merge records into one request when the gap between them is below this (bytes)")
+    parser.add_argument("--max-span", type=int, default=16 * 1024 * 1024,
+                        help="Upper bound on a merged request (bytes)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output-dir>/_checkpoint)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Decode each record and check its payload digest against the export")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    checkpoint = args.checkpoint or os.path.join(args.output_dir, "_checkpoint")
+
+    print("📥 Fetch WARC Records")
+    print("=" * 30)
+    print(f"🌐 Base URL: {args.base_url}")
+    print(f"📁 Output: {args.output_dir}")
+    print(f"♻️  Checkpoint: {checkpoint}")
+
+    fetcher = WarcFetcher(
+        base_url=args.base_url,
+        concurrency=args.concurrency,
+        max_gap=args.max_gap,
+        max_span=args.max_span,
+        checkpoint_path=checkpoint,
+    )
+    writer = PartWriter(args.output_dir)
+    on_record = DigestVerifier(writer.write) if args.verify else writer.write
+    try:
+        stats = fetcher.fetch(iter_records(args.inputs, columns=FETCH_COLUMNS), on_record,
+                              on_range=writer.on_range, flush=writer.close, on_discard=writer.on_discard)
+    finally:
+        writer.close()
+
+    rate = stats["bytes_fetched"] / stats["seconds"] if stats["seconds"] else 0
+    print("\n✅ Fetch complete")
+    print(f"   Records: {stats['records']:,} in {stats['ranges']:,} requests "
+          f"({stats['skipped_records']:,} records already done)")
+    print(f"   Fetched: {format_bytes(stats['bytes_fetched'])} "
+          f"(records: {format_bytes(stats['bytes_used'])}) at {format_bytes(rate)}/s")
+    if args.verify:
+        print(f"   Digests checked: {on_record.checked:,}, mismatched: {len(on_record.mismatched):,}")
+        for url in on_record.mismatched[:10]:
+            print(f"   ⚠️  Digest mismatch: {url}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Convert a Parquet CDX export (run_cc_query.py --format parquet) to the JSONL
+shape of the default export, so existing consumers keep working.
+
+Usage:
+  aws s3 sync s3://<bucket>/results/CC-MAIN-2025-30-cdx-parquet/ ./cdx-parquet/
+  python scripts/parquet_to_jsonl.py ./cdx-parquet/ -o cdx.jsonl.gz
+"""
+
+import sys
+import os
+import gzip
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cdx.records import expand_paths, iter_parquet_records, to_cdx_json  # noqa: E402
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert Parquet CDX exports to CDX JSON lines")
+    parser.add_argument("inputs", nargs="+", help="Parquet files or directories")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Output file (.gz is compressed); '-' for stdout")
+    args = parser.parse_args(argv)
+
+    if args.output == "-":
+        out = sys.stdout
+    elif args.output.endswith(".gz"):
+        out = gzip.open(args.output, "wt", encoding="utf-8")
+    else:
+        out = open(args.output, "w", encoding="utf-8")
+
+    count = 0
+    try:
+        for path in expand_paths(args.inputs):
+            for record in iter_parquet_records(path):
+                out.write(json.dumps(to_cdx_json(record), separators=(",", ":"), ensure_ascii=False))
+                out.write("\n")
+                count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.output != "-":
+        print(f"✅ Wrote {count:,} records to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+One-pass report over a CDX export: exact record count, distinct digests,
+WARC files touched, bytes needed to fetch and the pages-per-domain
+distribution. Files are streamed in parallel (from S3 or local disk) with
+bounded memory; per-domain counts spill to disk in hash partitions.
+
+Usage:
+  python scripts/report_export.py                              # last export from the config (S3)
+  python scripts/report_export.py s3://bucket/results/CC-MAIN-2025-30-cdx-json/
+  python scripts/report_export.py ./cdx-results/ --workers 8 --json report.json
+"""
+
+import sys
+import os
+import json
+import argparse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.aws.clients import get_client  # noqa: E402
+from src.cdx.report import ExportReport, list_sources  # noqa: E402
+
+
+def format_bytes(bytes_val):
+    """Convert bytes to human readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_val < 1024.0:
+            return f"{bytes_val:.2f} {unit}"
+        bytes_val /= 1024.0
+    return f"{bytes_val:.2f} PB"
+
+
+def print_report(report):
+    per_domain = report["records_per_domain"]
+    lengths = report["record_length"]
+    print(f"\n📊 Export Report ({report['sources']} files, {format_bytes(report['input_bytes'])}, "
+          f"{report['elapsed_s']}s)")
+    print(f"   Records: {report['records']:,}")
+    approx = "" if report["distinct_digests_exact"] else " (~0.8% HyperLogLog estimate)"
+    print(f"   Distinct digests: {report['distinct_digests']:,}{approx}")
+    print(f"   WARC files touched: {report['warc_files']:,}")
+    print(f"   Bytes to fetch: {format_bytes(report['bytes_to_fetch'])} ({report['bytes_to_fetch']:,} bytes)")
+    if lengths["p50"] is not None:
+        print(f"   Record length: p50 {format_bytes(lengths['p50'])}, p90 {format_bytes(lengths['p90'])}, "
+              f"p99 {format_bytes(lengths['p99'])}")
+    key = "hosts" if report["domain_key"] == "host" else "domains"
+    print(f"   {key.capitalize()}: {report['domains']:,}")
+    if per_domain["max"] is not None:
+        print(f"   Pages per {key[:-1]}: p50 {per_domain['p50']:,}, p90 {per_domain['p90']:,}, "
+              f"p99 {per_domain['p99']:,}, max {per_domain['max']:,}")
+    if report["top_domains"]:
+        print(f"   Top {key}:")
+        for domain, pages in report["top_domains"]:
+            print(f"     {pages:>12,}  {domain}")
+    if report["domain_key"] != "domain":
+        print("   ℹ️  JSON exports have no registered domain: counts are per urlkey host")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a CDX export once and report its statistics")
+    parser.add_argument("inputs", nargs="*", help="s3:// prefixes or local export files/directories "
+                                                  "(default: last_cdx_export in the config)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Files processed at once")
+    parser.add_argument("--partitions", type=int, default=64, help="Spill partitions for per-domain counts")
+    parser.add_argument("--max-domains", type=int, default=1_000_000,
+                        help="Domains held per worker before spilling to disk")
+    parser.add_argument("--exact-digests", action="store_true",
+                        help="Count distinct digests exactly (spills digests) instead of HyperLogLog")
+    parser.add_argument("--top", type=int, default=10, help="Largest domains to list")
+    parser.add_argument("--spill-dir", help="Directory for spill files (default: system temp)")
+    parser.add_argument("--json", help="Also write the report as JSON to this path")
+    args = parser.parse_args(argv)
+
+    with open("src/config/aws_config.json", "r") as f:
+        config = json.load(f)
+    inputs = args.inputs or [config.get("last_cdx_export", {}).get("output_location")]
+    if not inputs[0]:
+        print("❌ No inputs given and no last_cdx_export in the config")
+        return 1
+
+    s3 = None
+    if any(item.startswith("s3://") for item in inputs):
+        s3 = get_client("s3", config["region"])
+    sources = list_sources(inputs, s3)
+    if not sources:
+        print("📭 No export files found")
+        return 1
+
+    print(f"📈 Reporting on {len(sources)} files with {args.workers} workers")
+    reporter = ExportReport(workers=args.workers, num_partitions=args.partitions,
+                            max_domains=args.max_domains, exact_digests=args.exact_digests,
+                            top=args.top, region=config["region"], spill_dir=args.spill_dir)
+    done = [0]
+
+    def on_source(source, records):
+        done[0] += 1
+        name = source if isinstance(source, str) else source[1]
+        print(f"   ✅ [{done[0]}/{len(sources)}] {name.rsplit('/', 1)[-1]}: {records:,} records")
+
+    report = reporter.run(sources, on_source=on_source)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n💾 Report written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,193 @@
 #!/usr/bin/env python3
 """
-CDX Export (JSONL): CC-MAIN-2025-30, latest per digest, HTTP 200, HTML only.
-- Auto-creates domains_csv (single column 'domain') from config['domains_location']
-- Creates domains_norm view (lowercase + strip leading 'www.')
-- Adds just the target crawl/subset partition
-- Verifies via ccindex$partitions (no data scan)
-- Exports newline-delimited JSON (gz) using json_format(map(...))
+CDX Export: latest capture per content digest, HTTP 200, HTML only, for the
+domain list in config['domains_location'] (default crawl CC-MAIN-2025-30).
+- Auto-creates domains_csv (single column 'domain') and the domains_norm view
+  (lowercase + strip leading 'www.')
+- Adds just the target crawl/subset partition, verified via ccindex$partitions
+  (no data scan)
+- UNLOADs newline-delimited JSON (gz) or Parquet under the results location
+Sharding, incremental and delta runs, estimates, scan budgets, caching and
+the offline DuckDB engine are options: see --help and the readme.
 """
 
 import sys
 import os
 import json
 import time
-from dotenv import load_dotenv
+import argparse
+import tempfile
+import uuid
 
 # Allow local package imports like src.aws.athena_client
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-load_dotenv()
 
 from src.aws.athena_client import AthenaClient  # noqa: E402
+from src.aws.cdx_export import (  # noqa: E402
+    DOMAIN_ORDERS, EXPORT_TYPE, MANIFEST_NAME, MAX_TLD_PREDICATE, ShardedExport, build_export_select,
+    build_tlds_sql, build_tombstones_select, build_unload_sql, clear_prefix, split_s3_url, tombstones_prefix,
+)
+from src.aws.domain_manifest import DomainManifest  # noqa: E402
+from src.aws.estimate import ExportEstimator  # noqa: E402
+from src.aws.metrics import MetricsRecorder  # noqa: E402
+from src.aws.result_cache import ResultCache, cache_key, s3_prefix_fingerprint  # noqa: E402
+from src.aws.schema import (  # noqa: E402
+    CCINDEX_LOCATION, DEFAULT_CACHE_PATH as SCHEMA_CACHE_PATH, SchemaBootstrap, domains_csv_ddl,
+)
+from src.cdx.domains import iter_domain_file, write_domain_csv  # noqa: E402
 
 
-def main():
-    crawl_id = "CC-MAIN-2025-30"
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export CDX records for a domain list via Athena")
+    parser.add_argument("--crawl", default="CC-MAIN-2025-30", help="Crawl to export (default: CC-MAIN-2025-30)")
+    parser.add_argument("--delta-from", metavar="PREVIOUS_CRAWL",
+                        help="Only export URLs that are new or changed (content digest) since this crawl")
+    parser.add_argument("--tombstones", action="store_true",
+                        help="--delta-from: also export URLs the previous crawl had and this one did not see")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Split the domain list into N hash shards exported concurrently (default: 1)")
+    parser.add_argument("--max-concurrent", type=int, default=8,
+                        help="Max shard UNLOADs in flight (keep under the workgroup quota)")
+    parser.add_argument("--max-attempts", type=int, default=3,
+                        help="Attempts per shard before giving up")
+    parser.add_argument("--format", dest="export_format", choices=["json", "parquet"], default="json",
+                        help="json: gzipped CDX JSON lines (default); parquet: typed columnar output")
+    parser.add_argument("--compression", choices=["ZSTD", "SNAPPY", "GZIP"],
+                        help="Output compression (default: GZIP for json, ZSTD for parquet)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only export domains not yet exported for this crawl (per-crawl domain manifest)")
+    parser.add_argument("--domains-file",
+                        help="Local domain list for --incremental (default: the last uploaded CSV)")
+    parser.add_argument("--partition-projection", action="store_true",
+                        help="Define ccindex with partition projection instead of adding the crawl partition")
+    parser.add_argument("--no-schema-cache", action="store_true",
+                        help="Ignore .cache/schema.json and re-run all table DDL")
+    parser.add_argument("--recreate-ccindex", action="store_true",
+                        help="Drop and recreate ccindex if its definition changed (drops every crawl's partitions)")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Always run queries, ignoring .cache/results.sqlite and Athena result reuse")
+    parser.add_argument("--result-reuse-minutes", type=int, default=60,
+                        help="Max age of Athena results reused for identical SELECTs (default: 60)")
+    parser.add_argument("--metrics-log", default="logs/query_metrics.jsonl",
+                        help="JSONL file receiving one metrics record per query (default: logs/query_metrics.jsonl)")
+    parser.add_argument("--prometheus-textfile",
+                        help="Also write per-label totals here (node_exporter textfile collector, *.prom)")
+    parser.add_argument("--max-query-scan-gb", type=float,
+                        help="Stop any single query projected to scan more than this many GB")
+    parser.add_argument("--max-run-scan-gb", type=float,
+                        help="Stop the run once its queries together are projected to scan more than this many GB")
+    parser.add_argument("--max-per-domain", type=int,
+                        help="Export at most N pages per registered domain (top N by --domain-order)")
+    parser.add_argument("--domain-order", choices=sorted(DOMAIN_ORDERS), default="shortest-url",
+                        help="Which pages --max-per-domain keeps (default: shortest-url)")
+    parser.add_argument("--sample-heavy-domains", type=float, metavar="RATE",
+                        help="Keep this fraction (0-1) of URLs, by stable hash, in heavy domains")
+    parser.add_argument("--heavy-domain-pages", type=int, default=10000,
+                        help="Domains with more pages than this are sampled (default: 10000)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only estimate scan, cost, runtime and output of the export")
+    parser.add_argument("--sample-pct", type=float, default=1.0,
+                        help="--dry-run: percent of ccindex splits sampled for the join estimate (default: 1)")
+    parser.add_argument("--no-tld-pushdown", action="store_true",
+                        help="Do not restrict ccindex to the TLDs of the domain list")
+    parser.add_argument("--order-by-urlkey", action="store_true",
+                        help="Sort output by url_surtkey (index order); adds a sort stage to the export")
+    parser.add_argument("--engine", choices=["athena", "duckdb"], default="athena",
+                        help="duckdb: run the export offline over local files (no AWS calls)")
+    parser.add_argument("--ccindex-sample",
+                        help="--engine duckdb: local ccindex Parquet sample (crawl=.../subset=.../*.parquet)")
+    parser.add_argument("--local-root", default="offline",
+                        help="--engine duckdb: directory standing in for S3 (s3://bucket/key -> DIR/bucket/key)")
+    return parser.parse_args(argv)
+
+
+def format_bytes(bytes_val):
+    """Convert bytes to human readable format"""
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if bytes_val < 1024.0:
+            return f"{bytes_val:.2f} {unit}"
+        bytes_val /= 1024.0
+    return f"{bytes_val:.2f} PB"
+
+
+def print_estimate(estimate, export_format):
+    mins, secs = divmod(int(estimate["runtime_s"]), 60)
+    sample = estimate["domain_sample"]
+    per_domain = sample["pages_per_domain"]
+    print(f"   📊 Data scanned: ~{format_bytes(estimate['scan_bytes'])} "
+          f"({'planner estimate' if estimate['scan_source'] == 'explain' else 'scaled from the sample'})")
+    print(f"   💰 Estimated cost: ~${estimate['cost_usd']:.2f}")
+    print(f"   ⏱️ Estimated runtime: ~{mins}m {secs}s")
+    print(f"   📄 Output: ~{estimate['records']:,} records, ~{format_bytes(estimate['output_bytes'])} "
+          f"({export_format}, compressed)")
+    print(f"   🔬 Exact page counts (all captures) for {sample['domains_hit']:,} of {sample['domains']:,} "
+          f"sampled domains: p50 {per_domain['p50']:,}, p99 {per_domain['p99']:,}, max {per_domain['max']:,}")
+    for domain, pages in sample["top"][:10]:
+        print(f"      {domain}: {pages:,}")
+    print(f"   🧩 Suggested shards: {estimate['suggested_shards']} "
+          f"(each shard scans the same ccindex columns, so cost scales with shards)")
+    print(f"   💸 This estimate cost ~${estimate['estimate_cost_usd']:.2f}")
+
+
+def output_exists(s3, s3_url):
+    """True if anything was written under an S3 prefix"""
+    bucket, prefix = split_s3_url(s3_url)
+    return bool(s3.list_objects_v2(Bucket=bucket, Prefix=prefix, MaxKeys=1).get("Contents"))
+
+
+def local_domain_files(args, config, domains_parquet_location):
+    """Local domain list(s) behind the uploaded domains"""
+    if args.domains_file:
+        return [args.domains_file]
+    if domains_parquet_location:
+        return config["uploaded_domains"]["local_paths"]
+    return [config.get("uploaded_csv", {}).get("local_path", "data/sample.csv")]
+
+
+def offline_client_options(args, domains_location, domains_file):
+    """DuckDB engine + local S3 stand-in: ccindex reads the sample, domains_csv the local list"""
+    from src.aws.duckdb_engine import DuckDBEngine
+    from src.aws.local_s3 import LocalS3
+
+    s3 = LocalS3(args.local_root)
+    engine = DuckDBEngine(s3, locations={CCINDEX_LOCATION: args.ccindex_sample,
+                                         domains_location: domains_file})
+    return {"engine": engine, "s3": s3, "poll_initial": 0.01}
+
+
+def prepare_delta_domains(client, config, crawl_id, domains, athena_results):
+    """Upload only new domains and point default.domains_delta_norm at them"""
+    bucket_name = config["bucket_name"]
+    # Unique even for runs started in the same second (UNLOAD needs an empty prefix)
+    run_id = f"{time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())}-{uuid.uuid4().hex[:8]}"
+    delta_location = f"s3://{bucket_name}/domains-delta/{crawl_id}/{run_id}/"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "domains.csv")
+        write_domain_csv(domains, csv_path)
+        client.s3.upload_file(csv_path, bucket_name, f"domains-delta/{crawl_id}/{run_id}/domains.csv")
+    print(f"   📤 Uploaded {len(domains):,} new domains to {delta_location}")
+
+    client.execute_query("DROP TABLE IF EXISTS default.domains_delta_csv", athena_results)
+    client.execute_query(domains_csv_ddl(delta_location, table="default.domains_delta_csv"), athena_results)
+    # Domains were normalized locally (src/cdx/domains.py), so no regex here
+    client.execute_query("""
+        CREATE OR REPLACE VIEW default.domains_delta_norm AS
+        SELECT domain AS domain_norm
+        FROM default.domains_delta_csv
+        WHERE domain IS NOT NULL AND domain <> '';
+        """, athena_results)
+    return run_id, "default.domains_delta_norm"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    crawl_id = args.crawl
     subset = "warc"
+    if args.delta_from == crawl_id:
+        raise SystemExit("--delta-from must name a different crawl than --crawl")
+    if args.tombstones and not args.delta_from:
+        raise SystemExit("--tombstones needs --delta-from")
 
     print("📋 Common Crawl CDX Export — Latest per Digest, 200, HTML")
     print("=" * 80)
@@ -36,183 +200,219 @@ def main():
     results_location = config["results_location"].rstrip("/") + "/"
     athena_results   = config["athena_results_location"]
     domains_location = config.get("domains_location", "").rstrip("/") + "/"
+    domains_parquet_location = config.get("domains_parquet_location")
 
     if not domains_location.startswith("s3://"):
         raise RuntimeError("domains_location must be an s3:// path")
 
-    out_prefix = f"{results_location}{crawl_id}-cdx-json/"
+    offline = args.engine == "duckdb"
+    if offline:
+        if not args.ccindex_sample:
+            raise SystemExit("--engine duckdb needs --ccindex-sample (a local ccindex Parquet sample)")
+        # Offline runs read the local CSV domain list directly
+        domains_parquet_location = None
+
+    out_prefix = f"{results_location}{crawl_id}-cdx-{args.export_format}/"
+    if args.delta_from:
+        out_prefix = f"{results_location}{crawl_id}-cdx-{args.export_format}-delta-from-{args.delta_from}/"
     print(f"📦 Bucket: {bucket_name}")
-    print(f"🗂️  Domains CSV prefix: {domains_location}")
+    if domains_parquet_location:
+        print(f"🗂️  Domains Parquet prefix: {domains_parquet_location}")
+    else:
+        print(f"🗂️  Domains CSV prefix: {domains_location}")
+    if offline:
+        print(f"🦆 Offline: DuckDB over {args.ccindex_sample}, S3 paths under {args.local_root}/")
     print(f"🎯 Target Crawl: {crawl_id} / subset={subset}")
+    if args.delta_from:
+        print(f"🔀 Delta: only URLs new or changed since {args.delta_from}"
+              f"{' (+ tombstones)' if args.tombstones else ''}")
     print(f"📤 Output prefix: {out_prefix}")
     print("✅ Filters: HTTP 200, text/html, latest capture per content_digest\n")
 
+    domain_limits = {
+        "max_per_domain": args.max_per_domain,
+        "order": args.domain_order,
+        "sample_rate": args.sample_heavy_domains,
+        "heavy_pages": args.heavy_domain_pages,
+    }
+    if args.sample_heavy_domains is not None and not 0 < args.sample_heavy_domains <= 1:
+        raise SystemExit("--sample-heavy-domains must be in (0, 1]")
+
     start_ts = time.time()
+    client = None
     try:
-        client = AthenaClient()
-
-        # 0) Create domains_csv from single-column CSV + domains_norm
-        print("0️⃣ Creating/validating domains tables...")
-        create_domains_sql = f"""
-        CREATE EXTERNAL TABLE IF NOT EXISTS default.domains_csv (
-          domain STRING
-        )
-        ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.OpenCSVSerde'
-        WITH SERDEPROPERTIES (
-          'separatorChar' = ',',
-          'quoteChar'     = '"',
-          'escapeChar'    = '\\\\'
-        )
-        LOCATION '{domains_location}'
-        TBLPROPERTIES ('skip.header.line.count'='1');
-        """
-        client.execute_query(create_domains_sql, athena_results)
-
-        create_view_sql = """
-        CREATE OR REPLACE VIEW default.domains_norm AS
-        SELECT
-          REGEXP_REPLACE(LOWER(TRIM(domain)), '^www\\.', '') AS domain_norm
-        FROM default.domains_csv
-        WHERE domain IS NOT NULL AND TRIM(domain) <> '';
-        """
-        client.execute_query(create_view_sql, athena_results)
-
-        # 1) Light table health checks
-        print("1️⃣ Verifying domains...")
-        q = "SELECT CAST(COUNT(*) AS BIGINT) AS cnt FROM default.domains_csv"
-        qx = client.execute_query(q, athena_results)
+        metrics = MetricsRecorder(args.metrics_log, args.prometheus_textfile)
+        client_options = {
+            "metrics": metrics,
+            "query_scan_limit": args.max_query_scan_gb and int(args.max_query_scan_gb * 1024**3),
+            "run_scan_limit": args.max_run_scan_gb and int(args.max_run_scan_gb * 1024**3),
+        }
+        if offline:
+            domains_file = local_domain_files(args, config, None)[0]
+            client_options.update(offline_client_options(args, domains_location, domains_file))
+        elif not args.no_result_cache:
+            client_options.update(result_cache=ResultCache(), result_reuse_minutes=args.result_reuse_minutes)
+        client = AthenaClient(**client_options)
+
+        # 0) DDL: domains_csv + domains_norm, ccindex + target partition.
+        #    One catalog lookup; statements whose cached fingerprint still matches
+        #    are skipped, the rest run in dependency waves, concurrently per wave.
+        #    A newly added partition is verified via ccindex$partitions (no data scan).
+        print("0️⃣ Creating/validating domains and ccindex tables...")
+        # Offline catalogs start empty every run, so the schema cache is not used
+        schema = SchemaBootstrap(client, athena_results, cache_path=None if offline else SCHEMA_CACHE_PATH,
+                                 use_cache=not args.no_schema_cache, recreate_ccindex=args.recreate_ccindex)
+        schema.ensure(domains_location, crawl_id, subset, partition_projection=args.partition_projection,
+                      domains_parquet_location=domains_parquet_location,
+                      extra_crawls=[args.delta_from] if args.delta_from else ())
+
+        # 1) Light health check: domains row count (Parquet: answered from file metadata).
+        #    Cacheable queries are keyed on the domain objects' ETags (+ crawl id)
+        print("\n1️⃣ Verifying domains...")
+        domains_source = "domains_parquet" if domains_parquet_location else "domains_csv"
+        domains_inputs = [s3_prefix_fingerprint(client.s3, domains_parquet_location or domains_location)]
+        count_sql = f"SELECT CAST(COUNT(*) AS BIGINT) AS cnt FROM default.{domains_source}"
+        qx = client.execute_query(count_sql, athena_results, cache_inputs=domains_inputs, label="domains_count")
         cnt = int(client.get_query_results(qx["QueryExecution"]["QueryExecutionId"])["rows"][0]["cnt"])
         if cnt == 0:
-            raise RuntimeError("domains_csv is empty. Upload your domains first (single column header 'domain').")
-        print(f"   ✅ domains_csv rows: {cnt}")
-
-        # 2) Create ccindex table (idempotent) with official schema
-        print("\n2️⃣ Creating/validating ccindex table...")
-        ccindex_sql = f"""
-        CREATE EXTERNAL TABLE IF NOT EXISTS default.ccindex (
-          url_surtkey                STRING,
-          url                        STRING,
-          url_host_name              STRING,
-          url_host_registered_domain STRING,
-          url_protocol               STRING,
-          url_port                   INT,
-          url_path                   STRING,
-          url_query                  STRING,
-          fetch_time                 TIMESTAMP,
-          fetch_status               SMALLINT,
-          content_digest             STRING,
-          content_mime_type          STRING,
-          content_mime_detected      STRING,
-          content_charset            STRING,
-          content_languages          STRING,
-          warc_filename              STRING,
-          warc_record_offset         INT,
-          warc_record_length         INT,
-          warc_segment               STRING
-        )
-        PARTITIONED BY (crawl STRING, subset STRING)
-        STORED AS PARQUET
-        LOCATION 's3://commoncrawl/cc-index/table/cc-main/warc/';
-        """
-        client.execute_query(ccindex_sql, athena_results)
-        print("   ✅ ccindex created/verified")
-
-        # 3) Add ONLY the partition we need
-        print("\n3️⃣ Adding target partition...")
-        add_part_sql = f"""
-        ALTER TABLE default.ccindex
-        ADD IF NOT EXISTS PARTITION (crawl='{crawl_id}', subset='{subset}')
-        LOCATION 's3://commoncrawl/cc-index/table/cc-main/warc/crawl={crawl_id}/subset={subset}/';
-        """
-        client.execute_query(add_part_sql, athena_results)
-        print("   ✅ Partition add executed")
-
-        # 4) Verify partition via metadata table (no data scan)
-        print("\n4️⃣ Verifying partition (ccindex$partitions)...")
-        verify_sql = f"""
-        SELECT COUNT(1) AS cnt
-        FROM "default"."ccindex$partitions"
-        WHERE crawl='{crawl_id}' AND subset='{subset}';
-        """
-        vx = client.execute_query(verify_sql, athena_results)
-        vrows = client.get_query_results(vx["QueryExecution"]["QueryExecutionId"])["rows"]
-        if int(vrows[0]["cnt"]) == 0:
-            raise RuntimeError(f"Partition crawl={crawl_id}, subset={subset} not found after ADD PARTITION.")
-        print("   ✅ Partition present")
-
-        # 5) UNLOAD JSONL: latest per digest, 200, HTML, dedup, safe JSON
-        print("\n5️⃣ Exporting CDX-like JSON (latest per digest, 200, HTML)...")
+            raise RuntimeError(f"{domains_source} is empty. Upload your domains first (single column header 'domain').")
+        print(f"   ✅ {domains_source} rows: {cnt}")
+        domain_count = cnt
+
+        # 1b) Incremental: reduce the domain side to domains not exported yet for this crawl
+        domains_table = "default.domains_norm"
+        if args.incremental:
+            domains_inputs = None  # a fresh delta table every run
+            domains_files = local_domain_files(args, config, domains_parquet_location)
+            # One manifest per output prefix and per-domain limits: either changes the records a domain gets
+            limits = domain_limits if args.max_per_domain or args.sample_heavy_domains else None
+            domain_manifest = DomainManifest(client.s3, results_location, crawl_id, out_prefix, limits).load()
+            print(f"\n🔁 Incremental mode: comparing {', '.join(domains_files)} with {domain_manifest.url}...")
+            domains = [d for path in domains_files for d in iter_domain_file(path)]
+            delta = domain_manifest.delta(domains)
+            print(f"   ✅ {len(domains):,} domains, {len(delta):,} not yet exported "
+                  f"({len(domain_manifest.data['runs'])} previous run(s))")
+            if not delta:
+                print(f"\n🎉 Nothing new to export to {out_prefix}")
+                return 0
+            run_id, domains_table = prepare_delta_domains(client, config, crawl_id, delta, athena_results)
+            domain_count = len(delta)
+            out_prefix = f"{out_prefix}run={run_id}/"
+
+        # 1c) TLD pushdown: lists concentrate in few TLDs, and url_host_tld lets
+        #     Athena skip ccindex row groups by their min/max statistics
+        tlds = None
+        if not args.no_tld_pushdown:
+            print("\n🔎 Collecting TLDs of the domain list for predicate pushdown...")
+            tx = client.execute_query(build_tlds_sql(domains_table), athena_results,
+                                      cache_inputs=domains_inputs, label="tlds")
+            tlds = sorted(row["tld"] for row in client.get_query_results(tx["QueryExecution"]["QueryExecutionId"])["rows"]
+                          if row["tld"])
+            if len(tlds) > MAX_TLD_PREDICATE:
+                print(f"   ⚠️ {len(tlds)} TLDs in the domain list, skipping the url_host_tld filter")
+                tlds = None
+            else:
+                print(f"   ✅ Restricting ccindex to {len(tlds)} TLD(s): {', '.join(tlds[:10])}"
+                      f"{' ...' if len(tlds) > 10 else ''}")
+
+        if args.dry_run:
+            print(f"\n🧪 Dry run: estimating the export ({args.sample_pct:g}% ccindex sample)...")
+            estimator = ExportEstimator(client, athena_results, crawl_id, subset,
+                                        domains_table=domains_table, tlds=tlds,
+                                        export_format=args.export_format)
+            select_sql = build_export_select(crawl_id, subset, export_format=args.export_format,
+                                             domains_table=domains_table, tlds=tlds,
+                                             domain_limits=domain_limits, previous_crawl=args.delta_from)
+            print_estimate(estimator.run(select_sql, sample_pct=args.sample_pct, domain_count=domain_count),
+                           args.export_format)
+            if args.delta_from:
+                print(f"   ℹ️ The scan covers both crawls; records and output are for a full export, "
+                      f"an upper bound for the delta from {args.delta_from}")
+            print("\n🎉 Dry run finished, nothing exported")
+            return 0
+
+        # 2) UNLOAD JSONL or Parquet: latest per digest, 200, HTML, dedup
+        print(f"\n2️⃣ Exporting CDX records as {args.export_format} (latest per digest, 200, HTML)...")
         print("   ⏱️ Expected: ~1–3 minutes for modest outputs; more if the result set is huge")
-        print("   💰 Athena scan: typically $0.05–$0.30; worst case ~$1.50 if you scan most of the crawl")
-
-        export_sql = f"""
-        UNLOAD (
-          WITH ranked AS (
-            SELECT
-              cc.url_surtkey                                         AS urlkey,
-              date_format(cc.fetch_time, '%Y%m%d%H%i%s')             AS timestamp,
-              cc.url                                                 AS url,
-              cc.content_mime_type                                   AS mime,
-              cc.content_mime_detected                               AS mime_detected,
-              CAST(cc.fetch_status AS VARCHAR)                       AS status,
-              cc.content_digest                                      AS digest,
-              CAST(cc.warc_record_length AS VARCHAR)                 AS length,
-              CAST(cc.warc_record_offset AS VARCHAR)                 AS offset,
-              cc.warc_filename                                       AS filename,
-              cc.content_languages                                   AS languages,
-              cc.content_charset                                     AS encoding,
-              ROW_NUMBER() OVER (
-                PARTITION BY cc.content_digest
-                ORDER BY cc.fetch_time DESC
-              ) AS rn
-            FROM default.ccindex cc
-            JOIN default.domains_norm d
-              ON cc.url_host_registered_domain = d.domain_norm
-            WHERE cc.crawl  = '{crawl_id}'
-              AND cc.subset = '{subset}'
-              AND cc.fetch_status = 200
-              AND cc.content_mime_detected = 'text/html'
-              AND cc.content_digest IS NOT NULL
-              AND cc.url IS NOT NULL
-          )
-          SELECT
-            CONCAT(
-              '{{',
-              '"urlkey":"', urlkey, '",',
-              '"timestamp":"', timestamp, '",',
-              '"url":"', REPLACE(REPLACE(url, '"', '\\\\"'), '\\n', '\\\\n'), '",',
-              '"mime":"', COALESCE(mime,''), '",',
-              '"mime-detected":"', COALESCE(mime_detected,''), '",',
-              '"status":"', status, '",',
-              '"digest":"', digest, '",',
-              '"length":"', length, '",',
-              '"offset":"', offset, '",',
-              '"filename":"', filename, '",',
-              '"languages":"', COALESCE(languages,''), '",',
-              '"encoding":"', COALESCE(encoding,''), '"',
-              '}}'
-            ) AS cdx_record
-          FROM ranked
-          WHERE rn = 1
-        )
-        TO '{out_prefix}'
-        WITH (
-          format='TEXTFILE',
-          compression='GZIP'
-        );
-        """
-        print(f"   📤 Writing to: {out_prefix}")
-        ex = client.execute_query(export_sql, athena_results)
-        _ = client.get_query_results(ex["QueryExecution"]["QueryExecutionId"])
+        print("   💰 Athena scan: typically $0.05–$0.30; worst case ~$1.50 if you scan most of the crawl "
+              "(--dry-run estimates it)")
+
+        if args.shards > 1:
+            print(f"   🧩 Sharded mode: {args.shards} shards -> {out_prefix}shard=NN/")
+            export = ShardedExport(
+                client, crawl_id, subset, out_prefix, athena_results,
+                num_shards=args.shards,
+                max_concurrent=args.max_concurrent,
+                max_attempts=args.max_attempts,
+                export_format=args.export_format,
+                compression=args.compression,
+                domains_table=domains_table,
+                tlds=tlds,
+                order_by_urlkey=args.order_by_urlkey,
+                domain_limits=domain_limits,
+                previous_crawl=args.delta_from,
+            )
+            manifest = export.run()
+            execution_ids = [s["execution_id"] for _, s in sorted(manifest["shards"].items())]
+        else:
+            export_sql = build_unload_sql(
+                build_export_select(crawl_id, subset, export_format=args.export_format,
+                                    domains_table=domains_table, tlds=tlds,
+                                    order_by_urlkey=args.order_by_urlkey,
+                                    domain_limits=domain_limits, previous_crawl=args.delta_from),
+                out_prefix, args.export_format, args.compression,
+            )
+            print(f"   📤 Writing to: {out_prefix}")
+            export_inputs = None if domains_inputs is None else domains_inputs + [crawl_id]
+            if export_inputs and client.result_cache and not output_exists(client.s3, out_prefix):
+                client.result_cache.discard(cache_key(export_sql, export_inputs))
+            ex = client.execute_query(export_sql, athena_results, cache_inputs=export_inputs, label="export")
+            _ = client.get_query_results(ex["QueryExecution"]["QueryExecutionId"])
+            execution_ids = [ex["QueryExecution"]["QueryExecutionId"]]
         print("   ✅ Export finished")
 
+        if args.tombstones:
+            # Sibling prefix, rewritten on every run (UNLOAD needs it empty)
+            dropped_prefix = tombstones_prefix(out_prefix)
+            print(f"\n🪦 Exporting URLs seen in {args.delta_from} but not in {crawl_id} to {dropped_prefix}")
+            clear_prefix(client.s3, dropped_prefix)
+            tombstones_sql = build_unload_sql(
+                build_tombstones_select(crawl_id, args.delta_from, subset, export_format=args.export_format,
+                                        domains_table=domains_table, tlds=tlds),
+                dropped_prefix, args.export_format, args.compression,
+            )
+            client.execute_query(tombstones_sql, athena_results, label="tombstones")
+            print("   ✅ Tombstones exported")
+
+        if args.incremental:
+            domain_manifest.add_run(run_id, out_prefix, delta)
+            print(f"   📝 Domain manifest updated: {domain_manifest.url}")
+
+        if offline:
+            print(f"\n🎉 Done (offline) in {time.time() - start_ts:.1f}s")
+            print(f"📁 Results in: {client.s3.url_path(out_prefix)}")
+            return 0
+
         # Save export info
         config["last_cdx_export"] = {
             "crawl_id": crawl_id,
             "output_location": out_prefix,
-            "export_type": "cdx_unique_200_latest_html",
-            "execution_id": ex["QueryExecution"]["QueryExecutionId"],
+            "export_type": EXPORT_TYPE,
+            "format": args.export_format,
+            "execution_id": execution_ids[0],
         }
+        if args.max_per_domain or args.sample_heavy_domains:
+            config["last_cdx_export"]["domain_limits"] = domain_limits
+        if args.delta_from:
+            config["last_cdx_export"]["delta_from"] = args.delta_from
+        if args.tombstones:
+            config["last_cdx_export"]["tombstones"] = tombstones_prefix(out_prefix)
+        if args.shards > 1:
+            config["last_cdx_export"].update({
+                "shards": args.shards,
+                "execution_ids": execution_ids,
+                "manifest": f"{out_prefix}{MANIFEST_NAME}",
+            })
         with open("src/config/aws_config.json", "w") as f:
             json.dump(config, f, indent=2)
 
@@ -221,14 +421,25 @@ def main():
         secs = int(total_s % 60)
         print("\n🎉 Done!")
         print(f"⏱️  Total runtime: {mins}m {secs}s")
+        print(f"📈 Query metrics: {args.metrics_log} (run_id {metrics.run_id})")
         print(f"📁 Results in: {out_prefix}")
-        print("💾 Format: JSON lines (.gz), one record per line")
         print("🔎 Preview locally:")
         print("   aws s3 sync " + out_prefix + " ./cdx-results/")
-        print("   zcat ./cdx-results/*.gz | head -n 5")
+        if args.export_format == "parquet":
+            print("💾 Format: Parquet, typed columns")
+            print("   python scripts/parquet_to_jsonl.py ./cdx-results/ | head -n 5")
+        else:
+            print("💾 Format: JSON lines (.gz), one record per line")
+            print("   zcat ./cdx-results/*.gz | head -n 5")
 
         return 0
 
+    except KeyboardInterrupt:
+        if client is not None:
+            client.cancel_all()
+        print("\n🛑 Interrupted; all started queries were cancelled")
+        return 130
+
     except Exception as e:
         print(f"\n❌ Export failed: {e}")
         return 1
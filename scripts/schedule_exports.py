@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Queue and run many CDX exports (crawl x domain set x options) at once.
+
+Jobs live in a local SQLite store (.cache/jobs.sqlite) and never write
+src/config/aws_config.json, so any number of them (and other scripts) can
+run side by side. `run` packs every job's queries into one pool capped at
+--max-in-flight (keep it at the workgroup's active query quota), backs off
+on throttling, and picks up where it stopped after a crash or Ctrl-C.
+
+Usage:
+  python scripts/schedule_exports.py add --crawl CC-MAIN-2025-30 --crawl CC-MAIN-2025-26 --shards 4
+  python scripts/schedule_exports.py add --crawl CC-MAIN-2025-30 --domains-file data/other.csv --format parquet
+  python scripts/schedule_exports.py add --crawl CC-MAIN-2025-30 --delta-from CC-MAIN-2025-26 --tombstones
+  python scripts/schedule_exports.py run --max-in-flight 20
+  python scripts/schedule_exports.py list
+  python scripts/schedule_exports.py show <job_id>
+  python scripts/schedule_exports.py retry <job_id>
+"""
+
+import sys
+import os
+import json
+import time
+import uuid
+import argparse
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.aws.athena_client import AthenaClient  # noqa: E402
+from src.aws.cdx_export import DOMAIN_ORDERS  # noqa: E402
+from src.aws.clients import get_client  # noqa: E402
+from src.aws.metrics import MetricsRecorder  # noqa: E402
+from src.aws.scheduler import DEFAULT_STORE_PATH, JOB_STATES, PHASES, ExportScheduler, JobStore  # noqa: E402
+from src.aws.schema import DEFAULT_CACHE_PATH as SCHEMA_CACHE_PATH  # noqa: E402
+from src.cdx.domains import iter_domain_file, write_domain_csv  # noqa: E402
+
+STATE_ICONS = {"queued": "⏳", "running": "🏃", "succeeded": "✅", "failed": "❌"}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Schedule many CDX exports under one Athena concurrency budget")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help=f"Job store (default: {DEFAULT_STORE_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    add = commands.add_parser("add", help="Queue one export job per --crawl")
+    add.add_argument("--crawl", action="append", dest="crawls",
+                     help="Crawl id, repeatable (default: CC-MAIN-2025-30)")
+    add.add_argument("--subset", default="warc", help="ccindex subset (default: warc)")
+    domains = add.add_mutually_exclusive_group()
+    domains.add_argument("--domains-file", help="Local domain list, uploaded once for these jobs")
+    domains.add_argument("--domains-location",
+                         help="S3 prefix of a domain CSV (header 'domain'; default: domains_location from the config)")
+    add.add_argument("--format", dest="export_format", choices=["json", "parquet"], default="json")
+    add.add_argument("--compression", choices=["ZSTD", "SNAPPY", "GZIP"])
+    add.add_argument("--shards", type=int, default=1, help="Hash shards per job, each its own UNLOAD")
+    add.add_argument("--max-per-domain", type=int, help="At most N pages per registered domain")
+    add.add_argument("--domain-order", choices=sorted(DOMAIN_ORDERS), default="shortest-url")
+    add.add_argument("--sample-heavy-domains", type=float, metavar="RATE",
+                     help="Keep this fraction (0-1) of URLs in heavy domains")
+    add.add_argument("--heavy-domain-pages", type=int, default=10000)
+    add.add_argument("--no-tld-pushdown", action="store_true")
+    add.add_argument("--order-by-urlkey", action="store_true")
+    add.add_argument("--delta-from", metavar="PREVIOUS_CRAWL",
+                     help="Only URLs new or changed since this crawl")
+    add.add_argument("--tombstones", action="store_true",
+                     help="--delta-from: also export URLs the previous crawl had and this one did not see")
+
+    run = commands.add_parser("run", help="Run queued jobs and resume interrupted ones")
+    run.add_argument("jobs", nargs="*", help="Only these job ids (default: all queued/running)")
+    run.add_argument("--max-in-flight", type=int, default=20,
+                     help="Queries in flight across all jobs (default: 20, the default workgroup quota)")
+    run.add_argument("--max-attempts", type=int, default=3, help="Attempts per query before its job fails")
+    run.add_argument("--partition-projection", action="store_true",
+                     help="Define ccindex with partition projection instead of adding crawl partitions")
+    run.add_argument("--no-schema-cache", action="store_true", help="Ignore .cache/schema.json")
+    run.add_argument("--recreate-ccindex", action="store_true",
+                     help="Drop and recreate ccindex if its definition changed (drops every crawl's partitions)")
+    run.add_argument("--metrics-log", default="logs/query_metrics.jsonl",
+                     help="JSONL file receiving one metrics record per query")
+
+    listing = commands.add_parser("list", help="List jobs")
+    listing.add_argument("--state", choices=JOB_STATES, help="Only jobs in this state")
+
+    show = commands.add_parser("show", help="Print a job, its steps and result as JSON")
+    show.add_argument("job_id")
+
+    retry = commands.add_parser("retry", help="Queue failed jobs again (finished steps are kept)")
+    retry.add_argument("job_ids", nargs="+")
+    return parser.parse_args(argv)
+
+
+def load_config():
+    with open("src/config/aws_config.json", "r") as f:
+        return json.load(f)
+
+
+def upload_domain_file(s3, bucket_name, path):
+    """Upload a normalized copy of a local domain list; returns its S3 prefix"""
+    domains = sorted(set(iter_domain_file(path)))
+    key_prefix = f"jobs/domains/{uuid.uuid4().hex[:12]}/"
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "domains.csv")
+        write_domain_csv(domains, csv_path)
+        s3.upload_file(csv_path, bucket_name, f"{key_prefix}domains.csv")
+    print(f"📤 Uploaded {len(domains):,} domains from {path} to s3://{bucket_name}/{key_prefix}")
+    return f"s3://{bucket_name}/{key_prefix}"
+
+
+def add_jobs(args, store):
+    config = load_config()
+    if args.sample_heavy_domains is not None and not 0 < args.sample_heavy_domains <= 1:
+        raise SystemExit("--sample-heavy-domains must be in (0, 1]")
+    if args.tombstones and not args.delta_from:
+        raise SystemExit("--tombstones needs --delta-from")
+    if args.domains_file:
+        s3 = get_client("s3", config["region"])
+        domains_location = upload_domain_file(s3, config["bucket_name"], args.domains_file)
+    else:
+        domains_location = (args.domains_location or config["domains_location"]).rstrip("/") + "/"
+
+    for crawl_id in args.crawls or ["CC-MAIN-2025-30"]:
+        spec = {
+            "crawl_id": crawl_id,
+            "subset": args.subset,
+            "domains_location": domains_location,
+            "results_location": config["results_location"].rstrip("/") + "/",
+            "export_format": args.export_format,
+            "compression": args.compression,
+            "shards": args.shards,
+            "tld_pushdown": not args.no_tld_pushdown,
+            "order_by_urlkey": args.order_by_urlkey,
+            "delta_from": args.delta_from,
+            "tombstones": args.tombstones,
+        }
+        if args.max_per_domain or args.sample_heavy_domains:
+            spec["domain_limits"] = {
+                "max_per_domain": args.max_per_domain,
+                "order": args.domain_order,
+                "sample_rate": args.sample_heavy_domains,
+                "heavy_pages": args.heavy_domain_pages,
+            }
+        job_id = store.add(spec)
+        print(f"⏳ Queued job {job_id}: {crawl_id}, {args.export_format}, {args.shards} shard(s), "
+              f"domains {domains_location}")
+    return 0
+
+
+def run_jobs(args, store):
+    config = load_config()
+    metrics = MetricsRecorder(args.metrics_log)
+    client = AthenaClient(region=config["region"], metrics=metrics)
+    scheduler = ExportScheduler(
+        client, store, config["athena_results_location"],
+        max_in_flight=args.max_in_flight,
+        max_attempts=args.max_attempts,
+        partition_projection=args.partition_projection,
+        schema_cache_path=SCHEMA_CACHE_PATH,
+        use_schema_cache=not args.no_schema_cache,
+        recreate_ccindex=args.recreate_ccindex,
+    )
+    try:
+        summary = scheduler.run(args.jobs)
+    except KeyboardInterrupt:
+        print("\n🛑 Interrupted; queries cancelled. Run again to resume the jobs")
+        return 130
+
+    if not summary["succeeded"] and not summary["failed"]:
+        print("🎉 No queued jobs")
+        return 0
+    print(f"\n🎉 {len(summary['succeeded'])} job(s) succeeded, {len(summary['failed'])} failed "
+          f"in {summary['elapsed_s']:.1f}s")
+    print(f"📈 Peak queries in flight: {summary['peak_in_flight']}, throttled {summary['throttles']} time(s), "
+          f"final limit {summary['final_limit']}")
+    print(f"📈 Query metrics: {args.metrics_log} (run_id {metrics.run_id})")
+    return 1 if summary["failed"] else 0
+
+
+def list_jobs(args, store):
+    jobs = store.jobs(states=[args.state] if args.state else None)
+    if not jobs:
+        print("No jobs")
+        return 0
+    for job in jobs:
+        spec = job["spec"]
+        phase = PHASES[job["phase"]] if job["phase"] < len(PHASES) else "done"
+        created = time.strftime("%Y-%m-%d %H:%M", time.localtime(job["created"]))
+        print(f"{STATE_ICONS.get(job['state'], '?')} {job['id']}  {job['state']:<9} {created}  "
+              f"{spec['crawl_id']}  {spec['export_format']} x{spec.get('shards', 1)}  phase={phase}")
+        if job["result"]:
+            print(f"      📁 {job['result']['output_location']}")
+        if job["error"]:
+            print(f"      ❌ {job['error']}")
+    return 0
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    store = JobStore(args.store)
+    if args.command == "add":
+        return add_jobs(args, store)
+    if args.command == "run":
+        return run_jobs(args, store)
+    if args.command == "list":
+        return list_jobs(args, store)
+    if args.command == "show":
+        job = store.get(args.job_id)
+        if job is None:
+            print(f"❌ No job {args.job_id}")
+            return 1
+        job["steps"] = store.steps(args.job_id)
+        print(json.dumps(job, indent=2))
+        return 0
+    for job_id in args.job_ids:
+        job = store.get(job_id)
+        if job is None or job["state"] != "failed":
+            print(f"⚠️ {job_id}: not a failed job, skipped")
+            continue
+        store.retry(job_id)
+        print(f"⏳ Re-queued {job_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
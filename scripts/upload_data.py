@@ -1,21 +1,119 @@
 #!/usr/bin/env python3
 """
 Upload domain CSV data to S3
+
+--format parquet ingests domain lists of any size instead: streams the input
+files, normalizes like the domains_norm view, dedupes, writes hash-sharded
+Parquet files and uploads them in parallel (multipart for large shards) to
+s3://<bucket>/domains-parquet/<run_id>/. run_cc_query.py then builds
+domains_norm on that table instead of re-parsing the CSV on every query.
 """
 
 import sys
 import os
 import json
-import boto3
-from botocore.exceptions import ClientError
-from dotenv import load_dotenv
+import time
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-# Load environment variables
-load_dotenv()
+from src.aws.clients import get_client  # noqa: E402
+from src.cdx.ingest import build_domain_shards  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Upload a domain list to S3")
+    parser.add_argument("inputs", nargs="*", default=["data/sample.csv"],
+                        help="Domain files: CSV with a 'domain' column or one domain per line, .gz ok "
+                             "(default: data/sample.csv; --format csv uploads the first one)")
+    parser.add_argument("--format", dest="upload_format", choices=["csv", "parquet"], default="csv",
+                        help="csv: upload data/sample.csv as-is (default); "
+                             "parquet: normalize, dedupe and shard the inputs")
+    parser.add_argument("--shards", type=int, default=16,
+                        help="Parquet shards; each is deduped in memory, so raise this for huge lists")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Parallel shard uploads")
+    return parser.parse_args(argv)
+
+
+def load_config(config_path):
+    if not os.path.exists(config_path):
+        print("❌ Configuration file not found. Run setup first.")
+        return None
+    with open(config_path, 'r') as f:
+        return json.load(f)
+
+
+def upload_domain_parquet(args):
+    from botocore.exceptions import ClientError
+    config_path = 'src/config/aws_config.json'
+    config = load_config(config_path)
+    if config is None:
+        return 1
+
+    bucket_name = config['bucket_name']
+    region = config['region']
+
+    missing = [path for path in args.inputs if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Input file(s) not found: {', '.join(missing)}")
+        return 1
+
+    # A fresh prefix per upload: the table location changes, so run_cc_query.py
+    # recreates domains_parquet and no query ever sees a half-replaced list
+    run_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    prefix = f"domains-parquet/{run_id}/"
+    from boto3.s3.transfer import TransferConfig
+    transfer = TransferConfig(multipart_threshold=16 * 1024 * 1024,
+                              multipart_chunksize=16 * 1024 * 1024,
+                              max_concurrency=4)
+    # Every parallel upload runs up to max_concurrency part uploads at once
+    s3 = get_client('s3', region, max_pool_connections=args.workers * transfer.max_concurrency)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.time()
+            print(f"🧹 Normalizing and deduplicating {len(args.inputs)} file(s) into {args.shards} shards...")
+            result = build_domain_shards(args.inputs, tmp, num_shards=args.shards)
+            print(f"   ✅ {result['rows']:,} rows -> {result['domains']:,} unique domains "
+                  f"in {len(result['files'])} file(s) ({time.time() - start:.1f}s)")
+            if not result['files']:
+                print("❌ No domains found in the input files")
+                return 1
+
+            def upload(path):
+                s3.upload_file(path, bucket_name, prefix + os.path.basename(path), Config=transfer)
+                return os.path.getsize(path)
+
+            print(f"📤 Uploading to s3://{bucket_name}/{prefix} ({args.workers} in parallel)")
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                total_bytes = sum(pool.map(upload, result['files']))
+            print(f"✅ Upload complete! {len(result['files'])} file(s), {total_bytes / 1024 / 1024:.1f} MB")
+
+    except ClientError as e:
+        print(f"❌ Upload failed: {e}")
+        return 1
+
+    config['domains_parquet_location'] = f"s3://{bucket_name}/{prefix}"
+    config['uploaded_domains'] = {
+        'local_paths': args.inputs,
+        'rows': result['rows'],
+        'domains': result['domains'],
+        'shards': args.shards,
+        's3_url': f"s3://{bucket_name}/{prefix}",
+    }
+    with open(config_path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+    print(f"File location: s3://{bucket_name}/{prefix}")
+    print("💾 Configuration updated (run_cc_query.py now reads domains from Parquet)")
+    return 0
+
 
-def upload_domain_csv():
+def upload_domain_csv(csv_file='data/sample.csv'):
+    from botocore.exceptions import ClientError
     # Load configuration
     config_path = 'src/config/aws_config.json'
     if not os.path.exists(config_path):
@@ -29,12 +127,11 @@ def upload_domain_csv():
     region = config['region']
     
     # Find CSV file
-    csv_file = 'data/sample.csv'
     if not os.path.exists(csv_file):
         print(f"❌ CSV file not found: {csv_file}")
         return 1
     
-    s3 = boto3.client('s3', region_name=region)
+    s3 = get_client('s3', region)
     
     try:
         # Upload CSV file
@@ -51,7 +148,8 @@ def upload_domain_csv():
         print(f"✅ Upload complete!")
         print(f"File location: s3://{bucket_name}/{s3_key}")
         
-        # Update config with uploaded file info
+        # Update config with uploaded file info; the CSV is the domain source again
+        config.pop('domains_parquet_location', None)
         config['uploaded_csv'] = {
             'local_path': csv_file,
             's3_bucket': bucket_name,
@@ -70,11 +168,14 @@ def upload_domain_csv():
     
     return 0
 
-def main():
+def main(argv=None):
+    args = parse_args(argv)
     print("📤 Upload Domain CSV to S3")
     print("=" * 30)
     
-    return upload_domain_csv()
+    if args.upload_format == "parquet":
+        return upload_domain_parquet(args)
+    return upload_domain_csv(args.inputs[0])
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
@@ -1,32 +1,213 @@
-import boto3
+import csv
+import io
 import time
 import json
+import queue
+import random
+import re
+import threading
+from datetime import date, datetime
+from decimal import Decimal
 from botocore.exceptions import ClientError
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from src.aws.clients import get_client
+from src.aws.metrics import query_cost, query_metrics
+from src.aws.result_cache import cache_key, normalize_sql
+
+# Athena ColumnInfo type -> Python decoder (anything else stays a string)
+COLUMN_DECODERS = {
+    'tinyint': int,
+    'smallint': int,
+    'integer': int,
+    'bigint': int,
+    'double': float,
+    'float': float,
+    'real': float,
+    'decimal': Decimal,
+    'boolean': lambda v: v.lower() == 'true',
+    'date': date.fromisoformat,
+    'timestamp': lambda v: datetime.fromisoformat(v.replace(' UTC', '')),
+}
+
+
+def decode_value(value, column_type):
+    """Decode one Athena result value using its ColumnInfo type (None stays None)"""
+    if value is None:
+        return None
+    decoder = COLUMN_DECODERS.get(column_type.lower())
+    if decoder is None:
+        return value
+    try:
+        return decoder(value)
+    except ValueError:
+        return value
+
+
+class ScanBudgetExceeded(Exception):
+    """A query (or the run as a whole) was stopped for scanning more than its budget"""
+
 
 class AthenaClient:
-    def __init__(self, region='us-east-1', workgroup='primary'):
-        self.athena = boto3.client('athena', region_name=region)
-        self.s3 = boto3.client('s3', region_name=region)
+    def __init__(self, region='us-east-1', workgroup='primary',
+                 poll_initial=0.25, poll_max=5.0, poll_backoff=1.5, poll_jitter=0.2,
+                 result_cache=None, result_reuse_minutes=None, metrics=None,
+                 query_scan_limit=None, run_scan_limit=None, engine=None, s3=None):
+        # `engine` replaces the Athena client: any object with the Athena calls
+        # used below (start/get/batch_get/stop_query_execution, get_query_results,
+        # list_table_metadata), e.g. the offline DuckDBEngine
+        # (src/aws/duckdb_engine.py) with a LocalS3 (src/aws/local_s3.py) as `s3`.
+        # Real clients come from the shared cache (src/aws/clients.py); S3 is
+        # only created once something reads results or clears a prefix
+        self.region = region
+        self.athena = engine or get_client('athena', region)
+        self._s3 = s3
         self.workgroup = workgroup
+
+        # Caching (opt-in per query via cache_inputs): a local ResultCache
+        # (src/aws/result_cache.py) and Athena's own query result reuse
+        self.result_cache = result_cache
+        self.result_reuse_minutes = result_reuse_minutes
+
+        # Optional MetricsRecorder (src/aws/metrics.py): one record per finished
+        # execution. A retry is another execution of the same statement, so
+        # executions are counted per normalized SQL (re-attaching to the same
+        # execution, e.g. through a repeated ClientRequestToken, is not one)
+        self.metrics = metrics
+        self.statement_runs = {}  # statement key -> execution ids, in order
+
+        # Scan budgets (bytes, None = unlimited). DataScannedInBytes is read on
+        # every poll; a query whose projected scan at the next poll would pass
+        # the per-query budget is stopped right away (and fails like any other
+        # query), passing the per-run budget stops every query of the run
+        self.query_scan_limit = query_scan_limit
+        self.run_scan_limit = run_scan_limit
+        self.scanned = {}  # execution_id -> (sample time, bytes scanned so far)
+        self.budget_stops = {}  # execution_id -> why it was stopped
+        self.active = set()  # started, not yet finished (cancelled on Ctrl-C)
+
+        # Polling strategy: start with sub-second polls (DDL and metadata queries
+        # usually finish in ~1s), back off exponentially up to poll_max, with jitter
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.poll_backoff = poll_backoff
+        self.poll_jitter = poll_jitter
         
-    def execute_query(self, query, output_location, wait_for_completion=True):
-        """Execute Athena query and optionally wait for completion"""
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = get_client('s3', self.region)
+        return self._s3
+
+    def query_label(self, query, label=None):
+        """Label for metrics: the caller's, else the statement's first words and a hash of it"""
+        return label or f"{' '.join(normalize_sql(query).split()[:3])[:60]} #{cache_key(query)[:8]}"
+
+    def record_metrics(self, execution, label, cached=False):
+        if self.metrics is None:
+            return None
+        retries = 0
+        if not cached:
+            runs = self.statement_runs.setdefault(cache_key(execution.get('Query') or execution['QueryExecutionId']), [])
+            if execution['QueryExecutionId'] not in runs:
+                runs.append(execution['QueryExecutionId'])
+            retries = runs.index(execution['QueryExecutionId'])
+        return self.metrics.record(query_metrics(execution, label, retries, cached))
+
+    def run_scanned_bytes(self):
+        return sum(scanned for _, scanned in self.scanned.values())
+
+    def check_scan_budget(self, execution, next_poll_s):
+        """Stop `execution` if its projected scan at the next poll is over budget"""
+        execution_id = execution['QueryExecutionId']
+        scanned = execution.get('Statistics', {}).get('DataScannedInBytes', 0)
+        now = time.time()
+        last_time, last_scanned = self.scanned.get(execution_id, (now, 0))
+        self.scanned[execution_id] = (now, scanned)
+        if execution['Status']['State'] in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+            self.active.discard(execution_id)
+            return
+
+        rate = (scanned - last_scanned) / (now - last_time) if now > last_time else 0.0
+        projected_growth = rate * next_poll_s
+        if self.query_scan_limit is not None and scanned + projected_growth > self.query_scan_limit:
+            reason = (f"query {execution_id} scanned {scanned / 1024**3:.2f} GB "
+                      f"(projected {(scanned + projected_growth) / 1024**3:.2f} GB), "
+                      f"budget {self.query_scan_limit / 1024**3:.2f} GB")
+            print(f"🛑 Scan budget exceeded: {reason}; stopping the query")
+            self.budget_stops[execution_id] = f"Scan budget exceeded: {reason}"
+            self.stop_query(execution_id)
+        elif self.run_scan_limit is not None and self.run_scanned_bytes() + projected_growth > self.run_scan_limit:
+            reason = (f"run scanned {self.run_scanned_bytes() / 1024**3:.2f} GB "
+                      f"(projected {(self.run_scanned_bytes() + projected_growth) / 1024**3:.2f} GB), "
+                      f"budget {self.run_scan_limit / 1024**3:.2f} GB")
+            print(f"🛑 Scan budget exceeded: {reason}; stopping")
+            self.cancel_all()
+            raise ScanBudgetExceeded(f"Scan budget exceeded: {reason}")
+
+    def failure_reason(self, execution):
+        """Why a FAILED/CANCELLED execution ended (the scan budget if we stopped it)"""
+        return (self.budget_stops.get(execution['QueryExecutionId'])
+                or execution['Status'].get('StateChangeReason', 'Unknown error'))
+
+    def stop_query(self, execution_id):
+        try:
+            self.athena.stop_query_execution(QueryExecutionId=execution_id)
+            print(f"🛑 Cancelled query {execution_id}")
+        except ClientError as e:
+            print(f"⚠️ Could not cancel {execution_id}: {e}")
+        self.active.discard(execution_id)
+
+    def cancel_all(self):
+        """Stop every query this client started that has not finished yet"""
+        for execution_id in list(self.active):
+            self.stop_query(execution_id)
+
+    def execute_query(self, query, output_location, wait_for_completion=True, cache_inputs=None,
+                      label=None):
+        """Execute Athena query and optionally wait for completion.
+
+        Passing `cache_inputs` (fingerprints of everything the query reads,
+        e.g. S3 ETags and the crawl id) marks the query as cacheable: a
+        previous successful execution with the same normalized SQL and inputs
+        is returned without running it, and SELECTs may reuse Athena results.
+        """
+        label = self.query_label(query, label)
+        key = None
+        if self.result_cache is not None and cache_inputs is not None and wait_for_completion:
+            key = cache_key(query, cache_inputs)
+            cached = self.result_cache.get_execution(key)
+            if cached is not None:
+                print(f"♻️  Cached result: {cached['QueryExecution']['QueryExecutionId']}")
+                self.record_metrics(cached['QueryExecution'], label, cached=True)
+                return cached
+
+        if self.run_scan_limit is not None and self.run_scanned_bytes() >= self.run_scan_limit:
+            raise ScanBudgetExceeded(
+                f"Scan budget exceeded: run already scanned {self.run_scanned_bytes() / 1024**3:.2f} GB")
+
+        kwargs = {}
+        if (cache_inputs is not None and self.result_reuse_minutes
+                and re.match(r'\s*(SELECT|WITH)\b', query, re.IGNORECASE)):
+            kwargs['ResultReuseConfiguration'] = {'ResultReuseByAgeConfiguration': {
+                'Enabled': True, 'MaxAgeInMinutes': self.result_reuse_minutes}}
+
         try:
             response = self.athena.start_query_execution(
                 QueryString=query,
                 ResultConfiguration={'OutputLocation': output_location},
-                WorkGroup=self.workgroup
+                WorkGroup=self.workgroup,
+                **kwargs
             )
             
             execution_id = response['QueryExecutionId']
+            self.active.add(execution_id)
             print(f"🚀 Started query execution: {execution_id}")
             
             if wait_for_completion:
-                return self.wait_for_query_completion(execution_id)
+                response = self.wait_for_query_completion(execution_id, label=label)
+                if key is not None:
+                    self.result_cache.put_execution(key, response)
+                return response
             else:
                 return execution_id
                 
@@ -34,58 +215,247 @@ class AthenaClient:
             print(f"❌ Error executing query: {e}")
             raise
     
-    def wait_for_query_completion(self, execution_id, max_wait_minutes=45):
-        """Wait for query to complete with timeout"""
+    def execute_many(self, queries, output_location, max_concurrent=20,
+                     max_wait_minutes=45, raise_on_failure=True, label_prefix=''):
+        """Execute several queries concurrently, yielding (key, response) as each completes.
+
+        `queries` is a dict of key -> SQL (or a list, keyed by index). At most
+        `max_concurrent` queries are in flight at once so we stay under the
+        workgroup's active query quota; all of them are tracked with a single
+        batch_get_query_execution poll loop. Metrics are labelled
+        `label_prefix` + key. If a query fails (with raise_on_failure), the
+        wait times out or the caller stops iterating, the queries still in
+        flight are stopped; queued ones are never started.
+        """
+        if not isinstance(queries, dict):
+            queries = dict(enumerate(queries))
+        pending = list(queries.items())
+        in_flight = {}  # execution_id -> key
+        start_time = time.time()
+        max_wait_seconds = max_wait_minutes * 60
+        interval = self.poll_initial
+
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < max_concurrent:
+                    key, query = pending.pop(0)
+                    execution_id = self.execute_query(query, output_location, wait_for_completion=False,
+                                                      label=f"{label_prefix}{key}")
+                    in_flight[execution_id] = key
+                    interval = self.poll_initial
+
+                if time.time() - start_time > max_wait_seconds:
+                    print(f"⏰ Queries timed out after {max_wait_minutes} minutes")
+                    raise Exception(f"Queries timed out after {max_wait_minutes} minutes: {list(in_flight.values())}")
+
+                sleep_s, interval = self.next_poll_interval(interval)
+                try:
+                    time.sleep(sleep_s)
+                except KeyboardInterrupt:
+                    self.cancel_all()
+                    raise
+
+                ids = list(in_flight)
+                for i in range(0, len(ids), 50):  # API limit: 50 ids per call
+                    response = self.athena.batch_get_query_execution(QueryExecutionIds=ids[i:i + 50])
+                    for execution in response['QueryExecutions']:
+                        self.check_scan_budget(execution, interval)
+                        status = execution['Status']['State']
+                        if status not in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+                            continue
+                        key = in_flight.pop(execution['QueryExecutionId'])
+                        self.record_metrics(execution, f"{label_prefix}{key}")
+                        if status == 'SUCCEEDED':
+                            print(f"✅ Query {key} completed")
+                        else:
+                            error_reason = self.failure_reason(execution)
+                            print(f"❌ Query {key} failed: {error_reason}")
+                            if raise_on_failure:
+                                raise Exception(f"Query {key} failed: {error_reason}")
+                        yield key, {'QueryExecution': execution}
+        finally:
+            # Raised (a failed query, the timeout) or abandoned by the caller: the
+            # queries still running would otherwise keep scanning unmanaged
+            for execution_id in in_flight:
+                if execution_id in self.active:  # not already cancelled (Ctrl-C, run budget)
+                    self.stop_query(execution_id)
+
+    def next_poll_interval(self, interval):
+        """Return the sleep for this poll (with jitter) and the next base interval"""
+        sleep_s = interval * random.uniform(1 - self.poll_jitter, 1 + self.poll_jitter)
+        return sleep_s, min(interval * self.poll_backoff, self.poll_max)
+
+    @staticmethod
+    def get_query_timings(response):
+        """Extract Athena-reported timings (seconds) from a get_query_execution response"""
+        stats = response['QueryExecution'].get('Statistics', {})
+        fields = {
+            'queue': 'QueryQueueTimeInMillis',
+            'planning': 'QueryPlanningTimeInMillis',
+            'engine': 'EngineExecutionTimeInMillis',
+            'service_processing': 'ServiceProcessingTimeInMillis',
+            'total': 'TotalExecutionTimeInMillis',
+        }
+        return {name: stats.get(key, 0) / 1000.0 for name, key in fields.items()}
+
+    def wait_for_query_completion(self, execution_id, max_wait_minutes=45, label=None):
+        """Wait for query to complete with timeout, polling with capped exponential backoff"""
         start_time = time.time()
         max_wait_seconds = max_wait_minutes * 60
+        interval = self.poll_initial
+        last_status = None
+        last_report = start_time
         
         while time.time() - start_time < max_wait_seconds:
             response = self.athena.get_query_execution(QueryExecutionId=execution_id)
+            self.check_scan_budget(response['QueryExecution'], interval)
             status = response['QueryExecution']['Status']['State']
             
+            if status in ['SUCCEEDED', 'FAILED', 'CANCELLED']:
+                self.record_metrics(response['QueryExecution'], label or execution_id)
+
             if status == 'SUCCEEDED':
-                execution_time = time.time() - start_time
                 data_scanned = response['QueryExecution']['Statistics'].get('DataScannedInBytes', 0)
-                cost_estimate = (data_scanned / (1024**4)) * 5  # $5 per TB
+                cost_estimate = query_cost(data_scanned)
+                timings = self.get_query_timings(response)
                 
                 print(f"✅ Query completed successfully")
-                print(f"⏱️  Execution time: {execution_time:.1f} seconds")
+                print(f"⏱️  Execution time: {timings['total']:.1f} seconds "
+                      f"(queue {timings['queue']:.2f}s, planning {timings['planning']:.2f}s, "
+                      f"engine {timings['engine']:.2f}s, service {timings['service_processing']:.2f}s)")
                 print(f"📊 Data scanned: {data_scanned / (1024**3):.2f} GB")
                 print(f"💰 Estimated cost: ${cost_estimate:.2f}")
                 
                 return response
                 
             elif status in ['FAILED', 'CANCELLED']:
-                error_reason = response['QueryExecution']['Status'].get('StateChangeReason', 'Unknown error')
+                error_reason = self.failure_reason(response['QueryExecution'])
                 print(f"❌ Query failed: {error_reason}")
                 raise Exception(f"Query failed: {error_reason}")
                 
             else:
-                elapsed = time.time() - start_time
-                print(f"⏳ Query running... ({elapsed:.0f}s elapsed, status: {status})")
-                time.sleep(30)
+                # Report on state changes and then every ~30s, not on every fast poll
+                now = time.time()
+                if status != last_status or now - last_report >= 30:
+                    print(f"⏳ Query running... ({now - start_time:.0f}s elapsed, status: {status})")
+                    last_status = status
+                    last_report = now
+                sleep_s, interval = self.next_poll_interval(interval)
+                try:
+                    time.sleep(min(sleep_s, max(0.0, max_wait_seconds - (now - start_time))))
+                except KeyboardInterrupt:
+                    self.cancel_all()
+                    raise
         
         print(f"⏰ Query timed out after {max_wait_minutes} minutes")
         raise Exception(f"Query timed out after {max_wait_minutes} minutes")
     
-    def get_query_results(self, execution_id, max_results=100):
-        """Get query results"""
+    def get_query_results(self, execution_id, max_results=None):
+        """Get query results as {'columns', 'rows'} (all rows unless max_results is set)"""
+        if self.result_cache is not None:
+            cached = self.result_cache.get_result(execution_id)
+            if cached is not None:
+                if max_results is not None:
+                    return {'columns': cached['columns'], 'rows': cached['rows'][:max_results]}
+                return cached
+
+        rows = []
+        if max_results != 0:
+            for row in self.iter_query_results(execution_id):
+                rows.append(row)
+                if max_results is not None and len(rows) >= max_results:
+                    break
+        if rows:
+            columns = list(rows[0])
+        else:
+            columns = [col['Name'] for col in self.get_result_columns(execution_id)]
+        result = {'columns': columns, 'rows': rows}
+        if self.result_cache is not None and max_results is None:
+            self.result_cache.put_result(execution_id, result)
+        return result
+
+    def get_result_columns(self, execution_id):
+        """ColumnInfo (name/type) for a finished query"""
+        response = self.athena.get_query_results(QueryExecutionId=execution_id, MaxResults=1)
+        return response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+
+    def iter_query_results(self, execution_id, page_size=1000, prefetch=2, from_s3=False):
+        """Yield every result row as a dict, decoded by column type.
+
+        Pages are fetched by a background thread (up to `prefetch` pages ahead)
+        and follow NextToken to the end of the result set. With from_s3=True the
+        result CSV is streamed straight from the query's OutputLocation instead,
+        which is much faster for large results.
+        """
+        if from_s3:
+            yield from self.iter_s3_query_results(execution_id)
+            return
+
+        pages = queue.Queue(maxsize=max(1, prefetch))
+        stop = threading.Event()
+
+        def offer(item):
+            # Block while the consumer is behind, but give up once it has gone away
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def fetch_pages():
+            try:
+                kwargs = {'QueryExecutionId': execution_id, 'MaxResults': page_size}
+                while not stop.is_set():
+                    response = self.athena.get_query_results(**kwargs)
+                    offer(response)
+                    if 'NextToken' not in response:
+                        break
+                    kwargs['NextToken'] = response['NextToken']
+            except ClientError as e:
+                print(f"❌ Error getting query results: {e}")
+                offer(e)
+            finally:
+                offer(None)
+
+        fetcher = threading.Thread(target=fetch_pages, daemon=True)
+        fetcher.start()
         try:
-            response = self.athena.get_query_results(
-                QueryExecutionId=execution_id,
-                MaxResults=max_results
-            )
-            
-            columns = [col['Name'] for col in response['ResultSet']['ResultSetMetadata']['ColumnInfo']]
-            rows = []
-            
-            for row in response['ResultSet']['Rows'][1:]:  # Skip header
-                row_data = [col.get('VarCharValue', '') for col in row['Data']]
-                rows.append(dict(zip(columns, row_data)))
-            
-            return {'columns': columns, 'rows': rows}
-            
-        except ClientError as e:
-            print(f"❌ Error getting query results: {e}")
-            raise
-    
+            first_page = True
+            while True:
+                response = pages.get()
+                if response is None:
+                    break
+                if isinstance(response, Exception):
+                    raise response
+
+                column_info = response['ResultSet']['ResultSetMetadata']['ColumnInfo']
+                columns = [col['Name'] for col in column_info]
+                types = [col['Type'] for col in column_info]
+                rows = response['ResultSet']['Rows']
+                if first_page and rows and [c.get('VarCharValue') for c in rows[0]['Data']] == columns:
+                    rows = rows[1:]  # Skip header
+                first_page = False
+
+                for row in rows:
+                    values = [col.get('VarCharValue') for col in row['Data']]
+                    yield {name: decode_value(value, col_type)
+                           for name, value, col_type in zip(columns, values, types)}
+        finally:
+            stop.set()
+
+    def iter_s3_query_results(self, execution_id):
+        """Stream result rows from the query's CSV OutputLocation in S3"""
+        response = self.athena.get_query_execution(QueryExecutionId=execution_id)
+        output_location = response['QueryExecution']['ResultConfiguration']['OutputLocation']
+        bucket, _, key = output_location[len('s3://'):].partition('/')
+        types = {col['Name']: col['Type'] for col in self.get_result_columns(execution_id)}
+
+        body = self.s3.get_object(Bucket=bucket, Key=key)['Body']
+        reader = csv.reader(io.TextIOWrapper(body, encoding='utf-8', newline=''))
+        columns = next(reader, [])
+        for values in reader:
+            # The CSV cannot tell NULL from '' so empty non-string values decode to None
+            yield {name: decode_value(value if value != '' or types.get(name) == 'varchar' else None,
+                                      types.get(name, 'varchar'))
+                   for name, value in zip(columns, values)}
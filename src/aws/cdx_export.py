@@ -0,0 +1,500 @@
+"""
+CDX export query building and sharded UNLOAD execution.
+
+Sharding splits default.domains_norm by a stable hash of the normalized domain
+(crc32, identical in Athena and Python's zlib), so each shard is an independent
+UNLOAD into <out_prefix>shard=NN/ that can be retried on its own.
+
+Deduplication by content digest is not per shard: every shard ranks the
+captures of the whole domain list and then keeps its own domains' survivors,
+so a digest shared by domains in different shards is still exported once.
+Each shard therefore does the full join and window; shards buy independent
+retries and smaller UNLOADs, not less work.
+"""
+
+import hashlib
+import json
+import time
+import zlib
+
+EXPORT_TYPE = 'cdx_unique_200_latest_html'
+MANIFEST_NAME = '_manifest.json'
+# Beyond this many TLDs an IN list prunes too little to be worth it
+MAX_TLD_PREDICATE = 100
+# Orderings for picking a domain's first N pages (columns of the ranked CTE)
+DOMAIN_ORDERS = {
+    'shortest-url': 'LENGTH(url), urlkey',
+    'latest': 'fetch_time DESC, urlkey',
+    'urlkey': 'urlkey',
+    'hash': 'crc32(to_utf8(urlkey)), urlkey',
+}
+SAMPLE_BUCKETS = 10000
+
+
+def domain_shard(domain_norm, num_shards):
+    """Shard number of a normalized domain; matches shard_predicate() in Athena"""
+    return zlib.crc32(domain_norm.encode('utf-8')) % num_shards
+
+
+def shard_predicate(column, shard, num_shards):
+    """SQL predicate selecting one hash shard of `column`"""
+    return f"crc32(to_utf8({column})) % {num_shards} = {shard}"
+
+
+def build_tlds_sql(domains_table='default.domains_norm'):
+    """Distinct TLDs of the domain list: the last label, as stored in ccindex.url_host_tld"""
+    return f"""
+        SELECT DISTINCT regexp_extract(domain_norm, '[^.]+$') AS tld
+        FROM {domains_table}
+        """
+
+
+def tld_predicate(tlds, alias='cc'):
+    """url_host_tld IN (...) for a small TLD set, else '' (no pruning worth having)"""
+    tlds = sorted({t for t in tlds if t})
+    if not tlds or len(tlds) > MAX_TLD_PREDICATE:
+        return ""
+    values = ", ".join("'" + t.replace("'", "''") + "'" for t in tlds)
+    return f"\n              AND {alias}.url_host_tld IN ({values})"
+
+
+def ccindex_filters(crawl_id, subset, tlds=None, alias='cc'):
+    """Captures the export considers: one crawl partition, HTTP 200 HTML with a digest"""
+    return f"""{alias}.crawl  = '{crawl_id}'
+              AND {alias}.subset = '{subset}'
+              AND {alias}.fetch_status = 200
+              AND {alias}.content_mime_detected = 'text/html'
+              AND {alias}.content_digest IS NOT NULL
+              AND {alias}.url IS NOT NULL{tld_predicate(tlds or (), alias)}"""
+
+
+def json_string(column):
+    """SQL for a column as a quoted JSON string ('' for NULL), escaped by the engine"""
+    return f"json_format(CAST(COALESCE({column}, '') AS JSON))"
+
+
+def build_domain_limits(domain_limits):
+    """Extra CTEs capping/sampling pages per domain; returns (ctes, source, where).
+
+    `domain_limits` keys: max_per_domain (cap, top-N by `order`), order (a
+    DOMAIN_ORDERS key), sample_rate (keep this fraction of URLs, chosen by a
+    stable hash of the urlkey, in domains with more than heavy_pages pages).
+    """
+    max_per_domain = domain_limits.get('max_per_domain')
+    sample_rate = domain_limits.get('sample_rate')
+    if not max_per_domain and not sample_rate:
+        return "", "ranked", "rn = 1"
+
+    ctes = ""
+    source, where = "ranked", "rn = 1"
+    if sample_rate:
+        heavy_pages = domain_limits.get('heavy_pages', 10000)
+        kept_buckets = max(1, int(sample_rate * SAMPLE_BUCKETS))
+        ctes += f""",
+          sampled AS (
+            SELECT *
+            FROM (
+              SELECT *, COUNT(*) OVER (PARTITION BY domain) AS domain_pages
+              FROM ranked
+              WHERE rn = 1
+            )
+            WHERE domain_pages <= {heavy_pages}
+               OR crc32(to_utf8(urlkey)) % {SAMPLE_BUCKETS} < {kept_buckets}
+          )"""
+        source, where = "sampled", "TRUE"
+    if max_per_domain:
+        order_by = DOMAIN_ORDERS[domain_limits.get('order') or 'shortest-url']
+        ctes += f""",
+          capped AS (
+            SELECT *, ROW_NUMBER() OVER (
+                PARTITION BY domain
+                ORDER BY {order_by}
+              ) AS domain_rn
+            FROM {source}
+            WHERE {where}
+          )"""
+        source, where = "capped", f"domain_rn <= {int(max_per_domain)}"
+    return ctes, source, where
+
+
+def build_domains_source(shard=None, num_shards=None, domains_table='default.domains_norm'):
+    """Domain side of the export join, optionally restricted to one shard"""
+    if shard is None:
+        return domains_table
+    return (f"(SELECT domain_norm FROM {domains_table} "
+            f"WHERE {shard_predicate('domain_norm', shard, num_shards)})")
+
+
+def build_previous_ctes(previous_crawl, subset, domains_source, tlds=None):
+    """Delta CTE + join + predicate dropping captures whose (urlkey, digest) the previous crawl had"""
+    if not previous_crawl:
+        return "", "", ""
+    ctes = f"""
+            previous AS (
+              SELECT DISTINCT p.url_surtkey, p.content_digest
+              FROM default.ccindex p
+              JOIN {domains_source} pd
+                ON p.url_host_registered_domain = pd.domain_norm
+              WHERE {ccindex_filters(previous_crawl, subset, tlds, alias='p')}
+            ),"""
+    join = """
+            LEFT JOIN previous prev
+              ON prev.url_surtkey = cc.url_surtkey
+             AND prev.content_digest = cc.content_digest"""
+    return ctes, join, "\n              AND prev.url_surtkey IS NULL"
+
+
+def build_export_select(crawl_id, subset, shard=None, num_shards=None, export_format='json',
+                        domains_table='default.domains_norm', tlds=None, order_by_urlkey=False,
+                        domain_limits=None, previous_crawl=None):
+    """SELECT producing one record per latest capture of each content digest.
+
+    export_format='json' yields a single CDX JSON text column; 'parquet'
+    yields typed columns (integer offset/length/status, real timestamp).
+    `tlds` adds a url_host_tld predicate Athena can check against Parquet
+    row-group statistics before the join; `order_by_urlkey` sorts the
+    output in index (SURT) order. `domain_limits` bounds pages per domain
+    (see build_domain_limits). With `previous_crawl` only new or changed
+    URLs are kept: captures whose urlkey had the same digest in that crawl
+    are dropped before deduplication.
+
+    Deduplication always spans the whole domain list; a `shard` only
+    restricts which domains' surviving records it returns. Ties on
+    fetch_time are broken by WARC file and offset, so every shard ranks
+    the same capture first.
+    """
+    order_by = "\n          ORDER BY urlkey" if order_by_urlkey else ""
+    limit_ctes, source, where = build_domain_limits(domain_limits or {})
+    previous_ctes, previous_join, previous_where = build_previous_ctes(previous_crawl, subset,
+                                                                       domains_table, tlds)
+    shard_ctes = ""
+    if shard is not None:
+        shard_ctes = f""",
+          ranked AS (
+            SELECT *
+            FROM all_ranked
+            WHERE {shard_predicate('domain', shard, num_shards)}
+          )"""
+    ranked = f"""
+          WITH{previous_ctes} {'all_ranked' if shard_ctes else 'ranked'} AS (
+            SELECT
+              cc.url_surtkey                                         AS urlkey,
+              cc.fetch_time                                          AS fetch_time,
+              cc.url                                                 AS url,
+              cc.content_mime_type                                   AS mime,
+              cc.content_mime_detected                               AS mime_detected,
+              cc.fetch_status                                        AS status,
+              cc.content_digest                                      AS digest,
+              cc.warc_record_length                                  AS length,
+              cc.warc_record_offset                                  AS offset,
+              cc.warc_filename                                       AS filename,
+              cc.content_languages                                   AS languages,
+              cc.content_charset                                     AS encoding,
+              cc.url_host_registered_domain                          AS domain,
+              ROW_NUMBER() OVER (
+                PARTITION BY cc.content_digest
+                ORDER BY cc.fetch_time DESC, cc.warc_filename, cc.warc_record_offset
+              ) AS rn
+            FROM default.ccindex cc
+            JOIN {domains_table} d
+              ON cc.url_host_registered_domain = d.domain_norm{previous_join}
+            WHERE {ccindex_filters(crawl_id, subset, tlds)}{previous_where}
+          )""" + shard_ctes + limit_ctes
+
+    if export_format == 'parquet':
+        return ranked + f"""
+          SELECT
+            urlkey,
+            fetch_time                     AS timestamp,
+            url,
+            mime,
+            mime_detected,
+            CAST(status AS INTEGER)        AS status,
+            digest,
+            CAST(length AS INTEGER)        AS length,
+            CAST(offset AS BIGINT)         AS offset,
+            filename,
+            languages,
+            encoding,
+            domain
+          FROM {source}
+          WHERE {where}""" + order_by + """
+    """
+
+    # Text fields go through the engine's JSON encoder: URLs, MIME types and
+    # charsets can hold quotes, backslashes and control characters
+    return ranked + f"""
+          SELECT
+            CONCAT(
+              '{{',
+              '"urlkey":', {json_string('urlkey')}, ',',
+              '"timestamp":"', date_format(fetch_time, '%Y%m%d%H%i%s'), '",',
+              '"url":', {json_string('url')}, ',',
+              '"mime":', {json_string('mime')}, ',',
+              '"mime-detected":', {json_string('mime_detected')}, ',',
+              '"status":"', CAST(status AS VARCHAR), '",',
+              '"digest":', {json_string('digest')}, ',',
+              '"length":"', CAST(length AS VARCHAR), '",',
+              '"offset":"', CAST(offset AS VARCHAR), '",',
+              '"filename":', {json_string('filename')}, ',',
+              '"languages":', {json_string('languages')}, ',',
+              '"encoding":', {json_string('encoding')},
+              '}}'
+            ) AS cdx_record
+          FROM {source}
+          WHERE {where}""" + order_by + """
+    """
+
+
+def build_tombstones_select(crawl_id, previous_crawl, subset, export_format='json',
+                            domains_table='default.domains_norm', tlds=None):
+    """URLs exportable from `previous_crawl` with no exportable capture in `crawl_id`.
+
+    One record per urlkey with its last URL, digest and fetch time in the
+    previous crawl. Common Crawl does not revisit every URL, so this means
+    "not seen (as HTTP 200 HTML) this time", not necessarily deleted.
+    """
+    columns = """
+          SELECT
+            p.urlkey,
+            p.url,
+            p.digest,
+            p.fetch_time"""
+    if export_format == 'parquet':
+        select = columns + f""",
+            '{previous_crawl}' AS last_crawl"""
+    else:
+        select = f"""
+          SELECT
+            CONCAT(
+              '{{',
+              '"urlkey":', {json_string('p.urlkey')}, ',',
+              '"url":', {json_string('p.url')}, ',',
+              '"digest":', {json_string('p.digest')}, ',',
+              '"timestamp":"', date_format(p.fetch_time, '%Y%m%d%H%i%s'), '",',
+              '"last_crawl":"{previous_crawl}"',
+              '}}'
+            ) AS tombstone"""
+    return f"""
+          WITH previous_urls AS (
+            SELECT
+              cc.url_surtkey                           AS urlkey,
+              max_by(cc.url, cc.fetch_time)            AS url,
+              max_by(cc.content_digest, cc.fetch_time) AS digest,
+              MAX(cc.fetch_time)                       AS fetch_time
+            FROM default.ccindex cc
+            JOIN {domains_table} d
+              ON cc.url_host_registered_domain = d.domain_norm
+            WHERE {ccindex_filters(previous_crawl, subset, tlds)}
+            GROUP BY cc.url_surtkey
+          ),
+          current_urls AS (
+            SELECT DISTINCT cc.url_surtkey AS urlkey
+            FROM default.ccindex cc
+            JOIN {domains_table} d
+              ON cc.url_host_registered_domain = d.domain_norm
+            WHERE {ccindex_filters(crawl_id, subset, tlds)}
+          ){select}
+          FROM previous_urls p
+          LEFT JOIN current_urls c
+            ON c.urlkey = p.urlkey
+          WHERE c.urlkey IS NULL
+    """
+
+
+def tombstones_prefix(out_prefix):
+    """Sibling of the export prefix, so export readers never pick the tombstones up"""
+    return f"{out_prefix.rstrip('/')}-tombstones/"
+
+
+def build_unload_sql(select_sql, out_prefix, export_format='json', compression=None):
+    """Wrap an export SELECT in an UNLOAD (gzipped text for json, Parquet otherwise)"""
+    if export_format == 'parquet':
+        file_format = 'PARQUET'
+        compression = compression or 'ZSTD'
+    else:
+        file_format = 'TEXTFILE'
+        compression = compression or 'GZIP'
+    return f"""
+        UNLOAD (
+        {select_sql}
+        )
+        TO '{out_prefix}'
+        WITH (
+          format='{file_format}',
+          compression='{compression}'
+        );
+        """
+
+
+def split_s3_url(s3_url):
+    """Split s3://bucket/key into (bucket, key)"""
+    bucket, _, key = s3_url[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def clear_prefix(s3, s3_url):
+    """Delete everything under an S3 prefix (UNLOAD needs an empty one)"""
+    bucket, prefix = split_s3_url(s3_url)
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+        if objects:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+
+
+def shard_prefix(out_prefix, shard):
+    return f"{out_prefix}shard={shard:02d}/"
+
+
+class ShardedExport:
+    def __init__(self, client, crawl_id, subset, out_prefix, athena_results,
+                 num_shards, max_concurrent=8, max_attempts=3,
+                 export_format='json', compression=None, domains_table='default.domains_norm',
+                 tlds=None, order_by_urlkey=False, domain_limits=None, previous_crawl=None):
+        self.client = client
+        self.crawl_id = crawl_id
+        self.subset = subset
+        self.out_prefix = out_prefix
+        self.athena_results = athena_results
+        self.num_shards = num_shards
+        self.max_concurrent = max_concurrent
+        self.max_attempts = max_attempts
+        self.export_format = export_format
+        self.compression = compression
+        self.domains_table = domains_table
+        self.tlds = tlds
+        self.order_by_urlkey = order_by_urlkey
+        self.domain_limits = domain_limits
+        self.previous_crawl = previous_crawl
+        self.manifest_url = f"{out_prefix}{MANIFEST_NAME}"
+
+    @property
+    def options(self):
+        """Everything besides the shard that decides a shard's records"""
+        return {
+            'crawl_id': self.crawl_id,
+            'subset': self.subset,
+            'format': self.export_format,
+            'compression': self.compression,
+            'domains_table': self.domains_table,
+            'tlds': sorted(self.tlds) if self.tlds else None,
+            'order_by_urlkey': self.order_by_urlkey,
+            'domain_limits': self.domain_limits,
+            'delta_from': self.previous_crawl,
+            'dedup': 'content_digest across shards',
+        }
+
+    def load_manifest(self):
+        """Load the shard manifest from S3, or start a new one.
+
+        Finished shards are only reused if the manifest was written with the
+        same options (compared by fingerprint); otherwise the shards would mix
+        two different exports.
+        """
+        from botocore.exceptions import ClientError
+        options = self.options
+        fingerprint = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+        bucket, key = split_s3_url(self.manifest_url)
+        try:
+            body = self.client.s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+            manifest = json.loads(body)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            manifest = {
+                'crawl_id': self.crawl_id,
+                'subset': self.subset,
+                'export_type': EXPORT_TYPE,
+                'format': self.export_format,
+                'num_shards': self.num_shards,
+                'options': options,
+                'fingerprint': fingerprint,
+                'shards': {},
+            }
+
+        if manifest['num_shards'] != self.num_shards:
+            raise RuntimeError(
+                f"{self.manifest_url} was written with {manifest['num_shards']} shards, "
+                f"not {self.num_shards}. Use the same shard count or a new output prefix."
+            )
+        if manifest.get('fingerprint') is None:
+            print(f"   ⚠️  {self.manifest_url} has no options fingerprint; assuming the same options")
+            manifest.update(options=options, fingerprint=fingerprint)
+        elif manifest['fingerprint'] != fingerprint:
+            previous = manifest.get('options') or {}
+            changed = sorted(k for k in set(options) | set(previous) if options.get(k) != previous.get(k))
+            raise RuntimeError(
+                f"{self.manifest_url} was written with different export options ({', '.join(changed)}). "
+                f"Use the same options or a new output prefix."
+            )
+        return manifest
+
+    def save_manifest(self, manifest):
+        bucket, key = split_s3_url(self.manifest_url)
+        manifest['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        self.client.s3.put_object(
+            Bucket=bucket, Key=key,
+            Body=json.dumps(manifest, indent=2).encode('utf-8'),
+            ContentType='application/json',
+        )
+
+    def clear_prefix(self, s3_url):
+        """Delete partial output left by a failed attempt (UNLOAD needs an empty prefix)"""
+        clear_prefix(self.client.s3, s3_url)
+
+    def run(self):
+        """Run every shard not yet marked done in the manifest; retry failed shards only"""
+        manifest = self.load_manifest()
+        done = {int(k) for k, v in manifest['shards'].items() if v.get('status') == 'SUCCEEDED'}
+        pending = [s for s in range(self.num_shards) if s not in done]
+        if done:
+            print(f"   ♻️  {len(done)}/{self.num_shards} shards already exported, skipping them")
+
+        attempts = {s: manifest['shards'].get(f"{s:02d}", {}).get('attempts', 0) for s in pending}
+        for attempt in range(1, self.max_attempts + 1):
+            if not pending:
+                break
+            print(f"   🚀 Attempt {attempt}: exporting {len(pending)} shard(s), "
+                  f"{self.max_concurrent} at a time")
+
+            queries = {}
+            for shard in pending:
+                target = shard_prefix(self.out_prefix, shard)
+                self.clear_prefix(target)
+                select_sql = build_export_select(
+                    self.crawl_id, self.subset, shard, self.num_shards, self.export_format,
+                    self.domains_table, self.tlds, self.order_by_urlkey, self.domain_limits,
+                    self.previous_crawl)
+                queries[shard] = build_unload_sql(select_sql, target, self.export_format, self.compression)
+                attempts[shard] += 1
+
+            failed = []
+            for shard, response in self.client.execute_many(
+                queries, self.athena_results,
+                max_concurrent=self.max_concurrent, raise_on_failure=False, label_prefix='shard=',
+            ):
+                execution = response['QueryExecution']
+                status = execution['Status']['State']
+                manifest['shards'][f"{shard:02d}"] = {
+                    'status': status,
+                    'output_location': shard_prefix(self.out_prefix, shard),
+                    'execution_id': execution['QueryExecutionId'],
+                    'data_scanned_bytes': execution.get('Statistics', {}).get('DataScannedInBytes', 0),
+                    'attempts': attempts[shard],
+                }
+                if status != 'SUCCEEDED':
+                    manifest['shards'][f"{shard:02d}"]['error'] = self.client.failure_reason(execution)
+                    failed.append(shard)
+                self.save_manifest(manifest)
+            pending = sorted(failed)
+            if any(manifest['shards'][f"{s:02d}"]['execution_id'] in self.client.budget_stops for s in pending):
+                break  # a retry would scan just as much
+
+        if pending:
+            raise RuntimeError(
+                f"{len(pending)} shard(s) still failing after {self.max_attempts} attempts: "
+                f"{', '.join(f'{s:02d}' for s in pending)}. Rerun to retry only these shards."
+            )
+        print(f"   ✅ All {self.num_shards} shards exported (manifest: {self.manifest_url})")
+        return manifest
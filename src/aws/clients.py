@@ -0,0 +1,69 @@
+"""
+One boto3 session and a lazily filled client cache for the whole process.
+
+boto3 is only imported when the first client is asked for, so commands that
+never reach AWS (offline engine, local index, --help) don't pay for it, and
+a command only loads the service models it actually uses. The same goes for
+the credentials in .env: python-dotenv loads them right before the session
+is created. Clients are
+cached per (service, region, pool size) and are safe to share between
+threads; the session is not, so clients are created under a lock. A forked
+child (e.g. a report worker process) starts with an empty cache.
+
+Every client gets a connection pool sized for the parallel paths (botocore
+keeps 10 connections per client by default, so a 32-thread download would
+queue on the pool) and adaptive retries for throttling and transient
+errors. Athena retries less in the client: AthenaClient and the export
+scheduler see throttling themselves and back off across queries.
+"""
+
+import os
+import threading
+
+DEFAULT_REGION = 'us-east-1'
+MAX_POOL_CONNECTIONS = 50
+RETRIES = {'max_attempts': 10, 'mode': 'adaptive'}
+SERVICE_RETRIES = {'athena': {'max_attempts': 4, 'mode': 'standard'}}
+
+lock = threading.Lock()
+session = None
+clients = {}
+
+
+def get_session():
+    """The process-wide boto3 session (created on first use)"""
+    global session
+    with lock:
+        if session is None:
+            import boto3
+            from dotenv import load_dotenv
+            load_dotenv()
+            session = boto3.session.Session()
+        return session
+
+
+def get_client(service, region=None, max_pool_connections=MAX_POOL_CONNECTIONS):
+    """Cached client for `service`; the pool grows to `max_pool_connections` connections"""
+    key = (service, region or DEFAULT_REGION, max_pool_connections)
+    client = clients.get(key)
+    if client is not None:
+        return client
+    shared = get_session()
+    from botocore.config import Config
+    config = Config(max_pool_connections=max_pool_connections, tcp_keepalive=True,
+                    retries=dict(SERVICE_RETRIES.get(service, RETRIES)))
+    with lock:
+        if key not in clients:
+            clients[key] = shared.client(service, region_name=key[1], config=config)
+        return clients[key]
+
+
+def reset():
+    """Forget the session and clients (a forked child must not share the parent's connections)"""
+    global lock, session
+    lock = threading.Lock()
+    session = None
+    clients.clear()
+
+
+os.register_at_fork(after_in_child=reset)
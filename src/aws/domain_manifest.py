@@ -0,0 +1,115 @@
+"""
+Per-export manifest of domains already exported, for incremental runs.
+
+s3://<bucket>/results/manifests/<name>.json lists every incremental run
+(run id, output prefix, domain count) and points at a gzipped text file with
+that run's normalized domains. New runs compare their domain list against
+the union of those files locally and only upload/query the difference.
+
+<name> is the export's output prefix name (crawl, format, delta crawl, e.g.
+CC-MAIN-2025-30-cdx-parquet), plus a hash of options that change which
+records a domain gets (per-domain limits), so a domain exported as JSON is
+still new for a Parquet or a capped export. Manifests of older versions,
+one per crawl (<crawl>.json), are read for the runs under the same prefix.
+"""
+
+import gzip
+import hashlib
+import json
+import time
+from array import array
+from bisect import bisect_left
+from botocore.exceptions import ClientError
+
+from src.aws.cdx_export import split_s3_url
+from src.cdx.domains import domain_hash
+
+
+def manifest_name(out_prefix, options=None):
+    """Manifest name of an export: its output prefix name, plus a hash of `options` if any"""
+    name = out_prefix.rstrip('/').rsplit('/', 1)[-1]
+    if options:
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+        name = f"{name}-{digest[:12]}"
+    return name
+
+
+class DomainManifest:
+    def __init__(self, s3, results_location, crawl_id, out_prefix, options=None):
+        self.s3 = s3
+        self.crawl_id = crawl_id
+        self.out_prefix = out_prefix
+        self.options = options or None
+        self.name = manifest_name(out_prefix, self.options)
+        self.prefix = f"{results_location.rstrip('/')}/manifests/"
+        self.url = f"{self.prefix}{self.name}.json"
+        self.data = {'crawl_id': crawl_id, 'output_prefix': out_prefix, 'options': self.options, 'runs': []}
+        self.exported = array('Q')
+
+    def read(self, url):
+        bucket, key = split_s3_url(url)
+        try:
+            return json.loads(self.s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            return None
+
+    def load(self):
+        """Load the manifest and the sorted hashes of every domain already exported"""
+        data = self.read(self.url)
+        if data is None and not self.options:
+            legacy = self.read(f"{self.prefix}{self.crawl_id}.json")
+            if legacy is not None:
+                self.data['runs'] = [run for run in legacy['runs']
+                                     if run['output_location'].startswith(self.out_prefix)]
+        elif data is not None:
+            if data.get('options') != self.options:
+                raise ValueError(f"{self.url} was written for options {data.get('options')}, not {self.options}")
+            self.data = data
+
+        hashes = array('Q')
+        for run in self.data['runs']:
+            bucket, key = split_s3_url(run['domains_location'])
+            body = self.s3.get_object(Bucket=bucket, Key=key)['Body']
+            with gzip.open(body, 'rt', encoding='utf-8') as f:
+                hashes.extend(domain_hash(line.rstrip('\n')) for line in f if line.strip())
+        self.exported = array('Q', sorted(hashes))
+        return self
+
+    def __contains__(self, domain_norm):
+        h = domain_hash(domain_norm)
+        i = bisect_left(self.exported, h)
+        return i < len(self.exported) and self.exported[i] == h
+
+    def delta(self, domains):
+        """Domains (normalized, deduplicated, in input order) not yet exported to this export"""
+        seen = set()
+        new = []
+        for domain in domains:
+            if domain in seen or domain in self:
+                continue
+            seen.add(domain)
+            new.append(domain)
+        return new
+
+    def add_run(self, run_id, output_location, domains):
+        """Record a finished run: upload its domain list and update the manifest"""
+        domains_location = f"{self.prefix}{self.name}/{run_id}.domains.txt.gz"
+        bucket, key = split_s3_url(domains_location)
+        payload = gzip.compress(''.join(f"{d}\n" for d in domains).encode('utf-8'))
+        self.s3.put_object(Bucket=bucket, Key=key, Body=payload)
+
+        self.data['runs'].append({
+            'run_id': run_id,
+            'output_location': output_location,
+            'domains_location': domains_location,
+            'domains_count': len(domains),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        })
+        bucket, key = split_s3_url(self.url)
+        self.s3.put_object(
+            Bucket=bucket, Key=key,
+            Body=json.dumps(self.data, indent=2).encode('utf-8'),
+            ContentType='application/json',
+        )
@@ -0,0 +1,233 @@
+"""
+Parallel download and re-sharding of UNLOAD output.
+
+Every object under the export prefix is fetched with ranged GETs (several
+ranges in flight per object, several objects at once, one pooled client).
+Gzipped text is decompressed while the ranges stream in, and each record is
+appended to one of N local gzip shards chosen by a stable hash of its domain
+or WARC filename. Parquet objects are fetched to a temporary file (their
+footer comes last) and converted to CDX JSON lines. Memory stays bounded by
+workers x (prefetch x chunk size + a write buffer per object),
+whatever the export size.
+"""
+
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from src.aws.cdx_export import split_s3_url
+from src.cdx.domains import normalize_domain
+from src.cdx.records import iter_parquet_records, to_cdx_json
+
+GZIP_MAGIC = b'\x1f\x8b'
+PARQUET_MAGIC = b'PAR1'
+SHARD_KEYS = ('domain', 'filename')
+
+DOMAIN_FIELD = re.compile(rb'"domain":"([^"]*)"')
+URLKEY_HOST = re.compile(rb'"urlkey":"([^)"]*)\)')
+FILENAME_FIELD = re.compile(rb'"filename":"([^"]*)"')
+
+
+def surt_host(surt):
+    """'com,example,www' -> 'example.com' (normalized like domains_norm)"""
+    return normalize_domain('.'.join(reversed(surt.split(','))))
+
+
+def line_shard_key(line, by):
+    """Shard key of one CDX JSON line, without parsing the whole record.
+
+    JSON exports carry no registered domain, so 'domain' falls back to the
+    host of the urlkey (a registered domain's subdomains may then land in
+    different shards); Parquet exports have the exact domain column.
+    """
+    if by == 'filename':
+        match = FILENAME_FIELD.search(line)
+        return match.group(1).decode('utf-8') if match else ''
+    match = DOMAIN_FIELD.search(line)
+    if match:
+        return match.group(1).decode('utf-8')
+    match = URLKEY_HOST.search(line)
+    return surt_host(match.group(1).decode('utf-8')) if match else ''
+
+
+def iter_gunzip(chunks):
+    """Decompress a stream of (possibly multi-member) gzip chunks"""
+    decompressor = zlib.decompressobj(31)
+    for chunk in chunks:
+        while chunk:
+            out = decompressor.decompress(chunk)
+            if out:
+                yield out
+            if not decompressor.eof:
+                break
+            chunk = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+
+def iter_lines(blocks):
+    """Split a stream of byte blocks into lines (without the newline)"""
+    rest = b''
+    for block in blocks:
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if rest.strip():
+        yield rest
+
+
+def list_export_objects(s3, s3_url):
+    """(bucket, key, size) of the data objects under an export prefix (manifests and hidden files skipped)"""
+    bucket, prefix = split_s3_url(s3_url)
+    objects = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            name = obj['Key'].rsplit('/', 1)[-1]
+            if obj['Size'] and not name.startswith(('_', '.')):
+                objects.append((bucket, obj['Key'], obj['Size']))
+    return objects
+
+
+class ShardWriters:
+    """N gzip output files, one lock each; callers hand over whole buffers"""
+
+    def __init__(self, output_dir, num_shards, compresslevel=6):
+        os.makedirs(output_dir, exist_ok=True)
+        self.paths = [os.path.join(output_dir, f"shard-{i:05d}.jsonl.gz") for i in range(num_shards)]
+        self.files = [gzip.open(path, 'wb', compresslevel=compresslevel) for path in self.paths]
+        self.locks = [threading.Lock() for _ in range(num_shards)]
+
+    def write(self, shard, data):
+        with self.locks[shard]:
+            self.files[shard].write(data)
+
+    def close(self):
+        for f in self.files:
+            f.close()
+
+
+class ExportDownloader:
+    def __init__(self, s3, output_dir, num_shards=16, by='domain', workers=8,
+                 chunk_size=8 * 1024 * 1024, prefetch=4, buffer_size=4 * 1024 * 1024, compresslevel=6):
+        if by not in SHARD_KEYS:
+            raise ValueError(f"by must be one of {SHARD_KEYS}")
+        self.s3 = s3
+        self.output_dir = output_dir
+        self.num_shards = num_shards
+        self.by = by
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.buffer_size = buffer_size
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        self.stats = {'objects': 0, 'bytes_downloaded': 0, 'records': 0}
+
+    def list_objects(self, s3_url):
+        return list_export_objects(self.s3, s3_url)
+
+    def fetch_range(self, bucket, key, start, end):
+        body = self.s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")['Body']
+        data = body.read()
+        with self.lock:
+            self.stats['bytes_downloaded'] += len(data)
+        return data
+
+    def iter_chunks(self, bucket, key, size):
+        """Yield an object's bytes in order, keeping `prefetch` ranged GETs in flight"""
+        ranges = [(start, min(start + self.chunk_size, size) - 1) for start in range(0, size, self.chunk_size)]
+        futures = []
+        next_range = 0
+        while next_range < len(ranges) or futures:
+            while next_range < len(ranges) and len(futures) < self.prefetch:
+                start, end = ranges[next_range]
+                futures.append(self.range_pool.submit(self.fetch_range, bucket, key, start, end))
+                next_range += 1
+            yield futures.pop(0).result()
+
+    def shard_lines(self, lines, writers):
+        """Route lines to shards; all buffers are flushed once buffer_size bytes are held"""
+        buffers = [[] for _ in range(self.num_shards)]
+        buffered = 0
+        records = 0
+        for line in lines:
+            shard = zlib.crc32(line_shard_key(line, self.by).encode('utf-8')) % self.num_shards
+            buffers[shard].append(line)
+            buffered += len(line) + 1
+            records += 1
+            if buffered >= self.buffer_size:
+                self.flush_buffers(buffers, writers)
+                buffered = 0
+        self.flush_buffers(buffers, writers)
+        return records
+
+    def flush_buffers(self, buffers, writers):
+        for shard, buffer in enumerate(buffers):
+            if buffer:
+                writers.write(shard, b'\n'.join(buffer) + b'\n')
+                buffers[shard] = []
+
+    def iter_parquet_lines(self, chunks):
+        """Parquet needs random access: spool to a temp file, then convert to CDX JSON lines"""
+        with tempfile.NamedTemporaryFile(dir=self.output_dir, suffix='.parquet') as tmp:
+            for chunk in chunks:
+                tmp.write(chunk)
+            tmp.flush()
+            for record in iter_parquet_records(tmp.name):
+                cdx = to_cdx_json(record)
+                if record.get('domain'):
+                    cdx['domain'] = record['domain']
+                yield json.dumps(cdx, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def process_object(self, obj, writers):
+        bucket, key, size = obj
+        chunks = self.iter_chunks(bucket, key, size)
+        first = next(chunks)
+
+        def stream():
+            yield first
+            yield from chunks
+
+        if first.startswith(PARQUET_MAGIC):
+            lines = self.iter_parquet_lines(stream())
+        elif first.startswith(GZIP_MAGIC):
+            lines = iter_lines(iter_gunzip(stream()))
+        else:
+            lines = iter_lines(stream())
+        records = self.shard_lines(lines, writers)
+        with self.lock:
+            self.stats['objects'] += 1
+            self.stats['records'] += records
+        return key, records
+
+    def run(self, s3_url, on_object=None):
+        """Download and re-shard every object under `s3_url`; returns stats"""
+        objects = self.list_objects(s3_url)
+        self.stats['total_objects'] = len(objects)
+        self.stats['total_bytes'] = sum(size for _, _, size in objects)
+        writers = ShardWriters(self.output_dir, self.num_shards, self.compresslevel)
+        self.range_pool = ThreadPoolExecutor(max_workers=self.workers * self.prefetch)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # Largest objects first so one big file does not finish last on its own
+                futures = [pool.submit(self.process_object, obj, writers)
+                           for obj in sorted(objects, key=lambda o: -o[2])]
+                for future in futures:
+                    key, records = future.result()
+                    if on_object:
+                        on_object(key, records)
+        finally:
+            self.range_pool.shutdown()
+            writers.close()
+        self.stats['shards'] = writers.paths
+        return self.stats
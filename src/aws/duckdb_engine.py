@@ -0,0 +1,322 @@
+"""
+Offline query engine: runs the export's Athena SQL on DuckDB over local files.
+
+DuckDBEngine implements the Athena client calls AthenaClient makes
+(start_query_execution, get_query_execution, batch_get_query_execution,
+get_query_results, list_table_metadata, stop_query_execution) with the same
+response shapes, so schema bootstrap, polling, metrics, sharding and
+estimation all run unchanged. Statements are translated as they come in:
+
+- CREATE EXTERNAL TABLE ... LOCATION 's3://...' becomes a view over
+  read_csv/read_parquet of the local files for that location (`locations`
+  overrides, e.g. the ccindex sample, else the LocalS3 directory);
+- ALTER TABLE ... ADD PARTITION is a no-op (hive partitions are discovered
+  from crawl=/subset= directories), ccindex$partitions is derived from them;
+- UNLOAD writes gzipped text or Parquet files under the LocalS3 directory
+  of its TO prefix, failing like Athena if the prefix is not empty;
+- EXPLAIN (TYPE IO) reports no estimate (as for tables without statistics);
+- Presto functions without a DuckDB equivalent are defined as macros
+  (crc32/to_utf8 match zlib.crc32 of the UTF-8 bytes, so shards agree),
+  and JSON string encoding of export fields becomes to_json().
+
+Queries run synchronously inside start_query_execution. DataScannedInBytes
+is the size of the files of every table the statement names.
+"""
+
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from src.aws.cdx_export import split_s3_url
+from src.cdx.records import expand_paths
+
+UNLOAD_ROWS_PER_FILE = 1_000_000
+
+# DuckDB type (prefix) -> Athena ColumnInfo type
+ATHENA_TYPES = {
+    'BIGINT': 'bigint', 'HUGEINT': 'bigint', 'INTEGER': 'integer', 'SMALLINT': 'smallint',
+    'TINYINT': 'tinyint', 'UBIGINT': 'bigint', 'UINTEGER': 'bigint', 'DOUBLE': 'double',
+    'FLOAT': 'float', 'DECIMAL': 'decimal', 'BOOLEAN': 'boolean', 'DATE': 'date',
+    'TIMESTAMP': 'timestamp', 'VARCHAR': 'varchar',
+}
+
+CREATE_TABLE = re.compile(
+    r'^\s*CREATE\s+EXTERNAL\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?P<name>[\w."]+)\s*\((?P<columns>.*?)\)\s*'
+    r'(?:PARTITIONED\s+BY\s*\((?P<partitions>.*?)\)\s*)?(?P<rest>.*)$', re.IGNORECASE | re.DOTALL)
+LOCATION = re.compile(r"LOCATION\s+'([^']*)'", re.IGNORECASE)
+UNLOAD = re.compile(r"^\s*UNLOAD\s*\((?P<select>.*)\)\s*TO\s+'(?P<to>[^']*)'\s*WITH\s*\((?P<options>.*?)\)\s*$",
+                    re.IGNORECASE | re.DOTALL)
+DROP_TABLE = re.compile(r'^\s*DROP\s+TABLE\s+(?:IF\s+EXISTS\s+)?([\w."]+)\s*$', re.IGNORECASE)
+STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+# cdx_export.json_string(): Presto's CAST(varchar AS JSON) encodes a string, DuckDB's parses it
+JSON_STRING = re.compile(r"json_format\(CAST\(COALESCE\(([\w.]+), ''\) AS JSON\)\)")
+
+
+def crc32_table():
+    table = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ 0xEDB88320 if n & 1 else n >> 1
+        table.append(n)
+    return table
+
+
+MACROS = [
+    "CREATE MACRO to_utf8(x) AS encode(x)",
+    # CRC-32 (IEEE) of a blob, byte by byte over its hex digits
+    f"""CREATE MACRO crc32(b) AS xor(list_reduce(
+          list_transform(regexp_extract_all(hex(b), '..'), x -> ('0x' || x)::BIGINT),
+          (crc, x) -> xor(crc >> 8, ({crc32_table()})[(xor(crc, x) & 255) + 1]),
+          4294967295::BIGINT), 4294967295::BIGINT)""",
+    # MySQL-style specifiers used by Presto's date_format
+    "CREATE MACRO date_format(ts, fmt) AS strftime(ts, replace(replace(fmt, '%i', '%M'), '%s', '%S'))",
+    "CREATE MACRO approx_percentile(x, q) AS approx_quantile(x, q)",
+]
+
+
+def require_duckdb():
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("The offline engine requires duckdb: pip install duckdb")
+    return duckdb
+
+
+def table_name(name):
+    """'default.ccindex' / "default"."ccindex" -> 'ccindex'"""
+    return name.replace('"', '').split('.')[-1]
+
+
+def translate_sql(sql):
+    """Rewrite Athena/Presto SQL outside string literals into DuckDB SQL"""
+    sql = JSON_STRING.sub(r"to_json(COALESCE(\1, ''))::VARCHAR", sql)
+    parts = STRING_LITERAL.split(sql.strip().rstrip(';'))
+    for i in range(0, len(parts), 2):
+        part = parts[i]
+        part = re.sub(r'"default"\."ccindex\$partitions"',
+                      '(SELECT DISTINCT crawl, subset FROM ccindex)', part)
+        part = re.sub(r'"?\bdefault"?\.', '', part)
+        part = re.sub(r'TABLESAMPLE\s+(SYSTEM|BERNOULLI)\s*\(\s*([\d.]+)\s*\)',
+                      r'TABLESAMPLE \1 (\2 PERCENT)', part, flags=re.IGNORECASE)
+        part = re.sub(r'(?<![\w"])offset(?![\w"])', '"offset"', part)
+        parts[i] = part
+    return ''.join(parts)
+
+
+def varchar_value(value):
+    if value is None:
+        return {}
+    if isinstance(value, bool):
+        return {'VarCharValue': 'true' if value else 'false'}
+    if isinstance(value, datetime.datetime):
+        return {'VarCharValue': value.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}
+    return {'VarCharValue': str(value)}
+
+
+class DuckDBEngine:
+    def __init__(self, s3, locations=None, database=':memory:', threads=None):
+        duckdb = require_duckdb()
+        self.s3 = s3
+        self.locations = dict(locations or {})
+        self.db = duckdb.connect(database)
+        if threads:
+            self.db.execute(f"SET threads = {int(threads)}")
+        for macro in MACROS:
+            self.db.execute(macro)
+        self.lock = threading.Lock()
+        self.tables = {}  # name -> {'files', 'type', 'created'}
+        self.executions = {}  # execution id -> QueryExecution
+        self.results = {}  # execution id -> (ColumnInfo list, rows)
+
+    def local_path(self, location):
+        """Local file/directory for an s3:// location (longest `locations` prefix first)"""
+        for prefix in sorted(self.locations, key=len, reverse=True):
+            if location.startswith(prefix):
+                rest = location[len(prefix):]
+                return os.path.join(self.locations[prefix], *rest.split('/')) if rest else self.locations[prefix]
+        return self.s3.url_path(location)
+
+    # Statement handlers: each returns (ColumnInfo list, rows, bytes scanned)
+
+    def create_table(self, match):
+        name = table_name(match.group('name'))
+        columns = re.findall(r'(\w+)\s+(\w+)', match.group('columns'))
+        rest = match.group('rest')
+        location = LOCATION.search(rest).group(1)
+        path = self.local_path(location)
+        files = expand_paths([path]) if os.path.exists(path) else []
+        if not files:
+            raise ValueError(f"No local files for {location} (looked in {path})")
+        file_list = '[' + ', '.join("'" + f.replace("'", "''") + "'" for f in files) + ']'
+        if re.search(r'STORED\s+AS\s+PARQUET', rest, re.IGNORECASE):
+            source = f"read_parquet({file_list}, hive_partitioning = true, union_by_name = true)"
+        else:
+            skip = re.search(r"'skip\.header\.line\.count'\s*=\s*'(\d+)'", rest)
+            types = ', '.join(f"'{col}': 'VARCHAR'" for col, _ in columns)
+            source = (f"read_csv({file_list}, header = {'true' if skip else 'false'}, "
+                      f"columns = {{{types}}}, quote = '\"', escape = '\\', delim = ',')")
+        self.db.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {source}")
+        self.tables[name] = {'files': files, 'type': 'EXTERNAL_TABLE', 'created': datetime.datetime.now()}
+        return [], [], 0
+
+    def drop_table(self, match):
+        name = table_name(match.group(1))
+        self.db.execute(f"DROP VIEW IF EXISTS {name}")
+        self.tables.pop(name, None)
+        return [], [], 0
+
+    def create_view(self, sql):
+        name = table_name(re.search(r'VIEW\s+([\w."]+)', sql, re.IGNORECASE).group(1))
+        self.db.execute(translate_sql(sql))
+        self.tables[name] = {'files': [], 'type': 'VIRTUAL_VIEW', 'created': datetime.datetime.now()}
+        return [], [], self.scanned_bytes(sql)
+
+    def unload(self, match, execution_id):
+        options = dict(re.findall(r"(\w+)\s*=\s*'([^']*)'", match.group('options')))
+        file_format = options.get('format', 'TEXTFILE').upper()
+        compression = options.get('compression', 'GZIP').upper()
+        out_dir = self.s3.url_path(match.group('to'))
+        if os.path.isdir(out_dir) and expand_paths([out_dir]):
+            raise ValueError(f"HIVE_PATH_ALREADY_EXISTS: Target directory for table already exists: "
+                             f"{match.group('to')}")
+        os.makedirs(out_dir, exist_ok=True)
+        select = translate_sql(match.group('select'))
+        if file_format == 'PARQUET':
+            path = os.path.join(out_dir, f"{execution_id}_00000")
+            self.db.execute(f"COPY ({select}) TO '{path}' (FORMAT parquet, COMPRESSION {compression})")
+        elif compression in ('GZIP', 'NONE'):
+            cursor = self.db.execute(select)
+            part = 0
+            while True:
+                rows = cursor.fetchmany(UNLOAD_ROWS_PER_FILE)
+                if not rows:
+                    break
+                suffix = '.gz' if compression == 'GZIP' else ''
+                path = os.path.join(out_dir, f"{execution_id}_{part:05d}{suffix}")
+                opener = gzip.open if compression == 'GZIP' else open
+                with opener(path, 'wt', encoding='utf-8') as f:
+                    f.writelines('\t'.join('' if v is None else str(v) for v in row) + '\n' for row in rows)
+                part += 1
+        else:
+            raise ValueError(f"Offline UNLOAD supports TEXTFILE with GZIP/NONE or PARQUET, not {compression}")
+        return [], [], self.scanned_bytes(match.group('select'))
+
+    def explain_io(self):
+        plan = {'inputTableColumnInfos': [{'estimate': {'outputSizeInBytes': 'NaN'}}]}
+        return [{'Name': 'Query Plan', 'Type': 'varchar'}], [(json.dumps(plan),)], 0
+
+    def select(self, sql):
+        cursor = self.db.execute(translate_sql(sql))
+        columns = [{'Name': name, 'Type': ATHENA_TYPES.get(str(col_type).split('(')[0], 'varchar')}
+                   for name, col_type, *_ in cursor.description]
+        return columns, cursor.fetchall(), self.scanned_bytes(sql)
+
+    def scanned_bytes(self, sql):
+        names = set(re.findall(r'\w+', sql.replace('$partitions', '')))
+        return sum(os.path.getsize(f) for name, table in self.tables.items() if name in names
+                   for f in table['files'])
+
+    def run(self, sql, execution_id):
+        text = sql.strip().rstrip(';').strip()
+        match = CREATE_TABLE.match(text)
+        if match:
+            return self.create_table(match)
+        match = DROP_TABLE.match(text)
+        if match:
+            return self.drop_table(match)
+        if re.match(r'ALTER\s+TABLE\b.*\bADD\b.*\bPARTITION\b', text, re.IGNORECASE | re.DOTALL):
+            return [], [], 0
+        if re.match(r'CREATE\s+(OR\s+REPLACE\s+)?VIEW\b', text, re.IGNORECASE):
+            return self.create_view(text)
+        match = UNLOAD.match(text)
+        if match:
+            return self.unload(match, execution_id)
+        if re.match(r'EXPLAIN\s*\(\s*TYPE\s+IO', text, re.IGNORECASE):
+            return self.explain_io()
+        return self.select(text)
+
+    def write_result_csv(self, output_location, execution_id, columns, rows):
+        """Athena also leaves every result as <OutputLocation>/<id>.csv"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow([col['Name'] for col in columns])
+        for row in rows:
+            writer.writerow([varchar_value(v).get('VarCharValue', '') for v in row])
+        bucket, key = split_s3_url(output_location)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue())
+
+    # Athena API
+
+    def start_query_execution(self, QueryString, ResultConfiguration, WorkGroup=None, **kwargs):
+        execution_id = str(uuid.uuid4())
+        output_location = f"{ResultConfiguration['OutputLocation'].rstrip('/')}/{execution_id}.csv"
+        submitted = datetime.datetime.now(datetime.timezone.utc)
+        start = time.time()
+        status = {'State': 'SUCCEEDED'}
+        scanned = 0
+        with self.lock:
+            try:
+                columns, rows, scanned = self.run(QueryString, execution_id)
+                self.results[execution_id] = (columns, rows)
+                if columns:
+                    self.write_result_csv(output_location, execution_id, columns, rows)
+            except Exception as e:
+                status = {'State': 'FAILED', 'StateChangeReason': f"{type(e).__name__}: {e}"}
+        elapsed_ms = int((time.time() - start) * 1000)
+        status.update(SubmissionDateTime=submitted, CompletionDateTime=datetime.datetime.now(datetime.timezone.utc))
+        self.executions[execution_id] = {
+            'QueryExecutionId': execution_id,
+            'Query': QueryString,
+            'ResultConfiguration': {'OutputLocation': output_location},
+            'WorkGroup': WorkGroup,
+            'Status': status,
+            'Statistics': {
+                'DataScannedInBytes': scanned,
+                'EngineExecutionTimeInMillis': elapsed_ms,
+                'TotalExecutionTimeInMillis': elapsed_ms,
+                'QueryQueueTimeInMillis': 0,
+                'QueryPlanningTimeInMillis': 0,
+                'ServiceProcessingTimeInMillis': 0,
+            },
+        }
+        return {'QueryExecutionId': execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': self.executions[QueryExecutionId]}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        return {'QueryExecutions': [self.executions[i] for i in QueryExecutionIds if i in self.executions],
+                'UnprocessedQueryExecutionIds': [i for i in QueryExecutionIds if i not in self.executions]}
+
+    def stop_query_execution(self, QueryExecutionId):
+        return {}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000, NextToken=None):
+        """Pages of rows; like Athena, the first page of a SELECT starts with a header row"""
+        columns, rows = self.results[QueryExecutionId]
+        if columns:
+            rows = [tuple(col['Name'] for col in columns)] + list(rows)
+        start = int(NextToken or 0)
+        page = rows[start:start + MaxResults]
+        response = {
+            'ResultSet': {
+                'Rows': [{'Data': [varchar_value(v) for v in row]} for row in page],
+                'ResultSetMetadata': {'ColumnInfo': [dict(col, Label=col['Name']) for col in columns]},
+            },
+        }
+        if start + MaxResults < len(rows):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    def list_table_metadata(self, CatalogName, DatabaseName, Expression=None, NextToken=None, **kwargs):
+        tables = [{'Name': name, 'TableType': table['type'], 'CreateTime': table['created']}
+                  for name, table in sorted(self.tables.items())
+                  if Expression is None or re.fullmatch(Expression, name)]
+        return {'TableMetadataList': tables}
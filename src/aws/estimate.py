@@ -0,0 +1,211 @@
+"""
+Pre-flight estimate of an export: bytes scanned, cost, runtime, output size.
+
+Three cheap queries instead of the real one:
+- EXPLAIN (TYPE IO) of the planned export SELECT, for the planner's input
+  size estimate (only available when the table has statistics);
+- the export join over TABLESAMPLE SYSTEM (pct) of ccindex, which reads
+  about pct% of the splits, scaled back up for bytes scanned, records and
+  output size;
+- exact page counts for a small hash sample of the domains, reading only
+  url_host_registered_domain and the partition columns, which also give the
+  pages-per-domain distribution (a split sample can't: scaling a sampled
+  domain's count up by 1/pct is biased, most of all for small domains).
+"""
+
+import json
+import math
+
+from src.aws.cdx_export import build_domains_source, ccindex_filters, shard_predicate, tld_predicate
+from src.aws.metrics import query_cost
+
+# Rough per-record CDX JSON overhead beyond url/urlkey/filename, and gzip/ZSTD ratios
+JSON_RECORD_OVERHEAD = 250
+COMPRESSION_RATIO = {'json': 5.0, 'parquet': 4.0}
+# Domains in the exact page-count sample (lists under twice this are counted in full)
+DOMAIN_SAMPLE_MIN = 200
+MAX_DOMAIN_BUCKETS = 1000
+
+
+def build_explain_io_sql(select_sql):
+    return f"EXPLAIN (TYPE IO, FORMAT JSON) {select_sql}"
+
+
+def parse_explain_io(plan_lines):
+    """Sum the planner's outputSizeInBytes over input tables (None if unknown)"""
+    try:
+        plan = json.loads('\n'.join(plan_lines))
+    except ValueError:
+        return None
+    total = 0.0
+    for info in plan.get('inputTableColumnInfos', []):
+        size = info.get('estimate', {}).get('outputSizeInBytes')
+        try:
+            size = float(size)
+        except (TypeError, ValueError):
+            return None
+        if math.isnan(size):
+            return None
+        total += size
+    return int(total)
+
+
+def build_sample_sql(crawl_id, subset, sample_pct, domains_table='default.domains_norm', tlds=None):
+    """Export join over a TABLESAMPLE SYSTEM of ccindex, aggregated per domain"""
+    return f"""
+        WITH per_domain AS (
+          SELECT
+            cc.url_host_registered_domain AS domain,
+            COUNT(*) AS records,
+            SUM(2 * LENGTH(cc.url) + LENGTH(cc.warc_filename) + {JSON_RECORD_OVERHEAD}) AS json_bytes
+          FROM default.ccindex cc TABLESAMPLE SYSTEM ({sample_pct})
+          JOIN {domains_table} d
+            ON cc.url_host_registered_domain = d.domain_norm
+          WHERE {ccindex_filters(crawl_id, subset, tlds)}
+          GROUP BY cc.url_host_registered_domain
+        )
+        SELECT
+          COUNT(*)                              AS domains_hit,
+          COALESCE(SUM(records), 0)             AS records,
+          COALESCE(SUM(json_bytes), 0)          AS json_bytes
+        FROM per_domain
+        """
+
+
+def build_domain_sample_sql(crawl_id, subset, num_buckets, domains_table='default.domains_norm', tlds=None):
+    """Exact page counts for the domains in hash bucket 0 of `num_buckets`, largest first.
+
+    This query runs over the whole partition, so it skips the export's status,
+    MIME and url filters (they'd read those columns in full): counts are of
+    all captures, which bounds the domain's export records from above.
+    """
+    domains_source = build_domains_source(0, num_buckets, domains_table)
+    return f"""
+        SELECT
+          cc.url_host_registered_domain AS domain,
+          COUNT(*) AS pages
+        FROM default.ccindex cc
+        JOIN {domains_source} d
+          ON cc.url_host_registered_domain = d.domain_norm
+        WHERE cc.crawl  = '{crawl_id}'
+          AND cc.subset = '{subset}'{tld_predicate(tlds or ())}
+        GROUP BY cc.url_host_registered_domain
+        ORDER BY pages DESC
+        """
+
+
+def build_domain_sample_count_sql(num_buckets, domains_table='default.domains_norm'):
+    return f"""
+        SELECT COUNT(*) AS sampled
+        FROM {domains_table}
+        WHERE {shard_predicate('domain_norm', 0, num_buckets)}
+        """
+
+
+def domain_sample_buckets(domain_count, min_domains=DOMAIN_SAMPLE_MIN, max_buckets=MAX_DOMAIN_BUCKETS):
+    """Hash buckets for the domain sample: bucket 0 holds at least ~min_domains domains"""
+    return max(1, min(max_buckets, domain_count // min_domains))
+
+
+def stats_seconds(stats, field):
+    return stats.get(field, 0) / 1000.0
+
+
+def quantile(values, q):
+    """Nearest-rank quantile of descending `values` (0 if empty)"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * (1 - q)))]
+
+
+def suggest_shards(runtime_s, target_shard_runtime_s=600, max_shards=64):
+    """Shards needed to keep each UNLOAD under the target runtime.
+
+    Every shard scans the same ccindex columns, so shards multiply scan cost;
+    sharding is only worth it for long runs (retries, timeouts, parallelism).
+    """
+    return max(1, min(max_shards, math.ceil(runtime_s / target_shard_runtime_s)))
+
+
+class ExportEstimator:
+    def __init__(self, client, athena_results, crawl_id, subset,
+                 domains_table='default.domains_norm', tlds=None, export_format='json'):
+        self.client = client
+        self.athena_results = athena_results
+        self.crawl_id = crawl_id
+        self.subset = subset
+        self.domains_table = domains_table
+        self.tlds = tlds
+        self.export_format = export_format
+
+    def run(self, select_sql, sample_pct=1.0, domain_count=None, domain_buckets=None):
+        """Run the estimate queries concurrently and return the estimate dict.
+
+        The domain sample is bucket 0 of `domain_buckets` hash buckets, by
+        default sized from `domain_count` (the whole list when it is small).
+        """
+        if domain_buckets is None:
+            domain_buckets = domain_sample_buckets(domain_count) if domain_count else MAX_DOMAIN_BUCKETS
+        queries = {
+            'explain_io': build_explain_io_sql(select_sql),
+            'sample_join': build_sample_sql(self.crawl_id, self.subset, sample_pct,
+                                            self.domains_table, self.tlds),
+            'domain_sample': build_domain_sample_sql(self.crawl_id, self.subset, domain_buckets,
+                                                     self.domains_table, self.tlds),
+            'domain_sample_size': build_domain_sample_count_sql(domain_buckets, self.domains_table),
+        }
+        responses = dict(self.client.execute_many(queries, self.athena_results, label_prefix='estimate:'))
+        results = {key: self.client.get_query_results(response['QueryExecution']['QueryExecutionId'])
+                   for key, response in responses.items()}
+
+        fraction = sample_pct / 100.0
+        sample_exec = responses['sample_join']['QueryExecution']
+        sample_stats = sample_exec.get('Statistics', {})
+        sample = results['sample_join']['rows'][0]
+
+        planned_bytes = parse_explain_io(
+            [next(iter(row.values())) or '' for row in results['explain_io']['rows']])
+        sampled_scan = sample_stats.get('DataScannedInBytes', 0)
+        scan_bytes = planned_bytes if planned_bytes is not None else int(sampled_scan / fraction)
+
+        # Runtime: a fixed part (queueing, planning, service time and the engine's
+        # startup, taken from the trivial domain count query) plus the full scan at
+        # the sample's throughput. Scaling the whole sample time by 1/fraction
+        # would multiply the fixed part too.
+        count_stats = responses['domain_sample_size']['QueryExecution'].get('Statistics', {})
+        startup_s = max(0.0, stats_seconds(count_stats, 'EngineExecutionTimeInMillis')
+                        - stats_seconds(count_stats, 'QueryPlanningTimeInMillis'))
+        fixed_s = (stats_seconds(sample_stats, 'QueryQueueTimeInMillis')
+                   + stats_seconds(sample_stats, 'QueryPlanningTimeInMillis')
+                   + stats_seconds(sample_stats, 'ServiceProcessingTimeInMillis') + startup_s)
+        scan_s = max(stats_seconds(sample_stats, 'EngineExecutionTimeInMillis')
+                     - stats_seconds(sample_stats, 'QueryPlanningTimeInMillis') - startup_s, 0.05)
+        throughput = max(sampled_scan / scan_s, 1.0)
+        runtime_s = fixed_s + scan_bytes / throughput
+
+        pages = [int(row['pages']) for row in results['domain_sample']['rows']]
+        records = int(int(sample['records'] or 0) / fraction)
+        json_bytes = int(int(sample['json_bytes'] or 0) / fraction)
+        output_bytes = int(json_bytes / COMPRESSION_RATIO[self.export_format])
+
+        return {
+            'scan_bytes': scan_bytes,
+            'scan_source': 'explain' if planned_bytes is not None else 'sample',
+            'cost_usd': query_cost(scan_bytes),
+            'runtime_s': runtime_s,
+            'records': records,
+            'output_bytes': output_bytes,
+            'domains_hit_in_sample': int(sample['domains_hit'] or 0),
+            'domain_sample': {
+                'domains': int(results['domain_sample_size']['rows'][0]['sampled']),
+                'buckets': domain_buckets,
+                'domains_hit': len(pages),
+                'pages_per_domain': {'p50': quantile(pages, 0.5), 'p99': quantile(pages, 0.99),
+                                     'max': quantile(pages, 1.0)},
+                'top': [(row['domain'], int(row['pages'])) for row in results['domain_sample']['rows'][:20]],
+            },
+            'estimate_cost_usd': sum(query_cost(r['QueryExecution'].get('Statistics', {})
+                                                .get('DataScannedInBytes', 0))
+                                     for r in responses.values()),
+            'suggested_shards': suggest_shards(runtime_s),
+        }
@@ -0,0 +1,150 @@
+"""
+Local-directory stand-in for the S3 client calls this project makes.
+
+s3://bucket/key is stored at <root>/bucket/key. Only the subset of the boto3
+S3 API used by the export, download and manifest code is implemented, with
+the same request/response shapes, so that code runs unchanged against local
+files (offline engine, benchmarks).
+"""
+
+import datetime
+import hashlib
+import io
+import os
+import shutil
+
+from botocore.exceptions import ClientError
+
+from src.aws.cdx_export import split_s3_url
+
+
+class ChunkedBody:
+    """StreamingBody-like helpers on top of a binary file object"""
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class LocalBody(ChunkedBody, io.BufferedReader):
+    pass
+
+
+class LocalRangeBody(ChunkedBody, io.BytesIO):
+    pass
+
+
+def not_found(operation, key):
+    return ClientError({'Error': {'Code': 'NoSuchKey', 'Message': f"No such key: {key}"}}, operation)
+
+
+class LocalPaginator:
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.s3.list_objects_v2(**kwargs)
+            yield page
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class LocalS3:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, bucket, key=''):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def url_path(self, s3_url):
+        """Local path of an s3:// URL"""
+        return self.path(*split_s3_url(s3_url))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        path = self.path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        stat = os.stat(path)
+        return {
+            'ContentLength': stat.st_size,
+            'ETag': f'"{hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()}"',
+            'LastModified': datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc),
+        }
+
+    def list_keys(self, bucket, prefix):
+        # Only walk the deepest directory the prefix names
+        base = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        top = self.path(bucket, base)
+        keys = []
+        for root, dirs, names in os.walk(top):
+            dirs.sort()
+            for name in names:
+                rel = os.path.relpath(os.path.join(root, name), self.path(bucket))
+                key = rel.replace(os.sep, '/')
+                if key.startswith(prefix) and not name.endswith('.s3tmp'):
+                    keys.append(key)
+        return sorted(keys)
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, **kwargs):
+        keys = self.list_keys(Bucket, Prefix)
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {'KeyCount': len(page), 'IsTruncated': start + MaxKeys < len(keys)}
+        if page:
+            response['Contents'] = [dict(self.head_object(Bucket, key), Key=key,
+                                         Size=os.path.getsize(self.path(Bucket, key)))
+                                    for key in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+    def get_paginator(self, operation):
+        if operation != 'list_objects_v2':
+            raise NotImplementedError(f"LocalS3 has no paginator for {operation}")
+        return LocalPaginator(self)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        path = self.path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise not_found('GetObject', Key)
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            with open(path, 'rb') as f:
+                f.seek(int(start))
+                data = f.read(int(end) - int(start) + 1 if end else -1)
+            return {'Body': LocalRangeBody(data), 'ContentLength': len(data)}
+        return {'Body': LocalBody(io.FileIO(path, 'rb')), 'ContentLength': os.path.getsize(path)}
+
+    def put_object(self, Bucket, Key, Body=b'', **kwargs):
+        path = self.path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        tmp_path = f"{path}.s3tmp"
+        with open(tmp_path, 'wb') as f:
+            if isinstance(Body, bytes):
+                f.write(Body)
+            else:
+                shutil.copyfileobj(Body, f)
+        os.replace(tmp_path, path)
+        return {'ETag': self.head_object(Bucket, Key)['ETag']}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket, Key, f)
+        if Callback:
+            Callback(os.path.getsize(Filename))
+
+    def delete_objects(self, Bucket, Delete):
+        deleted = []
+        for obj in Delete['Objects']:
+            path = self.path(Bucket, obj['Key'])
+            if os.path.isfile(path):
+                os.remove(path)
+            deleted.append({'Key': obj['Key']})
+        return {'Deleted': deleted}
@@ -0,0 +1,110 @@
+"""
+Structured per-query metrics for Athena executions.
+
+Every finished execution becomes one record with Athena's own timings
+(queue, planning, engine, service processing, total), bytes scanned, the
+computed cost and how many times the same label was retried. Records are
+appended to a JSONL run log (tagged with the run id) and, optionally,
+aggregated into a Prometheus textfile (node_exporter textfile collector
+format). The textfile is labelled by query label only: a run id label would
+start a new series every run.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+COST_PER_TB = 5.0  # USD per TiB scanned
+
+TIMING_FIELDS = {
+    'queue_ms': 'QueryQueueTimeInMillis',
+    'planning_ms': 'QueryPlanningTimeInMillis',
+    'engine_ms': 'EngineExecutionTimeInMillis',
+    'service_processing_ms': 'ServiceProcessingTimeInMillis',
+    'total_ms': 'TotalExecutionTimeInMillis',
+}
+
+
+def query_cost(data_scanned_bytes):
+    return data_scanned_bytes / (1024 ** 4) * COST_PER_TB
+
+
+def query_metrics(execution, label=None, retries=0, cached=False):
+    """Metrics record for a QueryExecution dict (as returned by get/batch_get_query_execution)"""
+    stats = execution.get('Statistics', {})
+    status = execution.get('Status', {})
+    scanned = 0 if cached else stats.get('DataScannedInBytes', 0)
+    record = {
+        'ts': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'label': label,
+        'execution_id': execution['QueryExecutionId'],
+        'state': status.get('State'),
+        'data_scanned_bytes': scanned,
+        'cost_usd': round(query_cost(scanned), 6),
+        'retries': retries,
+        'cached': cached,
+        'reused': stats.get('ResultReuseInformation', {}).get('ReusedPreviousResult', False),
+    }
+    for name, key in TIMING_FIELDS.items():
+        record[name] = 0 if cached else stats.get(key, 0)
+    if status.get('State') in ('FAILED', 'CANCELLED'):
+        record['error'] = status.get('StateChangeReason', '')
+    return record
+
+
+def prometheus_escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRecorder:
+    """Append query metrics to a JSONL log and keep Prometheus aggregates per label"""
+
+    def __init__(self, run_log_path=None, prometheus_path=None, run_id=None):
+        self.run_log_path = run_log_path
+        self.prometheus_path = prometheus_path
+        self.run_id = run_id or time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        self.lock = threading.Lock()
+        self.totals = defaultdict(float)  # (metric, labels) -> value
+        for path in (run_log_path, prometheus_path):
+            if path:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    def record(self, metrics):
+        metrics = dict(metrics, run_id=self.run_id)
+        with self.lock:
+            if self.run_log_path:
+                with open(self.run_log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(metrics) + '\n')
+            if self.prometheus_path:
+                self.aggregate(metrics)
+                self.write_prometheus()
+        return metrics
+
+    def aggregate(self, metrics):
+        label = metrics['label'] or ''
+        self.totals[('queries_total', (('label', label), ('state', metrics['state'])))] += 1
+        for name in TIMING_FIELDS:
+            phase = name[:-len('_ms')]
+            self.totals[('query_seconds_total', (('label', label), ('phase', phase)))] += metrics[name] / 1000.0
+        self.totals[('data_scanned_bytes_total', (('label', label),))] += metrics['data_scanned_bytes']
+        self.totals[('cost_usd_total', (('label', label),))] += metrics['cost_usd']
+        self.totals[('retries_total', (('label', label),))] += metrics['retries']
+        self.totals[('cached_total', (('label', label),))] += int(metrics['cached'])
+
+    def write_prometheus(self):
+        """Rewrite the textfile atomically so the collector never reads a partial file"""
+        lines = []
+        for metric in sorted({m for m, _ in self.totals}):
+            lines.append(f"# TYPE cc_athena_{metric} counter")
+            for (name, labels), value in sorted(self.totals.items()):
+                if name != metric:
+                    continue
+                label_str = ','.join(f'{k}="{prometheus_escape(v)}"' for k, v in labels)
+                value = int(value) if value == int(value) else round(value, 6)
+                lines.append(f"cc_athena_{metric}{{{label_str}}} {value}")
+        tmp_path = f"{self.prometheus_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.prometheus_path)
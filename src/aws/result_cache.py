@@ -0,0 +1,124 @@
+"""
+Local cache of Athena query executions and small result sets.
+
+Entries are keyed by a hash of the normalized SQL plus caller-supplied input
+fingerprints (S3 ETags of the tables' data, crawl id, ...), so a repeat run
+over unchanged inputs skips Athena entirely. Small results are stored
+whole; for big ones only the execution (id, output location) is kept and
+rows are read back from Athena as usual. Stored in SQLite with TTL and
+least-recently-used eviction.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+
+from src.aws.cdx_export import split_s3_url
+
+DEFAULT_CACHE_PATH = '.cache/results.sqlite'
+
+
+def normalize_sql(query):
+    """Collapse whitespace and drop a trailing ';' (literals are left untouched)"""
+    return re.sub(r'\s+', ' ', query).strip().rstrip(';').strip()
+
+
+def cache_key(query, inputs=()):
+    digest = hashlib.sha256(normalize_sql(query).encode('utf-8'))
+    for item in sorted(str(i) for i in inputs):
+        digest.update(b'\0' + item.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def s3_prefix_fingerprint(s3, s3_url):
+    """Fingerprint of every object under an S3 prefix (keys + ETags)"""
+    bucket, prefix = split_s3_url(s3_url)
+    digest = hashlib.sha256()
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            digest.update(f"{obj['Key']}\0{obj['ETag']}\n".encode('utf-8'))
+    return f"{s3_url}@{digest.hexdigest()[:16]}"
+
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=7 * 24 * 3600,
+                 max_entries=1000, max_rows=10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS executions (
+                  key TEXT PRIMARY KEY, execution_id TEXT, response BLOB,
+                  created REAL, last_used REAL)""")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                  execution_id TEXT PRIMARY KEY, result BLOB,
+                  created REAL, last_used REAL)""")
+
+    def lookup(self, table, column, value):
+        with self.lock:
+            row = self.db.execute(
+                f"SELECT {'response' if table == 'executions' else 'result'}, created "
+                f"FROM {table} WHERE {column} = ?", (value,)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            with self.db:
+                if now - row[1] > self.ttl_seconds:
+                    self.db.execute(f"DELETE FROM {table} WHERE {column} = ?", (value,))
+                    return None
+                self.db.execute(f"UPDATE {table} SET last_used = ? WHERE {column} = ?", (now, value))
+        return pickle.loads(row[0])
+
+    def get_execution(self, key):
+        """Cached get_query_execution response for a query key, or None"""
+        return self.lookup('executions', 'key', key)
+
+    def get_result(self, execution_id):
+        """Cached {'columns', 'rows'} of an execution, or None"""
+        return self.lookup('results', 'execution_id', execution_id)
+
+    def put_execution(self, key, response):
+        now = time.time()
+        execution_id = response['QueryExecution']['QueryExecutionId']
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO executions VALUES (?, ?, ?, ?, ?)",
+                            (key, execution_id, pickle.dumps(response), now, now))
+            self.evict('executions')
+
+    def put_result(self, execution_id, result):
+        """Store a full result set if it is small enough; returns whether it was stored"""
+        if len(result['rows']) > self.max_rows:
+            return False
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                            (execution_id, pickle.dumps(result), now, now))
+            self.evict('results')
+        return True
+
+    def discard(self, key):
+        """Forget a cached execution (e.g. its output was deleted)"""
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM executions WHERE key = ?", (key,))
+
+    def evict(self, table):
+        """Drop expired entries, then the least recently used beyond max_entries (lock held)"""
+        self.db.execute(f"DELETE FROM {table} WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self.db.execute(f"""
+            DELETE FROM {table} WHERE rowid IN (
+              SELECT rowid FROM {table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                        (self.max_entries,))
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,525 @@
+"""
+Multi-job CDX export scheduler with a local SQLite job store.
+
+A job is one (crawl, domain set, export options) export. Jobs never touch
+src/config/aws_config.json: each gets its own domains table and view
+(default.cdx_job_<id>_domains[_norm]) and output prefix, and its result
+(output location, execution ids, bytes scanned) is recorded in
+.cache/jobs.sqlite.
+
+A job runs as phases: domains table, domains view, TLDs, one UNLOAD per
+shard, cleanup. The queries of every running job's current phase share one
+pool of in-flight queries, so the workgroup's concurrency quota stays packed
+instead of jobs running one after another. The pool size follows AIMD: it
+grows by one per pool-full of successful queries and is halved, with
+exponential backoff before the next start, on TooManyRequestsException or
+throttling.
+
+Every query is started with a ClientRequestToken derived from (job, step,
+attempt), and attempts and execution ids are written to the store as they
+change, so a scheduler restarted after a crash re-attaches to the queries it
+had in flight instead of starting them again. A failed job still runs its
+cleanup phase, so its domains table and view don't outlive it.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from botocore.exceptions import ClientError
+
+from src.aws.cdx_export import (
+    MAX_TLD_PREDICATE, build_export_select, build_tlds_sql, build_tombstones_select, build_unload_sql,
+    clear_prefix, shard_prefix, tombstones_prefix,
+)
+from src.aws.schema import SchemaBootstrap, domains_csv_ddl, domains_norm_ddl
+
+DEFAULT_STORE_PATH = '.cache/jobs.sqlite'
+JOB_STATES = ('queued', 'running', 'succeeded', 'failed')
+PHASES = ('domains', 'view', 'tlds', 'export', 'cleanup')
+THROTTLE_CODES = {'TooManyRequestsException', 'ThrottlingException', 'Throttling', 'SlowDown'}
+# Failures caused by throttling somewhere behind the query (e.g. S3 during UNLOAD)
+THROTTLE_REASON = re.compile(r'TooManyRequests|Throttl|Rate exceeded|SlowDown|reduce your request rate',
+                             re.IGNORECASE)
+
+
+def is_throttle(error):
+    return isinstance(error, ClientError) and error.response['Error']['Code'] in THROTTLE_CODES
+
+
+def request_token(job_id, step, attempt):
+    """ClientRequestToken (32+ chars): the same attempt always maps to the same execution"""
+    return hashlib.sha256(f"{job_id}/{step}/{attempt}".encode('utf-8')).hexdigest()[:32]
+
+
+class JobStore:
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            # WAL: `list` can read while a scheduler is writing
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                  id TEXT PRIMARY KEY, spec TEXT, state TEXT, phase INTEGER,
+                  context TEXT, result TEXT, error TEXT, created REAL, updated REAL)""")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS steps (
+                  job_id TEXT, name TEXT, phase INTEGER, attempts INTEGER, failures INTEGER,
+                  execution_id TEXT, state TEXT, scanned_bytes INTEGER, updated REAL,
+                  PRIMARY KEY (job_id, name))""")
+
+    @staticmethod
+    def decode(row):
+        job = dict(row)
+        for field in ('spec', 'context', 'result'):
+            job[field] = json.loads(job[field]) if job[field] else None
+        return job
+
+    def add(self, spec):
+        """Queue a job; returns its id"""
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO jobs VALUES (?, ?, 'queued', 0, '{}', NULL, NULL, ?, ?)",
+                            (job_id, json.dumps(spec), now, now))
+        return job_id
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self.decode(row) if row else None
+
+    def jobs(self, states=None):
+        """Jobs in creation order, optionally only those in `states`"""
+        query, params = "SELECT * FROM jobs", ()
+        if states:
+            query += f" WHERE state IN ({', '.join('?' * len(states))})"
+            params = tuple(states)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY created", params).fetchall()
+        return [self.decode(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        for field in ('context', 'result'):
+            if field in fields:
+                fields[field] = json.dumps(fields[field])
+        fields['updated'] = time.time()
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                            (*fields.values(), job_id))
+
+    def steps(self, job_id):
+        with self.lock:
+            rows = self.db.execute("SELECT * FROM steps WHERE job_id = ?", (job_id,)).fetchall()
+        return {row['name']: dict(row) for row in rows}
+
+    def save_step(self, job_id, name, **fields):
+        fields['updated'] = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO steps (job_id, name, attempts, failures) VALUES (?, ?, 0, 0)",
+                            (job_id, name))
+            self.db.execute(f"UPDATE steps SET {', '.join(f'{k} = ?' for k in fields)} "
+                            f"WHERE job_id = ? AND name = ?", (*fields.values(), job_id, name))
+
+    def retry(self, job_id):
+        """Queue a failed job again; finished steps are kept, failed ones get fresh attempts.
+
+        Attempt numbers keep counting (they make the request tokens), only
+        the failure counts are reset. The job starts over from its domains
+        table and view, which the failed run's cleanup dropped.
+        """
+        recreate = tuple(PHASES.index(phase) for phase in ('domains', 'view', 'cleanup'))
+        with self.lock, self.db:
+            self.db.execute(f"UPDATE steps SET failures = 0, state = 'CANCELLED' WHERE job_id = ? "
+                            f"AND (state IS NOT 'SUCCEEDED' OR phase IN {recreate})", (job_id,))
+            self.db.execute("UPDATE jobs SET state = 'queued', phase = 0, error = NULL, updated = ? WHERE id = ?",
+                            (time.time(), job_id))
+
+
+class AimdLimit:
+    """Additive-increase/multiplicative-decrease cap on queries in flight"""
+
+    def __init__(self, maximum, minimum=1, decrease=0.5, backoff_initial=1.0, backoff_max=60.0):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.limit = float(maximum)
+        self.backoff = 0.0
+        self.resume_at = 0.0
+        self.throttles = 0
+
+    @property
+    def allowed(self):
+        return max(self.minimum, int(self.limit))
+
+    def ready(self):
+        return time.time() >= self.resume_at
+
+    def on_success(self, in_flight):
+        # Only grow while the pool is actually full, else the limit drifts up unused
+        if in_flight + 1 >= self.allowed:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+        self.backoff = 0.0
+
+    def on_throttle(self, in_flight):
+        """Athena refused a query: what was in flight is the real capacity right now"""
+        self.throttles += 1
+        self.limit = max(self.minimum, min(self.limit, in_flight) * self.decrease)
+        self.backoff = min(self.backoff_max, max(self.backoff_initial, self.backoff * 2))
+        self.resume_at = time.time() + self.backoff * random.uniform(0.5, 1.0)
+
+
+class ExportJob:
+    """Phases and queries of one export job (SQL only; running them is the scheduler's)"""
+
+    def __init__(self, row):
+        self.id = row['id']
+        self.spec = row['spec']
+        self.phase = row['phase']
+        self.context = row['context'] or {}
+        self.error = None  # set once the job has failed and only its cleanup is left
+        self.domains_table = f"default.cdx_job_{self.id}_domains"
+        self.domains_view = f"{self.domains_table}_norm"
+
+    @property
+    def out_prefix(self):
+        spec = self.spec
+        delta = f"-delta-from-{spec['delta_from']}" if spec.get('delta_from') else ""
+        return spec.get('out_prefix') or (f"{spec['results_location']}{spec['crawl_id']}-cdx-"
+                                          f"{spec['export_format']}{delta}/job={self.id}/")
+
+    def target(self, step):
+        """Output prefix of an UNLOAD step"""
+        if step == 'export':
+            return self.out_prefix
+        if step == 'tombstones':
+            return tombstones_prefix(self.out_prefix)
+        return shard_prefix(self.out_prefix, int(step.split('=')[1]))
+
+    def queries(self, phase):
+        spec = self.spec
+        if phase == 'domains':
+            return {'domains': domains_csv_ddl(spec['domains_location'], table=self.domains_table)}
+        if phase == 'view':
+            return {'domains_norm': domains_norm_ddl(view=self.domains_view, source=self.domains_table)}
+        if phase == 'tlds':
+            return {'tlds': build_tlds_sql(self.domains_view)} if spec.get('tld_pushdown', True) else {}
+        if phase == 'export':
+            shards = spec.get('shards', 1)
+            steps = {f"shard={s:02d}": s for s in range(shards)} if shards > 1 else {'export': None}
+            queries = {
+                step: build_unload_sql(
+                    build_export_select(spec['crawl_id'], spec['subset'], shard, shards if shards > 1 else None,
+                                        spec['export_format'], self.domains_view, self.context.get('tlds'),
+                                        spec.get('order_by_urlkey', False), spec.get('domain_limits'),
+                                        spec.get('delta_from')),
+                    self.target(step), spec['export_format'], spec.get('compression'))
+                for step, shard in steps.items()
+            }
+            if spec.get('tombstones'):
+                queries['tombstones'] = build_unload_sql(
+                    build_tombstones_select(spec['crawl_id'], spec['delta_from'], spec['subset'],
+                                            spec['export_format'], self.domains_view, self.context.get('tlds')),
+                    self.target('tombstones'), spec['export_format'], spec.get('compression'))
+            return queries
+        return {
+            'drop_view': f"DROP VIEW IF EXISTS {self.domains_view}",
+            'drop_table': f"DROP TABLE IF EXISTS {self.domains_table}",
+        }
+
+
+class ExportScheduler:
+    def __init__(self, client, store, athena_results, max_in_flight=20, max_attempts=3,
+                 partition_projection=False, schema_cache_path=None, use_schema_cache=True,
+                 recreate_ccindex=False):
+        self.client = client
+        self.store = store
+        self.athena_results = athena_results
+        self.limiter = AimdLimit(max_in_flight)
+        self.max_attempts = max_attempts
+        self.partition_projection = partition_projection
+        self.schema_cache_path = schema_cache_path
+        self.use_schema_cache = use_schema_cache
+        self.recreate_ccindex = recreate_ccindex
+        self.jobs = {}
+        self.pending = {}  # job id -> steps of the current phase not finished yet
+        self.ready = deque()  # (job, step, sql, resume)
+        self.in_flight = {}  # execution id -> (job, step)
+
+    # Job lifecycle
+
+    def open_phase(self, job):
+        """Queue the steps of job.phase not already finished, re-attaching to started ones"""
+        while job.phase < len(PHASES):
+            queries = job.queries(PHASES[job.phase])
+            steps = self.store.steps(job.id)
+            pending = {}
+            for step, sql in queries.items():
+                saved = steps.get(step, {})
+                if saved.get('state') == 'SUCCEEDED':
+                    continue
+                pending[step] = sql
+                if saved.get('execution_id') and saved.get('state') in (None, 'QUEUED', 'RUNNING'):
+                    self.in_flight[saved['execution_id']] = (job, step)
+                    self.client.active.add(saved['execution_id'])
+                else:
+                    # Started but no execution id recorded: the same token finds it again
+                    resume = bool(saved.get('attempts')) and not saved.get('execution_id') and not saved.get('state')
+                    self.ready.append((job, step, sql, resume))
+            if pending:
+                self.pending[job.id] = pending
+                return
+            self.finish_phase(job)
+
+    def finish_phase(self, job):
+        if job.error is not None:
+            # Cleanup after a failure: the stored phase stays where the job failed
+            self.pending.pop(job.id, None)
+            job.phase = len(PHASES)
+            return
+        job.phase += 1
+        self.store.update(job.id, phase=job.phase, context=job.context)
+        if job.phase == len(PHASES):
+            self.pending.pop(job.id, None)
+            self.succeed(job)
+
+    def succeed(self, job):
+        steps = self.store.steps(job.id)
+        exports = sorted(step for step in job.queries('export') if step != 'tombstones')
+        result = {
+            'crawl_id': job.spec['crawl_id'],
+            'output_location': job.out_prefix,
+            'format': job.spec['export_format'],
+            'shards': job.spec.get('shards', 1),
+            'execution_ids': [steps[step]['execution_id'] for step in exports],
+            'data_scanned_bytes': sum(s['scanned_bytes'] or 0 for s in steps.values()),
+            'tlds': job.context.get('tlds'),
+        }
+        if job.spec.get('delta_from'):
+            result['delta_from'] = job.spec['delta_from']
+        if job.spec.get('tombstones'):
+            result['tombstones'] = job.target('tombstones')
+        self.store.update(job.id, state='succeeded', result=result)
+        print(f"✅ Job {job.id} ({job.spec['crawl_id']}) exported to {job.out_prefix}")
+
+    def fail(self, job, error):
+        """Give up on a job: stop its other queries, drop its queued steps and run its cleanup"""
+        for execution_id, (other, _) in list(self.in_flight.items()):
+            if other.id == job.id:
+                del self.in_flight[execution_id]
+                try:
+                    self.client.athena.stop_query_execution(QueryExecutionId=execution_id)
+                except ClientError as e:
+                    print(f"⚠️ Could not cancel {execution_id}: {e}")
+                self.client.active.discard(execution_id)
+        self.ready = deque(item for item in self.ready if item[0].id != job.id)
+        self.pending.pop(job.id, None)
+        self.store.update(job.id, state='failed', error=error)
+        print(f"❌ Job {job.id} ({job.spec['crawl_id']}) failed: {error}")
+        job.error = error
+        if job.phase < PHASES.index('cleanup'):
+            job.phase = PHASES.index('cleanup')
+            self.open_phase(job)
+
+    # Queries
+
+    def start(self, job, step, sql, resume):
+        """Start one step; returns False if Athena throttled us (the step stays queued)"""
+        attempt = self.store.steps(job.id).get(step, {}).get('attempts') or 0
+        try:
+            if not resume:
+                attempt += 1
+                if PHASES[job.phase] == 'export':
+                    # Partial output of an earlier attempt would fail the UNLOAD
+                    clear_prefix(self.client.s3, job.target(step))
+                self.store.save_step(job.id, step, phase=job.phase, attempts=attempt, execution_id=None, state=None)
+            response = self.client.athena.start_query_execution(
+                QueryString=sql,
+                ResultConfiguration={'OutputLocation': self.athena_results},
+                WorkGroup=self.client.workgroup,
+                ClientRequestToken=request_token(job.id, step, attempt),
+            )
+        except ClientError as e:
+            if not is_throttle(e):
+                self.step_error(job, step, f"{step} could not start: {e}")
+                return True
+            self.limiter.on_throttle(len(self.in_flight))
+            print(f"🐢 Throttled ({e.response['Error']['Code']}): {len(self.in_flight)} in flight, "
+                  f"limit now {self.limiter.allowed}, pausing starts {self.limiter.backoff:.1f}s")
+            self.ready.appendleft((job, step, sql, True))
+            return False
+        execution_id = response['QueryExecutionId']
+        self.store.save_step(job.id, step, execution_id=execution_id, state='QUEUED')
+        self.in_flight[execution_id] = (job, step)
+        self.client.active.add(execution_id)
+        return True
+
+    def fill(self):
+        """Start ready steps up to the current limit; returns how many started"""
+        started = 0
+        while self.ready and len(self.in_flight) < self.limiter.allowed and self.limiter.ready():
+            if not self.start(*self.ready.popleft()):
+                break
+            started += 1
+        return started
+
+    def step_error(self, job, step, error):
+        """An API call for one step failed outright: fail its job (a cleanup step only warns)"""
+        if PHASES[job.phase] != 'cleanup':
+            self.fail(job, error)
+            return
+        print(f"⚠️ Job {job.id}: {error}; the table can be dropped by hand")
+        pending = self.pending.get(job.id, {})
+        pending.pop(step, None)
+        if not pending:
+            self.finish_phase(job)
+
+    def describe(self, ids):
+        """QueryExecutions for `ids`; a non-throttling error fails only the job it belongs to"""
+        batch = self.client.athena.batch_get_query_execution
+        try:
+            return batch(QueryExecutionIds=ids)['QueryExecutions']
+        except ClientError as e:
+            if is_throttle(e):
+                raise
+        # One bad id (e.g. a re-attached execution Athena no longer knows) fails the whole batch
+        executions = []
+        for execution_id in ids:
+            try:
+                executions += batch(QueryExecutionIds=[execution_id])['QueryExecutions']
+            except ClientError as e:
+                if is_throttle(e):
+                    raise
+                if execution_id in self.in_flight:
+                    job, step = self.in_flight.pop(execution_id)
+                    self.client.active.discard(execution_id)
+                    self.step_error(job, step, f"{step} ({execution_id}) could not be polled: {e}")
+        return executions
+
+    def poll(self, interval):
+        """One batch_get_query_execution round over everything in flight"""
+        ids = list(self.in_flight)
+        for i in range(0, len(ids), 50):  # API limit: 50 ids per call
+            try:
+                executions = self.describe(ids[i:i + 50])
+            except ClientError:
+                return False  # throttled
+            for execution in executions:
+                self.client.check_scan_budget(execution, interval)
+                execution_id = execution['QueryExecutionId']
+                if execution_id not in self.in_flight:
+                    continue
+                job, step = self.in_flight[execution_id]
+                state = execution['Status']['State']
+                scanned = execution.get('Statistics', {}).get('DataScannedInBytes', 0)
+                self.store.save_step(job.id, step, state=state, scanned_bytes=scanned)
+                if state in ('SUCCEEDED', 'FAILED', 'CANCELLED'):
+                    del self.in_flight[execution_id]
+                    self.client.record_metrics(execution, f"job={job.id} {step}")
+                    self.finished(job, step, execution)
+        return True
+
+    def finished(self, job, step, execution):
+        state = execution['Status']['State']
+        phase = PHASES[job.phase]
+        if state == 'SUCCEEDED':
+            self.limiter.on_success(len(self.in_flight))
+            if step == 'tlds':
+                rows = self.client.get_query_results(execution['QueryExecutionId'])['rows']
+                tlds = sorted(row['tld'] for row in rows if row['tld'])
+                job.context['tlds'] = tlds if len(tlds) <= MAX_TLD_PREDICATE else None
+                self.store.update(job.id, context=job.context)
+        else:
+            reason = self.client.failure_reason(execution)
+            if THROTTLE_REASON.search(reason):
+                self.limiter.on_throttle(len(self.in_flight) + 1)
+            failures = self.store.steps(job.id)[step]['failures'] + 1
+            self.store.save_step(job.id, step, failures=failures)
+            if execution['QueryExecutionId'] in self.client.budget_stops:
+                self.fail(job, f"{step}: {reason}")  # a retry would scan just as much
+                return
+            if phase == 'cleanup':
+                print(f"⚠️ Job {job.id}: {step} failed ({reason}); the table can be dropped by hand")
+            elif failures < self.max_attempts:
+                print(f"🔁 Job {job.id}: {step} failed ({reason}), retrying ({failures}/{self.max_attempts} failed)")
+                self.ready.append((job, step, self.pending[job.id][step], False))
+                return
+            else:
+                self.fail(job, f"{step} failed {failures} time(s): {reason}")
+                return
+
+        pending = self.pending.get(job.id, {})
+        pending.pop(step, None)
+        if not pending:
+            self.finish_phase(job)
+            if job.phase < len(PHASES):
+                self.open_phase(job)
+
+    # Main loop
+
+    def ensure_ccindex(self, jobs):
+        partitions = sorted({(crawl_id, job.spec['subset']) for job in jobs
+                             for crawl_id in (job.spec['crawl_id'], job.spec.get('delta_from')) if crawl_id})
+        print(f"🗂️  Ensuring ccindex partitions: {', '.join(f'{c}/{s}' for c, s in partitions)}")
+        schema = SchemaBootstrap(self.client, self.athena_results, cache_path=self.schema_cache_path,
+                                 use_cache=self.use_schema_cache, recreate_ccindex=self.recreate_ccindex)
+        schema.ensure_ccindex(partitions, partition_projection=self.partition_projection)
+
+    def run(self, job_ids=None):
+        """Run queued jobs and resume interrupted ones until all have finished"""
+        rows = self.store.jobs(states=('queued', 'running'))
+        if job_ids:
+            rows = [row for row in rows if row['id'] in job_ids]
+        jobs = [ExportJob(row) for row in rows]
+        if not jobs:
+            return {'succeeded': [], 'failed': []}
+        start_time = time.time()
+        self.ensure_ccindex(jobs)
+
+        for job in jobs:
+            self.jobs[job.id] = job
+            self.store.update(job.id, state='running')
+            self.open_phase(job)
+
+        interval = self.client.poll_initial
+        peak = 0
+        try:
+            while self.ready or self.in_flight:
+                if self.fill():
+                    interval = self.client.poll_initial
+                peak = max(peak, len(self.in_flight))
+                sleep_s, interval = self.client.next_poll_interval(interval)
+                if self.ready and not self.limiter.ready():
+                    sleep_s = min(sleep_s, max(0.0, self.limiter.resume_at - time.time()))
+                time.sleep(sleep_s)
+                if self.in_flight and not self.poll(interval):
+                    interval = min(interval * 2, self.client.poll_max)
+        except KeyboardInterrupt:
+            # Jobs stay 'running'. Steps we cancel are marked so the next run starts them
+            # again instead of re-attaching and counting the cancellation as a failure.
+            for job, step in self.in_flight.values():
+                self.store.save_step(job.id, step, state='CANCELLED')
+            self.client.cancel_all()
+            raise
+
+        states = {job_id: self.store.get(job_id)['state'] for job_id in self.jobs}
+        return {
+            'succeeded': [job_id for job_id, state in states.items() if state == 'succeeded'],
+            'failed': [job_id for job_id, state in states.items() if state == 'failed'],
+            'elapsed_s': round(time.time() - start_time, 1),
+            'peak_in_flight': peak,
+            'throttles': self.limiter.throttles,
+            'final_limit': self.limiter.allowed,
+        }
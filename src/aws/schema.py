@@ -0,0 +1,324 @@
+"""
+Cached, idempotent bootstrap of the Athena tables used by the CDX export.
+
+One list_table_metadata call tells us which tables/views exist. A local cache
+(.cache/schema.json) remembers the fingerprint of the DDL that created each
+object and the partitions already added, so a rerun with unchanged
+definitions skips every statement. Whatever is missing or stale runs in
+dependency waves, with the statements of each wave executed concurrently.
+
+A table is only dropped when the cache says we created it from a different
+DDL; anything else is created with IF NOT EXISTS and the existing table is
+adopted. default.ccindex is shared by every crawl and job, so it is never
+dropped unless `recreate_ccindex` is set (its partitions go with it).
+"""
+
+import hashlib
+import json
+import os
+import re
+
+DEFAULT_CACHE_PATH = '.cache/schema.json'
+CCINDEX_TABLE = 'default.ccindex'
+CCINDEX_LOCATION = 's3://commoncrawl/cc-index/table/cc-main/warc/'
+CCINDEX_SUBSETS = 'warc,robotstxt,crawldiagnostics,non200responses'
+
+
+def domains_csv_ddl(domains_location, table='default.domains_csv'):
+    return f"""
+        CREATE EXTERNAL TABLE IF NOT EXISTS {table} (
+          domain STRING
+        )
+        ROW FORMAT SERDE 'org.apache.hadoop.hive.serde2.OpenCSVSerde'
+        WITH SERDEPROPERTIES (
+          'separatorChar' = ',',
+          'quoteChar'     = '"',
+          'escapeChar'    = '\\\\'
+        )
+        LOCATION '{domains_location}'
+        TBLPROPERTIES ('skip.header.line.count'='1');
+        """
+
+
+def domains_parquet_ddl(domains_parquet_location):
+    """Domains already normalized and deduplicated by upload_data.py --format parquet"""
+    return f"""
+        CREATE EXTERNAL TABLE IF NOT EXISTS default.domains_parquet (
+          domain_norm STRING
+        )
+        STORED AS PARQUET
+        LOCATION '{domains_parquet_location}';
+        """
+
+
+def domains_norm_ddl(parquet=False, view='default.domains_norm', source=None):
+    if parquet:
+        # Normalized at ingestion (src/cdx/ingest.py): no CSV parsing or regex per query
+        return f"""
+        CREATE OR REPLACE VIEW {view} AS
+        SELECT domain_norm
+        FROM {source or 'default.domains_parquet'};
+        """
+    return f"""
+        CREATE OR REPLACE VIEW {view} AS
+        SELECT
+          REGEXP_REPLACE(LOWER(TRIM(domain)), '^www\\.', '') AS domain_norm
+        FROM {source or 'default.domains_csv'}
+        WHERE domain IS NOT NULL AND TRIM(domain) <> '';
+        """
+
+
+def ccindex_ddl(partition_projection=False):
+    """Official ccindex schema; with partition projection no ADD PARTITION is needed"""
+    properties = ""
+    if partition_projection:
+        properties = f"""
+        TBLPROPERTIES (
+          'projection.enabled'        = 'true',
+          'projection.crawl.type'     = 'injected',
+          'projection.subset.type'    = 'enum',
+          'projection.subset.values'  = '{CCINDEX_SUBSETS}',
+          'storage.location.template' = '{CCINDEX_LOCATION}crawl=${{crawl}}/subset=${{subset}}/'
+        )"""
+    return f"""
+        CREATE EXTERNAL TABLE IF NOT EXISTS default.ccindex (
+          url_surtkey                STRING,
+          url                        STRING,
+          url_host_name              STRING,
+          url_host_tld               STRING,
+          url_host_registered_domain STRING,
+          url_protocol               STRING,
+          url_port                   INT,
+          url_path                   STRING,
+          url_query                  STRING,
+          fetch_time                 TIMESTAMP,
+          fetch_status               SMALLINT,
+          content_digest             STRING,
+          content_mime_type          STRING,
+          content_mime_detected      STRING,
+          content_charset            STRING,
+          content_languages          STRING,
+          warc_filename              STRING,
+          warc_record_offset         INT,
+          warc_record_length         INT,
+          warc_segment               STRING
+        )
+        PARTITIONED BY (crawl STRING, subset STRING)
+        STORED AS PARQUET
+        LOCATION '{CCINDEX_LOCATION}'{properties};
+        """
+
+
+def add_partition_ddl(crawl_id, subset):
+    return f"""
+        ALTER TABLE default.ccindex
+        ADD IF NOT EXISTS PARTITION (crawl='{crawl_id}', subset='{subset}')
+        LOCATION '{CCINDEX_LOCATION}crawl={crawl_id}/subset={subset}/';
+        """
+
+
+def verify_partition_sql(crawl_id, subset):
+    return f"""
+        SELECT COUNT(1) AS cnt
+        FROM "default"."ccindex$partitions"
+        WHERE crawl='{crawl_id}' AND subset='{subset}';
+        """
+
+
+def fingerprint(sql):
+    """Hash of a statement with whitespace normalized"""
+    return hashlib.sha256(re.sub(r'\s+', ' ', sql).strip().encode('utf-8')).hexdigest()[:16]
+
+
+class SchemaObject:
+    """A table, view or partition, the DDL that creates it and what it depends on"""
+    __slots__ = ('name', 'ddl', 'kind', 'depends_on')
+
+    def __init__(self, name, ddl, kind='table', depends_on=()):
+        self.name = name
+        self.ddl = ddl
+        self.kind = kind
+        self.depends_on = tuple(depends_on)
+
+    @property
+    def short_name(self):
+        return self.name.split('.')[-1]
+
+
+class SchemaBootstrap:
+    def __init__(self, client, athena_results, cache_path=DEFAULT_CACHE_PATH,
+                 database='default', use_cache=True, recreate_ccindex=False):
+        # use_cache=False re-runs every statement; the cached fingerprints still
+        # decide whether an existing table is ours to drop
+        self.client = client
+        self.athena_results = athena_results
+        self.cache_path = cache_path
+        self.database = database
+        self.use_cache = use_cache
+        self.recreate_ccindex = recreate_ccindex
+        self.cache = self.load_cache()
+
+    def load_cache(self):
+        if self.cache_path and os.path.exists(self.cache_path):
+            with open(self.cache_path, 'r') as f:
+                return json.load(f)
+        return {'tables': {}, 'partitions': {}}
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        with open(self.cache_path, 'w') as f:
+            json.dump(self.cache, f, indent=2)
+
+    def catalog_tables(self, names):
+        """Existing tables/views among `names`, from a single list_table_metadata call"""
+        tables = {}
+        kwargs = {
+            'CatalogName': 'AwsDataCatalog',
+            'DatabaseName': self.database,
+            'Expression': '|'.join(names),
+        }
+        while True:
+            response = self.client.athena.list_table_metadata(**kwargs)
+            for table in response['TableMetadataList']:
+                tables[table['Name']] = table
+            if 'NextToken' not in response:
+                return tables
+            kwargs['NextToken'] = response['NextToken']
+
+    def is_current(self, obj, catalog, stale):
+        """True if `obj` exists and was created from this exact DDL (per the cache)"""
+        if not self.use_cache:
+            return False
+        if obj.kind == 'partition':
+            table, _, partition = obj.name.partition(':')
+            return table not in stale and partition in self.cache['partitions'].get(table, [])
+        table = catalog.get(obj.short_name)
+        cached = self.cache['tables'].get(obj.name)
+        if table is None or cached is None:
+            return False
+        return (cached['fingerprint'] == fingerprint(obj.ddl)
+                and cached.get('create_time') == str(table.get('CreateTime')))
+
+    def ensure_objects(self, objects):
+        """Create stale/missing objects in dependency waves, each wave run concurrently"""
+        names = [obj.short_name for obj in objects if obj.kind != 'partition']
+        catalog = self.catalog_tables(names)
+
+        todo = {}
+        for obj in objects:  # dependencies are listed before dependents
+            if not self.is_current(obj, catalog, todo):
+                todo[obj.name] = obj
+        skipped = [obj.name for obj in objects if obj.name not in todo]
+        created = []
+
+        # Only tables we created from a different definition are dropped (external
+        # tables: metadata only, no data is touched); others are adopted as they are
+        stale = [obj for obj in todo.values() if obj.kind == 'table' and obj.short_name in catalog
+                 and self.cache['tables'].get(obj.name, {}).get('fingerprint') not in (None, fingerprint(obj.ddl))]
+        if any(obj.name == CCINDEX_TABLE for obj in stale) and not self.recreate_ccindex:
+            raise RuntimeError(
+                f"{CCINDEX_TABLE} exists with a different definition than this run needs (e.g. "
+                f"--partition-projection changed). Dropping it removes the partitions every other crawl "
+                f"and job uses; pass --recreate-ccindex to do it anyway, or keep the previous options.")
+        drops = {obj.name for obj in stale}
+
+        while todo:
+            wave = [obj for obj in todo.values() if not any(dep in todo for dep in obj.depends_on)]
+            if not wave:
+                raise RuntimeError(f"Circular schema dependencies: {sorted(todo)}")
+
+            wave_drops = {f"drop {obj.name}": f"DROP TABLE IF EXISTS {obj.name}" for obj in wave
+                          if obj.name in drops}
+            for _ in self.client.execute_many(wave_drops, self.athena_results):
+                pass
+            for _ in self.client.execute_many({obj.name: obj.ddl for obj in wave}, self.athena_results):
+                pass
+
+            for obj in wave:
+                del todo[obj.name]
+                created.append(obj)
+
+        # Remember what we created or adopted, with the catalog's CreateTime so a
+        # table dropped or recreated elsewhere is noticed on the next run
+        if created:
+            catalog = self.catalog_tables(names)
+        for obj in created:
+            if obj.kind == 'partition':
+                table, _, partition = obj.name.partition(':')
+                self.cache['partitions'].setdefault(table, []).append(partition)
+            else:
+                self.cache['tables'][obj.name] = {
+                    'fingerprint': fingerprint(obj.ddl),
+                    'create_time': str(catalog.get(obj.short_name, {}).get('CreateTime')),
+                }
+                if obj.kind == 'table':
+                    self.cache['partitions'][obj.name] = []
+        self.save_cache()
+        return [obj.name for obj in created], skipped
+
+    def ccindex_objects(self, partitions, partition_projection=False):
+        """ccindex plus one partition object per (crawl_id, subset) unless projected"""
+        objects = [SchemaObject(CCINDEX_TABLE, ccindex_ddl(partition_projection))]
+        if not partition_projection:
+            objects += [SchemaObject(f"{CCINDEX_TABLE}:{crawl_id}/{subset}", add_partition_ddl(crawl_id, subset),
+                                     kind='partition', depends_on=[CCINDEX_TABLE])
+                        for crawl_id, subset in partitions]
+        return objects
+
+    def verify_partitions(self, created):
+        """Check newly added partitions via the metadata table (no data scan)"""
+        for name in created:
+            table, _, partition = name.partition(':')
+            if table != 'default.ccindex' or not partition:
+                continue
+            crawl_id, _, subset = partition.partition('/')
+            vx = self.client.execute_query(verify_partition_sql(crawl_id, subset), self.athena_results,
+                                           label=f"partition_check:{crawl_id}/{subset}")
+            vrows = self.client.get_query_results(vx['QueryExecution']['QueryExecutionId'])['rows']
+            if int(vrows[0]['cnt']) == 0:
+                self.cache['partitions']['default.ccindex'].remove(partition)
+                self.save_cache()
+                raise RuntimeError(f"Partition crawl={crawl_id}, subset={subset} not found after ADD PARTITION.")
+
+    def report(self, created, skipped):
+        if created:
+            print(f"   ✅ Created/updated: {', '.join(created)}")
+        if skipped:
+            print(f"   ♻️  Already current (cached): {', '.join(skipped)}")
+
+    def ensure(self, domains_location, crawl_id, subset, partition_projection=False,
+               domains_parquet_location=None, extra_crawls=()):
+        """Make sure the domains table, domains_norm, ccindex and the crawl partition exist.
+
+        With `domains_parquet_location`, domains_norm reads the ingested
+        Parquet shards instead of normalizing domains_csv on every query.
+        `extra_crawls` adds more crawl partitions (e.g. the previous crawl of
+        a delta export).
+        """
+        if domains_parquet_location:
+            domains = SchemaObject('default.domains_parquet', domains_parquet_ddl(domains_parquet_location))
+        else:
+            domains = SchemaObject('default.domains_csv', domains_csv_ddl(domains_location))
+        objects = [
+            domains,
+            SchemaObject('default.domains_norm', domains_norm_ddl(parquet=bool(domains_parquet_location)),
+                         kind='view', depends_on=[domains.name]),
+        ] + self.ccindex_objects([(c, subset) for c in (crawl_id, *extra_crawls)], partition_projection)
+
+        created, skipped = self.ensure_objects(objects)
+        self.verify_partitions(created)
+
+        if partition_projection:
+            partitions = ', '.join(f"crawl={c}/subset={subset}" for c in (crawl_id, *extra_crawls))
+            print(f"   ✅ Partition projection: {partitions} needs no ADD PARTITION")
+        self.report(created, skipped)
+        return created, skipped
+
+    def ensure_ccindex(self, partitions, partition_projection=False):
+        """Only ccindex and the given (crawl_id, subset) partitions, e.g. for several crawls at once"""
+        created, skipped = self.ensure_objects(self.ccindex_objects(partitions, partition_projection))
+        self.verify_partitions(created)
+        self.report(created, skipped)
+        return created, skipped
@@ -1,21 +1,32 @@
-import boto3
 import json
 import os
 from botocore.exceptions import ClientError
-from dotenv import load_dotenv
 
-# Load environment variables
-load_dotenv()
+from src.aws.clients import get_client
+
 
 class CommonCrawlAWSSetup:
     def __init__(self, bucket_name, region='us-east-1'):
         self.bucket_name = bucket_name
         self.region = region
-        self.s3 = boto3.client('s3', region_name=region)
-        self.athena = boto3.client('athena', region_name=region)
-        self.iam = boto3.client('iam', region_name=region)
-        self.cloudwatch = boto3.client('cloudwatch', region_name=region)
-        
+
+    # Clients are created on first use from the shared cache (src/aws/clients.py)
+    @property
+    def s3(self):
+        return get_client('s3', self.region)
+
+    @property
+    def athena(self):
+        return get_client('athena', self.region)
+
+    @property
+    def iam(self):
+        return get_client('iam', self.region)
+
+    @property
+    def cloudwatch(self):
+        return get_client('cloudwatch', self.region)
+
     def create_s3_bucket(self):
         """Create S3 bucket with required folders"""
         try:
@@ -89,7 +100,7 @@ class CommonCrawlAWSSetup:
     def get_aws_credentials_info(self):
         """Display current AWS configuration"""
         try:
-            sts = boto3.client('sts')
+            sts = get_client('sts', self.region)
             identity = sts.get_caller_identity()
             print(f"🔑 AWS Account: {identity['Account']}")
             print(f"🔑 AWS User/Role: {identity['Arn']}")
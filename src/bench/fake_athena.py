@@ -0,0 +1,319 @@
+"""
+Fake Athena for orchestration benchmarks.
+
+Implements the Athena calls AthenaClient makes with a simple timing model:
+every query waits `latencies['QUEUED']` seconds, then takes one of
+`max_concurrent` running slots (FIFO) for a per-statement-kind RUNNING
+latency (ddl, select, unload + unload_per_million records). Starting a query
+while `max_active` are unfinished raises TooManyRequestsException, as Athena
+does past the workgroup's quota; a repeated ClientRequestToken returns the
+execution it first started.
+
+Answers are just enough for run_cc_query.py: the domains count, the TLD
+list, partition checks, catalog listings and UNLOADs, which write gzipped
+CDX JSON files into the S3 stand-in. `SELECT ... FROM bench_rows LIMIT n`
+returns n generated rows for result-path benchmarks.
+
+The fake records when each query finished and when a client first saw it
+finished, so polling lag can be separated from Athena's own time.
+"""
+
+import datetime
+import gzip
+import heapq
+import itertools
+import re
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+from src.aws.cdx_export import split_s3_url
+
+DEFAULT_LATENCIES = {
+    'QUEUED': 0.05,
+    'ddl': 0.3,
+    'select': 0.5,
+    'unload': 1.0,
+    'unload_per_million': 2.0,
+}
+
+RECORD_TEMPLATE = (
+    '{{"urlkey":"com,{host})/p{i}","timestamp":"20250701000000","url":"https://{host}.com/p{i}",'
+    '"mime":"text/html","mime-detected":"text/html","status":"200","digest":"sha1:B{i:032d}",'
+    '"length":"{length}","offset":"{offset}","filename":"crawl-data/CC-MAIN-2025-30/segments/{segment}.warc.gz",'
+    '"languages":"eng","encoding":"UTF-8"}}'
+)
+
+
+class CountingProxy:
+    """Counts calls per method name on the wrapped client"""
+
+    def __init__(self, target):
+        self.target = target
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with self.lock:
+                self.calls[name] += 1
+            return attr(*args, **kwargs)
+        return call
+
+
+def too_many_requests():
+    return ClientError({'Error': {'Code': 'TooManyRequestsException',
+                                  'Message': 'Too many queries already running'}}, 'StartQueryExecution')
+
+
+class FakeAthena:
+    def __init__(self, s3, domains=1000, records_per_domain=1.0, max_output_records=1_000_000,
+                 records_per_file=100_000, tlds=('com', 'net', 'org'), latencies=None,
+                 max_concurrent=20, max_active=None, scan_bytes=50 * 1024**3):
+        self.s3 = s3
+        self.domains = domains
+        self.records_per_domain = records_per_domain
+        self.max_output_records = max_output_records
+        self.records_per_file = records_per_file
+        self.tlds = list(tlds)
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+        self.max_concurrent = max_concurrent
+        self.max_active = max_active
+        self.scan_bytes = scan_bytes
+        self.lock = threading.Lock()
+        self.counter = itertools.count()
+        self.slots = [0.0] * max_concurrent  # heap of times a running slot frees up
+        self.queries = {}
+        self.tokens = {}  # ClientRequestToken -> execution id
+        self.tables = {}
+        self.file_cache = {}
+
+    # Timing model
+
+    def statement_kind(self, sql):
+        text = sql.lstrip().upper()
+        if text.startswith(('CREATE', 'DROP', 'ALTER')):
+            return 'ddl'
+        if text.startswith('UNLOAD'):
+            return 'unload'
+        return 'select'
+
+    def running_latency(self, kind, records=0):
+        if kind == 'unload':
+            return self.latencies['unload'] + self.latencies['unload_per_million'] * records / 1e6
+        return self.latencies[kind]
+
+    def state(self, query, now):
+        if now >= query['finish']:
+            if query['observed'] is None:
+                query['observed'] = now
+            return 'SUCCEEDED' if query['error'] is None else 'FAILED'
+        return 'RUNNING' if now >= query['start'] else 'QUEUED'
+
+    def execution(self, execution_id):
+        query = self.queries[execution_id]
+        now = time.time()
+        state = self.state(query, now)
+        if state == 'RUNNING':
+            progress = (now - query['start']) / max(query['finish'] - query['start'], 1e-9)
+        else:
+            progress = 1.0 if state in ('SUCCEEDED', 'FAILED') else 0.0
+        status = {'State': state, 'SubmissionDateTime': datetime.datetime.fromtimestamp(query['submit'])}
+        if query['error']:
+            status['StateChangeReason'] = query['error']
+        queued_ms = int((query['start'] - query['submit']) * 1000)
+        engine_ms = int((query['finish'] - query['start']) * 1000)
+        return {
+            'QueryExecutionId': execution_id,
+            'Query': query['sql'],
+            'ResultConfiguration': {'OutputLocation': query['output_location']},
+            'Status': status,
+            'Statistics': {
+                'DataScannedInBytes': int(query['scan_bytes'] * progress),
+                'QueryQueueTimeInMillis': queued_ms if progress else 0,
+                'EngineExecutionTimeInMillis': engine_ms if progress == 1.0 else 0,
+                'QueryPlanningTimeInMillis': 0,
+                'ServiceProcessingTimeInMillis': 0,
+                'TotalExecutionTimeInMillis': queued_ms + engine_ms if progress == 1.0 else 0,
+            },
+        }
+
+    # Answers
+
+    def answer(self, sql, execution_id):
+        """(columns, rows, output records, bytes scanned) for a statement"""
+        created = re.match(r'\s*CREATE\s+(?:EXTERNAL\s+TABLE|OR\s+REPLACE\s+VIEW)\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+                           r'[\w"]+\.([\w"]+)', sql, re.IGNORECASE)
+        if created:
+            self.tables[created.group(1)] = datetime.datetime.now()
+            return [], [], 0, 0
+        if self.statement_kind(sql) == 'ddl':
+            return [], [], 0, 0
+        if self.statement_kind(sql) == 'unload':
+            return [], [], self.unload(sql, execution_id), self.scan_bytes
+        if 'ccindex$partitions' in sql:
+            return [('cnt', 'bigint')], [(1,)], 0, 0
+        if re.search(r'\bAS\s+tld\b', sql, re.IGNORECASE):
+            return [('tld', 'varchar')], [(tld,) for tld in self.tlds], 0, 1024**2
+        if re.search(r'\bAS\s+cnt\b', sql, re.IGNORECASE):
+            return [('cnt', 'bigint')], [(self.domains,)], 0, 1024**2
+        rows = re.search(r'FROM\s+bench_rows\s+LIMIT\s+(\d+)', sql, re.IGNORECASE)
+        if rows:
+            columns = [('id', 'bigint'), ('domain', 'varchar'), ('pages', 'integer'), ('ts', 'timestamp')]
+            return columns, BenchRows(int(rows.group(1))), 0, 0
+        return [], [], 0, 0
+
+    def output_file(self, records):
+        """Gzipped CDX JSON lines, built once per size and reused for every file"""
+        if records not in self.file_cache:
+            lines = [RECORD_TEMPLATE.format(host=f"host{i % 5000}", i=i, length=1000 + i % 50000,
+                                            offset=i * 7919, segment=i % 900)
+                     for i in range(records)]
+            self.file_cache[records] = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'), 1)
+        return self.file_cache[records]
+
+    def write_result_csv(self, output_location, columns, rows, batch=100_000):
+        """Athena leaves every result as <OutputLocation>/<id>.csv (read by iter_s3_query_results)"""
+        lines = [','.join(f'"{name}"' for name, _ in columns)]
+        for start in range(0, len(rows), batch):
+            lines.extend(','.join('' if v is None else f'"{v}"' for v in row)
+                         for row in rows[start:start + batch])
+        bucket, key = split_s3_url(output_location)
+        self.s3.put_object(Bucket=bucket, Key=key, Body=('\n'.join(lines) + '\n').encode('utf-8'))
+
+    def unload(self, sql, execution_id):
+        to = re.search(r"\bTO\s+'([^']*)'", sql).group(1)
+        records = min(int(self.domains * self.records_per_domain), self.max_output_records)
+        shard = re.search(r'%\s*(\d+)\s*=\s*(\d+)', sql)
+        if shard:
+            records //= int(shard.group(1))
+        bucket, prefix = split_s3_url(to)
+        part = 0
+        remaining = records
+        while remaining > 0:
+            n = min(remaining, self.records_per_file)
+            self.s3.put_object(Bucket=bucket, Key=f"{prefix}{execution_id}_{part:05d}.gz",
+                               Body=self.output_file(n))
+            remaining -= n
+            part += 1
+        return records
+
+    # Athena API
+
+    def start_query_execution(self, QueryString, ResultConfiguration, WorkGroup=None,
+                              ClientRequestToken=None, **kwargs):
+        with self.lock:
+            if ClientRequestToken in self.tokens:
+                return {'QueryExecutionId': self.tokens[ClientRequestToken]}
+            now = time.time()
+            if self.max_active is not None:
+                active = sum(1 for q in self.queries.values() if q['finish'] > now)
+                if active >= self.max_active:
+                    raise too_many_requests()
+            execution_id = f"bench-{next(self.counter):06d}"
+            error = None
+            try:
+                columns, rows, records, scan_bytes = self.answer(QueryString, execution_id)
+            except Exception as e:
+                columns, rows, records, scan_bytes, error = [], [], 0, 0, str(e)
+            kind = self.statement_kind(QueryString)
+            ready = now + self.latencies['QUEUED']
+            start = max(ready, heapq.heappop(self.slots))
+            finish = start + self.running_latency(kind, records)
+            heapq.heappush(self.slots, finish)
+            output_location = f"{ResultConfiguration['OutputLocation'].rstrip('/')}/{execution_id}.csv"
+            if columns:
+                self.write_result_csv(output_location, columns, rows)
+            self.queries[execution_id] = {
+                'sql': QueryString, 'kind': kind, 'submit': now, 'start': start, 'finish': finish,
+                'observed': None, 'error': error, 'columns': columns, 'rows': rows,
+                'scan_bytes': scan_bytes, 'output_location': output_location,
+            }
+            if ClientRequestToken is not None:
+                self.tokens[ClientRequestToken] = execution_id
+        return {'QueryExecutionId': execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        with self.lock:
+            return {'QueryExecution': self.execution(QueryExecutionId)}
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        with self.lock:
+            return {'QueryExecutions': [self.execution(i) for i in QueryExecutionIds],
+                    'UnprocessedQueryExecutionIds': []}
+
+    def stop_query_execution(self, QueryExecutionId):
+        with self.lock:
+            query = self.queries[QueryExecutionId]
+            now = time.time()
+            if now < query['finish']:
+                query['finish'] = now
+                query['error'] = 'Query cancelled by user'
+        return {}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000, NextToken=None):
+        query = self.queries[QueryExecutionId]
+        columns = query['columns']
+        start = int(NextToken or 0)
+        header = start == 0 and bool(columns)
+        end = min(len(query['rows']), start + MaxResults - header)
+        page = [[name for name, _ in columns]] if header else []
+        page.extend(query['rows'][start:end])
+        response = {'ResultSet': {
+            'Rows': [{'Data': [{} if v is None else {'VarCharValue': str(v)} for v in row]} for row in page],
+            'ResultSetMetadata': {'ColumnInfo': [{'Name': name, 'Type': t} for name, t in columns]},
+        }}
+        if end < len(query['rows']):
+            response['NextToken'] = str(end)
+        return response
+
+    def list_table_metadata(self, CatalogName, DatabaseName, Expression=None, NextToken=None, **kwargs):
+        return {'TableMetadataList': [{'Name': name, 'CreateTime': created}
+                                      for name, created in sorted(self.tables.items())
+                                      if Expression is None or re.fullmatch(Expression, name)]}
+
+    # Measurements
+
+    def query_stats(self):
+        """Athena-busy time (union of submit..finish intervals) and polling lag per query"""
+        intervals = sorted((q['submit'], q['finish']) for q in self.queries.values())
+        busy = 0.0
+        current_start, current_end = None, None
+        for start, end in intervals:
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    busy += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            busy += current_end - current_start
+        lags = [q['observed'] - q['finish'] for q in self.queries.values() if q['observed'] is not None]
+        return {
+            'queries': len(self.queries),
+            'by_kind': dict(Counter(q['kind'] for q in self.queries.values())),
+            'athena_busy_s': round(busy, 3),
+            'poll_lag_mean_s': round(sum(lags) / len(lags), 3) if lags else None,
+            'poll_lag_max_s': round(max(lags), 3) if lags else None,
+        }
+
+
+class BenchRows:
+    """Lazily generated result rows (sliceable, with a length) so large results cost no memory"""
+
+    def __init__(self, n):
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, index):
+        return [(i, f"domain{i}.com", i % 1000, '2025-07-01 10:00:00.000')
+                for i in range(*index.indices(self.n))]
+
@@ -0,0 +1,190 @@
+"""
+Orchestration benchmarks: our own overhead around Athena and S3.
+
+Each scenario runs three paths against FakeAthena (src/bench/fake_athena.py)
+and a LocalS3 stand-in (src/aws/local_s3.py), both wrapped to count API
+calls:
+
+- end_to_end: run_cc_query.main in a scratch directory (its own config file,
+  metrics log and S3 root), reporting wall time, Athena's busy time, the
+  difference (our overhead: polling lag, DDL round trips, config rewrites,
+  result parsing) and API call counts;
+- results: get_query_results (paged API) and iter_query_results(from_s3=True)
+  over a large result, in rows/s;
+- download: ExportDownloader re-sharding the UNLOAD output, in records/s.
+
+Domain counts only change what the fake reports and how much it writes;
+output records are capped (max_output_records) so 10M-domain scenarios stay
+runnable on a laptop.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from functools import partial
+
+from src.aws.athena_client import AthenaClient
+from src.aws.download import ExportDownloader
+from src.aws.local_s3 import LocalS3
+from src.bench.fake_athena import CountingProxy, FakeAthena
+
+SCENARIOS = {
+    '1k': {'domains': 1_000, 'shards': 1},
+    '100k': {'domains': 100_000, 'shards': 4},
+    '10m': {'domains': 10_000_000, 'shards': 16},
+}
+
+BUCKET = 'bench'
+
+
+def bench_config():
+    return {
+        'bucket_name': BUCKET,
+        'region': 'us-east-1',
+        'results_location': f"s3://{BUCKET}/results/",
+        'athena_results_location': f"s3://{BUCKET}/athena-results/",
+        'domains_location': f"s3://{BUCKET}/domains/",
+    }
+
+
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+class Benchmark:
+    def __init__(self, work_dir=None, latencies=None, max_concurrent=20, max_output_records=1_000_000,
+                 result_rows=1_000_000, quiet=True):
+        self.work_dir = work_dir
+        self.latencies = latencies
+        self.max_concurrent = max_concurrent
+        self.max_output_records = max_output_records
+        self.result_rows = result_rows
+        self.quiet = quiet
+
+    def stand_ins(self, root, domains):
+        s3 = CountingProxy(LocalS3(os.path.join(root, 's3')))
+        athena = CountingProxy(FakeAthena(s3.target, domains=domains, latencies=self.latencies,
+                                          max_concurrent=self.max_concurrent,
+                                          max_output_records=self.max_output_records))
+        return athena, s3
+
+    def end_to_end(self, root, domains, shards):
+        """run_cc_query.main against the fakes; returns (stats, export prefix)"""
+        import run_cc_query
+
+        athena, s3 = self.stand_ins(root, domains)
+        os.makedirs(os.path.join(root, 'src', 'config'), exist_ok=True)
+        with open(os.path.join(root, 'src', 'config', 'aws_config.json'), 'w') as f:
+            json.dump(bench_config(), f, indent=2)
+        s3.target.put_object(Bucket=BUCKET, Key='domains/domains.csv', Body=b'domain\nexample.com\n')
+
+        argv = ['--no-result-cache', '--no-schema-cache', '--shards', str(shards)]
+        output = io.StringIO()
+        original = run_cc_query.AthenaClient
+        run_cc_query.AthenaClient = partial(AthenaClient, engine=athena, s3=s3)
+        try:
+            with working_directory(root), contextlib.redirect_stdout(output if self.quiet else sys.stdout):
+                start = time.perf_counter()
+                rc = run_cc_query.main(argv)
+                elapsed = time.perf_counter() - start
+        finally:
+            run_cc_query.AthenaClient = original
+        if rc != 0:
+            raise RuntimeError(f"run_cc_query failed (rc={rc}):\n{output.getvalue()[-2000:]}")
+
+        with open(os.path.join(root, 'src', 'config', 'aws_config.json')) as f:
+            out_prefix = json.load(f)['last_cdx_export']['output_location']
+        query_stats = athena.target.query_stats()
+        return {
+            'seconds': round(elapsed, 3),
+            'athena_busy_s': query_stats['athena_busy_s'],
+            'overhead_s': round(elapsed - query_stats['athena_busy_s'], 3),
+            'poll_lag_mean_s': query_stats['poll_lag_mean_s'],
+            'poll_lag_max_s': query_stats['poll_lag_max_s'],
+            'queries': query_stats['by_kind'],
+            'athena_calls': dict(athena.calls),
+            's3_calls': dict(s3.calls),
+            'domains_per_s': rate(domains, elapsed),
+        }, out_prefix
+
+    def results(self, root, rows):
+        """Paged API vs S3 CSV result reads for one large SELECT"""
+        athena, s3 = self.stand_ins(root, rows)
+        client = AthenaClient(engine=athena, s3=s3)
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.execute_query(f"SELECT * FROM bench_rows LIMIT {rows}",
+                                            f"s3://{BUCKET}/athena-results/")
+        execution_id = response['QueryExecution']['QueryExecutionId']
+        stats = {'rows': rows}
+        for name, from_s3 in (('api', False), ('s3', True)):
+            calls_before = sum(athena.calls.values()) + sum(s3.calls.values())
+            start = time.perf_counter()
+            count = sum(1 for _ in client.iter_query_results(execution_id, from_s3=from_s3))
+            elapsed = time.perf_counter() - start
+            stats[name] = {
+                'seconds': round(elapsed, 3),
+                'rows_per_s': rate(count, elapsed),
+                'api_calls': sum(athena.calls.values()) + sum(s3.calls.values()) - calls_before,
+            }
+        return stats
+
+    def download(self, root, s3_root, out_prefix):
+        s3 = CountingProxy(LocalS3(s3_root))
+        downloader = ExportDownloader(s3, os.path.join(root, 'download'), num_shards=16)
+        start = time.perf_counter()
+        stats = downloader.run(out_prefix)
+        elapsed = time.perf_counter() - start
+        return {
+            'objects': stats['objects'],
+            'records': stats['records'],
+            'bytes': stats['bytes_downloaded'],
+            'seconds': round(elapsed, 3),
+            'records_per_s': rate(stats['records'], elapsed),
+            'mb_per_s': rate(stats['bytes_downloaded'] / 1024**2, elapsed),
+            's3_calls': dict(s3.calls),
+        }
+
+    def run_scenario(self, name, domains, shards):
+        root = tempfile.mkdtemp(prefix=f"cc-bench-{name}-", dir=self.work_dir)
+        try:
+            end_to_end, out_prefix = self.end_to_end(os.path.join(root, 'e2e'), domains, shards)
+            return {
+                'scenario': name,
+                'domains': domains,
+                'shards': shards,
+                'end_to_end': end_to_end,
+                'results': self.results(os.path.join(root, 'results'), min(domains, self.result_rows)),
+                'download': self.download(root, os.path.join(root, 'e2e', 's3'), out_prefix),
+            }
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    def run(self, names):
+        return {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {
+                'latencies': FakeAthena(None, latencies=self.latencies).latencies,
+                'max_concurrent': self.max_concurrent,
+                'max_output_records': self.max_output_records,
+                'result_rows': self.result_rows,
+            },
+            'scenarios': [self.run_scenario(name, **SCENARIOS[name]) for name in names],
+        }
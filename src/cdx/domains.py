@@ -0,0 +1,55 @@
+"""
+Local domain list handling that mirrors the Athena side.
+
+normalize_domain() must stay in sync with the domains_norm view in
+src/aws/schema.py: REGEXP_REPLACE(LOWER(TRIM(domain)), '^www\\.', '').
+"""
+
+import csv
+import gzip
+import hashlib
+import re
+
+WWW_PREFIX = re.compile(r'^www\.')
+
+
+def normalize_domain(domain):
+    """Normalize like domains_norm; returns None for blank values"""
+    if domain is None:
+        return None
+    domain = domain.strip()
+    if not domain:
+        return None
+    return WWW_PREFIX.sub('', domain.lower())
+
+
+def domain_hash(domain_norm):
+    """64-bit hash of a normalized domain, for compact membership arrays"""
+    return int.from_bytes(hashlib.blake2b(domain_norm.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def open_text(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    return opener(path, 'rt', encoding='utf-8', newline='')
+
+
+def iter_domain_file(path):
+    """Yield normalized domains from a CSV (first column, 'domain' header) or plain list"""
+    with open_text(path) as f:
+        for i, row in enumerate(csv.reader(f)):
+            if not row:
+                continue
+            if i == 0 and row[0].strip().lower() == 'domain':
+                continue
+            domain = normalize_domain(row[0])
+            if domain:
+                yield domain
+
+
+def write_domain_csv(domains, path):
+    """Write domains as a single-column CSV with a 'domain' header (the domains_csv layout)"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['domain'])
+        for domain in domains:
+            writer.writerow([domain])
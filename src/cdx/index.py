@@ -0,0 +1,294 @@
+"""
+Local CDX index: exported records sorted by urlkey in one memory-mapped file.
+
+Layout (little-endian):
+- header: magic, version, record size, record count and section offsets
+- records: fixed-width RECORD structs sorted by (urlkey, timestamp), so
+  record i is at records_offset + i * RECORD.size
+- heap: each record's urlkey, url and digest bytes, back to back
+- tables: JSON lists of the interned low-cardinality strings (filename,
+  mime, mime-detected, languages, encoding); records hold their indexes
+
+Opening is just an mmap: lookups binary-search the records for the urlkey
+ranges of a URL, URL prefix, host or host subtree (the host and all its
+subdomains, on any port; O(log n) page reads) and decode only the matching
+records, in the export's JSON record shape.
+
+Building is an external sort: records are sorted in runs of `run_records`,
+spilled to temporary files and k-way merged straight into the index file.
+"""
+
+import heapq
+import json
+import marshal
+import mmap
+import os
+import re
+import struct
+import tempfile
+from urllib.parse import urlsplit
+
+from src.cdx.records import CDX_FIELDS, expand_paths, is_parquet, iter_jsonl_records, iter_parquet_records, to_cdx_json
+
+MAGIC = b'CDXIDX01'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQQQQ')  # magic, version, record size, count, records/heap/tables offsets, tables size
+# heap offset, urlkey/url/digest lengths, timestamp, offset, length, status, interned string ids
+RECORD = struct.Struct('<QIIHQQIHIIIII')
+KEY = struct.Struct('<QI')  # leading heap offset + urlkey length of a record
+TIMESTAMP = struct.Struct('<Q')
+TIMESTAMP_AT = struct.calcsize('<QIIH')
+INTERNED = ['filename', 'mime', 'mime-detected', 'languages', 'encoding']
+MATCH_TYPES = ('exact', 'prefix', 'host', 'domain')
+WWW_PREFIX = re.compile(r'^www\d*\.')
+DEFAULT_PORTS = {'http': '80', 'https': '443'}
+
+
+def surt_host(host):
+    """example.com -> com,example (lowercased, leading www. dropped)"""
+    host = WWW_PREFIX.sub('', host.lower().strip('.'))
+    return ','.join(reversed(host.split('.')))
+
+
+def surt_key(url):
+    """SURT urlkey of a URL, close to the surt package's defaults used by ccindex.
+
+    Scheme, leading www. and default ports are dropped, the host is
+    reversed, and query arguments are sorted; everything is lowercased.
+    """
+    if '://' not in url:
+        url = 'http://' + url
+    parts = urlsplit(url.strip())
+    host = surt_host(parts.hostname or '')
+    if parts.port and str(parts.port) != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host = f"{host}:{parts.port}"
+    key = f"{host})" + (parts.path or '/')
+    if parts.query:
+        key += '?' + '&'.join(sorted(parts.query.split('&')))
+    return key.lower()
+
+
+def key_ranges(query, match_type='exact'):
+    """[start, stop) byte ranges of urlkeys matching a URL/host/domain query, in key order.
+
+    'domain' is the host subtree: the query's host ("com,example)") and its
+    subdomains ("com,example,") on any port ("com,example:8080)"). Hosts that
+    merely share the prefix ("com,example-shop)", between ',' and ':') are
+    left out. The query's host is used as given: www.example.com and
+    example.com are the same subtree, blog.example.com is a smaller one.
+    """
+    if match_type not in MATCH_TYPES:
+        raise ValueError(f"match_type must be one of {', '.join(MATCH_TYPES)}")
+    if match_type == 'domain':
+        host = surt_host(urlsplit(query if '://' in query else 'http://' + query).hostname or '').encode('utf-8')
+        return [(host + b')', host + b',\xff'), (host + b':', host + b':\xff')]
+    key = surt_key(query).encode('utf-8')
+    if match_type == 'exact':
+        return [(key, key + b'\x00')]
+    if match_type == 'host':
+        key = key.split(b')', 1)[0] + b')'
+    return [(key, key + b'\xff')]
+
+
+def iter_export_records(paths):
+    """Export records of either format in the JSON shape (all strings)"""
+    for path in expand_paths(paths):
+        if is_parquet(path):
+            for record in iter_parquet_records(path):
+                yield to_cdx_json(record)
+        else:
+            yield from iter_jsonl_records(path)
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+class IndexBuilder:
+    def __init__(self, run_records=500_000, tmp_dir=None):
+        self.run_records = run_records
+        self.tmp_dir = tmp_dir
+        self.tables = {field: {} for field in INTERNED}
+        self.runs = []
+        self.count = 0
+
+    def intern(self, field, value):
+        table = self.tables[field]
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table)
+        return index
+
+    def row(self, record):
+        """Sortable tuple: (urlkey, timestamp, url, digest, offset, length, status, interned ids...)"""
+        return (
+            (record.get('urlkey') or '').encode('utf-8'),
+            to_int(record.get('timestamp')),
+            (record.get('url') or '').encode('utf-8'),
+            (record.get('digest') or '').encode('utf-8'),
+            to_int(record.get('offset')),
+            to_int(record.get('length')),
+            to_int(record.get('status')),
+            *(self.intern(field, record.get(field) or '') for field in INTERNED),
+        )
+
+    def spill(self, rows, tmp):
+        rows.sort()
+        path = os.path.join(tmp, f"run-{len(self.runs):05d}")
+        with open(path, 'wb') as f:
+            for i in range(0, len(rows), 10_000):
+                marshal.dump(rows[i:i + 10_000], f)
+        self.runs.append(path)
+        self.count += len(rows)
+
+    @staticmethod
+    def iter_run(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    block = marshal.load(f)
+                except EOFError:
+                    return
+                yield from block
+
+    def build(self, records, output_path, on_run=None):
+        """Sort `records` (export JSON shape) into an index file; returns stats"""
+        with tempfile.TemporaryDirectory(prefix='cdx-index-', dir=self.tmp_dir) as tmp:
+            rows = []
+            for record in records:
+                rows.append(self.row(record))
+                if len(rows) >= self.run_records:
+                    self.spill(rows, tmp)
+                    rows = []
+                    if on_run:
+                        on_run(len(self.runs), self.count)
+            if rows:
+                self.spill(rows, tmp)
+            self.write(output_path, heapq.merge(*(self.iter_run(path) for path in self.runs)))
+        return {'records': self.count, 'runs': len(self.runs), 'bytes': os.path.getsize(output_path),
+                'filenames': len(self.tables['filename'])}
+
+    def write(self, output_path, rows):
+        """Records and heap are written side by side: the record count is known before the merge"""
+        records_offset = HEADER.size
+        heap_offset = records_offset + self.count * RECORD.size
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'wb') as records, open(tmp_path, 'r+b') as heap:
+            records.write(b'\0' * HEADER.size)
+            records.flush()
+            heap.seek(heap_offset)
+            heap_size = 0
+            for urlkey, timestamp, url, digest, offset, length, status, *ids in rows:
+                records.write(RECORD.pack(heap_size, len(urlkey), len(url), len(digest), timestamp,
+                                          offset, length, status, *ids))
+                heap.write(urlkey + url + digest)
+                heap_size += len(urlkey) + len(url) + len(digest)
+            records.flush()
+            tables = json.dumps({field: list(self.tables[field]) for field in INTERNED}).encode('utf-8')
+            tables_offset = heap_offset + heap_size
+            heap.write(tables)
+            heap.seek(0)
+            heap.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.count, records_offset, heap_offset,
+                                   tables_offset, len(tables)))
+        os.replace(tmp_path, output_path)
+
+
+class CdxIndex:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, record_size, self.count, self.records_offset, self.heap_offset,
+         tables_offset, tables_size) = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a CDX index (version {VERSION})")
+        tables = json.loads(self.mm[tables_offset:tables_offset + tables_size])
+        self.tables = [tables[field] for field in INTERNED]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def urlkey(self, i):
+        heap_offset, key_len = KEY.unpack_from(self.mm, self.records_offset + i * RECORD.size)
+        start = self.heap_offset + heap_offset
+        return self.mm[start:start + key_len]
+
+    def bisect(self, key, lo=0):
+        """First record at or after `lo` whose urlkey is >= key"""
+        hi = self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.urlkey(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def spans(self, query, match_type='exact'):
+        """(first, stop) record positions matching a query, one pair per key range"""
+        spans = []
+        for start, stop in key_ranges(query, match_type):
+            first = self.bisect(start)
+            spans.append((first, self.bisect(stop, lo=first)))
+        return spans
+
+    def record(self, i):
+        """Record i in the export's JSON shape (all strings)"""
+        (heap_offset, key_len, url_len, digest_len, timestamp, offset, length, status,
+         *ids) = RECORD.unpack_from(self.mm, self.records_offset + i * RECORD.size)
+        start = self.heap_offset + heap_offset
+        strings = self.mm[start:start + key_len + url_len + digest_len]
+        record = {
+            'urlkey': strings[:key_len].decode('utf-8'),
+            'timestamp': str(timestamp) if timestamp else '',
+            'url': strings[key_len:key_len + url_len].decode('utf-8'),
+            'digest': strings[key_len + url_len:].decode('utf-8'),
+            'status': str(status) if status else '',
+            'length': str(length),
+            'offset': str(offset),
+        }
+        for field, table, index in zip(INTERNED, self.tables, ids):
+            record[field] = table[index]
+        return {field: record.get(field, '') for field in CDX_FIELDS}
+
+    def count_matches(self, query, match_type='exact'):
+        return sum(stop - first for first, stop in self.spans(query, match_type))
+
+    def lookup(self, query, match_type='exact', limit=None, from_ts=None, to_ts=None):
+        """Yield matching records in urlkey/timestamp order, optionally within [from_ts, to_ts]"""
+        from_ts = int(from_ts.ljust(14, '0')) if from_ts else None
+        to_ts = int(to_ts.ljust(14, '9')) if to_ts else None
+        yielded = 0
+        for i in (i for first, stop in self.spans(query, match_type) for i in range(first, stop)):
+            if limit is not None and yielded >= limit:
+                return
+            if from_ts or to_ts:
+                timestamp = TIMESTAMP.unpack_from(self.mm, self.records_offset + i * RECORD.size + TIMESTAMP_AT)[0]
+                if (from_ts and timestamp < from_ts) or (to_ts and timestamp > to_ts):
+                    continue
+            yield self.record(i)
+            yielded += 1
+
+    def info(self):
+        return {
+            'path': self.path,
+            'records': self.count,
+            'bytes': os.path.getsize(self.path),
+            'filenames': len(self.tables[0]),
+            'first_urlkey': self.urlkey(0).decode('utf-8') if self.count else None,
+            'last_urlkey': self.urlkey(self.count - 1).decode('utf-8') if self.count else None,
+        }
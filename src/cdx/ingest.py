@@ -0,0 +1,66 @@
+"""
+Bulk domain ingestion: normalize, dedupe and hash-shard domain lists to Parquet.
+
+Input files are streamed once and each normalized domain is appended to one of
+N spill files chosen by domain_shard() (the same crc32 split the sharded export
+uses). Every spill file then holds a disjoint slice of the domains, small
+enough to dedupe with an in-memory set, so memory is bounded by the largest
+shard rather than by the whole list. Each shard is written sorted as
+domains-NNNNN.parquet with a single domain_norm column.
+"""
+
+import os
+import tempfile
+
+from src.aws.cdx_export import domain_shard
+from src.cdx.domains import iter_domain_file
+from src.cdx.records import require_pyarrow_parquet
+
+
+def spill_domains(paths, spill_dir, num_shards, buffer_size=1 << 20):
+    """Split normalized domains from `paths` into per-shard text files; returns rows read"""
+    files = [open(os.path.join(spill_dir, f"shard-{shard:05d}.txt"), 'w',
+                  encoding='utf-8', buffering=buffer_size)
+             for shard in range(num_shards)]
+    rows = 0
+    try:
+        for path in paths:
+            for domain in iter_domain_file(path):
+                files[domain_shard(domain, num_shards)].write(domain + '\n')
+                rows += 1
+    finally:
+        for f in files:
+            f.close()
+    return rows
+
+
+def write_shard(spill_path, output_path, compression='zstd'):
+    """Dedupe one spill file and write it as a sorted single-column Parquet file"""
+    import pyarrow as pa
+    pq = require_pyarrow_parquet()
+
+    with open(spill_path, 'r', encoding='utf-8') as f:
+        domains = sorted({line.rstrip('\n') for line in f})
+    table = pa.table({'domain_norm': pa.array(domains, type=pa.string())})
+    pq.write_table(table, output_path, compression=compression)
+    return len(domains)
+
+
+def build_domain_shards(paths, output_dir, num_shards=16, compression='zstd'):
+    """Normalize, dedupe and hash-shard domain files into `output_dir`.
+
+    Returns {'rows', 'domains', 'files'}; empty shards produce no file.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    domains = 0
+    with tempfile.TemporaryDirectory(dir=output_dir) as spill_dir:
+        rows = spill_domains(paths, spill_dir, num_shards)
+        for shard in range(num_shards):
+            spill_path = os.path.join(spill_dir, f"shard-{shard:05d}.txt")
+            if os.path.getsize(spill_path) == 0:
+                continue
+            output_path = os.path.join(output_dir, f"domains-{shard:05d}.parquet")
+            domains += write_shard(spill_path, output_path, compression)
+            files.append(output_path)
+    return {'rows': rows, 'domains': domains, 'files': files}
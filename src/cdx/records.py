@@ -0,0 +1,94 @@
+"""
+Readers for exported CDX records on local disk.
+
+Handles both export formats written by run_cc_query.py:
+- json:    gzipped (or plain) newline-delimited CDX JSON
+- parquet: typed columns; read with column projection via pyarrow (optional dependency)
+"""
+
+import gzip
+import json
+import os
+
+# Field order of the JSONL export (and of converted Parquet records)
+CDX_FIELDS = [
+    'urlkey', 'timestamp', 'url', 'mime', 'mime-detected', 'status',
+    'digest', 'length', 'offset', 'filename', 'languages', 'encoding',
+]
+
+# Parquet column names that differ from the JSONL field names
+PARQUET_TO_CDX = {'mime_detected': 'mime-detected'}
+
+
+def require_pyarrow_parquet():
+    """Import pyarrow.parquet, with a clear error if it is not installed"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet support requires pyarrow: pip install pyarrow")
+    return pq
+
+
+def is_parquet(path):
+    """Detect Parquet files by magic bytes (UNLOAD output has no file extension)"""
+    with open(path, 'rb') as f:
+        return f.read(4) == b'PAR1'
+
+
+def expand_paths(paths):
+    """Expand directories into the data files they contain, skipping manifests and hidden files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                for name in sorted(names):
+                    if not name.startswith(('.', '_')):
+                        files.append(os.path.join(root, name))
+        else:
+            files.append(path)
+    return files
+
+
+def iter_jsonl_records(path):
+    """Yield dicts from a (gzipped) JSONL export file"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_parquet_records(path, columns=None, batch_size=65536):
+    """Yield dicts from a Parquet export file, reading only `columns` if given"""
+    pq = require_pyarrow_parquet()
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from batch.to_pylist()
+
+
+def iter_records(paths, columns=None):
+    """Yield records from export files/directories of either format.
+
+    `columns` projects Parquet reads (JSONL lines are always fully parsed).
+    """
+    for path in expand_paths(paths):
+        if is_parquet(path):
+            yield from iter_parquet_records(path, columns=columns)
+        else:
+            yield from iter_jsonl_records(path)
+
+
+def to_cdx_json(record):
+    """Convert a typed Parquet export record to the JSONL export shape (all strings)"""
+    out = {}
+    for name, value in record.items():
+        field = PARQUET_TO_CDX.get(name, name)
+        if field not in CDX_FIELDS:
+            continue
+        if value is None:
+            value = ''
+        elif field == 'timestamp' and hasattr(value, 'strftime'):
+            value = value.strftime('%Y%m%d%H%M%S')
+        out[field] = str(value)
+    return {field: out.get(field, '') for field in CDX_FIELDS}
@@ -0,0 +1,292 @@
+"""
+One-pass analytics over a CDX export, local or straight from S3.
+
+Every export file is streamed once by a worker process, which keeps:
+- exact counters: records, bytes to fetch (sum of WARC record lengths), the
+  set of WARC files touched;
+- a HyperLogLog of content digests and a KLL sketch of record lengths, both
+  merged across workers at the end;
+- per-domain page counts, spilled to disk in hash partitions whenever more
+  than `max_domains` are held, so no process ever holds the whole domain list.
+
+The partitions are then reduced one at a time (in parallel) into exact
+per-domain counts, giving exact pages-per-domain percentiles and the top
+domains. Memory is bounded by workers x max_domains plus the largest
+partition. With exact_digests=True, digests are spilled and counted the same
+way instead of estimated.
+
+JSON exports carry no registered domain, so per-domain means per host of the
+urlkey there (see src/aws/download.line_shard_key); Parquet exports have the
+domain column.
+"""
+
+import heapq
+import os
+import re
+import shutil
+import tempfile
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from src.aws.clients import get_client
+from src.aws.download import (FILENAME_FIELD, GZIP_MAGIC, PARQUET_MAGIC, iter_gunzip, iter_lines,
+                              line_shard_key, list_export_objects, surt_host)
+from src.cdx.records import expand_paths, iter_parquet_records, require_pyarrow_parquet
+from src.cdx.sketches import HyperLogLog, KLLSketch
+
+DIGEST_FIELD = re.compile(rb'"digest":"([^"]*)"')
+LENGTH_FIELD = re.compile(rb'"length":"(\d+)"')
+PARQUET_COLUMNS = ['urlkey', 'digest', 'length', 'filename', 'domain']
+QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+# S3 client of a worker process (see init_worker)
+s3_client = None
+
+
+def init_worker(region=None):
+    global s3_client
+    if region:
+        s3_client = get_client('s3', region)
+
+
+def iter_source_chunks(source, chunk_size=8 * 1024 * 1024):
+    """Bytes of a local path or an (bucket, key, size) S3 object, in order"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    bucket, key, _ = source
+    body = s3_client.get_object(Bucket=bucket, Key=key)['Body']
+    yield from body.iter_chunks(chunk_size)
+
+
+def iter_json_fields(lines):
+    """(domain, digest, length, filename, from_host) per CDX JSON line, without json.loads"""
+    for line in lines:
+        digest = DIGEST_FIELD.search(line)
+        length = LENGTH_FIELD.search(line)
+        filename = FILENAME_FIELD.search(line)
+        yield (line_shard_key(line, 'domain'),
+               digest.group(1).decode('utf-8') if digest else '',
+               int(length.group(1)) if length else 0,
+               filename.group(1).decode('utf-8') if filename else '',
+               b'"domain":"' not in line)
+
+
+def iter_parquet_fields(chunks, spool_dir=None):
+    """Same tuples from a Parquet object (spooled to a temp file: the footer comes last)"""
+    pq = require_pyarrow_parquet()
+    with tempfile.NamedTemporaryFile(dir=spool_dir, suffix='.parquet') as tmp:
+        for chunk in chunks:
+            tmp.write(chunk)
+        tmp.flush()
+        names = set(pq.ParquetFile(tmp.name).schema_arrow.names)
+        columns = [c for c in PARQUET_COLUMNS if c in names]
+        for record in iter_parquet_records(tmp.name, columns=columns):
+            domain = record.get('domain')
+            from_host = not domain
+            if from_host:
+                domain = surt_host((record.get('urlkey') or '').split(')', 1)[0])
+            yield (domain or '', record.get('digest') or '', int(record.get('length') or 0),
+                   record.get('filename') or '', from_host)
+
+
+def iter_source_fields(source, spool_dir=None):
+    chunks = iter_source_chunks(source)
+    first = next(chunks, b'')
+
+    def stream():
+        yield first
+        yield from chunks
+
+    if first.startswith(PARQUET_MAGIC):
+        return iter_parquet_fields(stream(), spool_dir)
+    if first.startswith(GZIP_MAGIC):
+        return iter_json_fields(iter_lines(iter_gunzip(stream())))
+    return iter_json_fields(iter_lines(stream()))
+
+
+class PartitionSpill:
+    """Append `key<TAB>count` lines to one of N partition files chosen by crc32(key)"""
+
+    def __init__(self, spill_dir, kind, index, num_partitions):
+        self.paths = [os.path.join(spill_dir, f"{kind}-{p:04d}", f"{index:06d}.tsv")
+                      for p in range(num_partitions)]
+        self.num_partitions = num_partitions
+
+    def write(self, counts):
+        buffers = [[] for _ in range(self.num_partitions)]
+        for key, count in counts.items():
+            buffers[zlib.crc32(key.encode('utf-8')) % self.num_partitions].append(f"{key}\t{count}\n")
+        for path, buffer in zip(self.paths, buffers):
+            if buffer:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.writelines(buffer)
+
+
+def summarize_source(source, index, spill_dir, num_partitions, max_domains, exact_digests):
+    """Stream one export file; returns its mergeable partial summary"""
+    domains = PartitionSpill(spill_dir, 'domains', index, num_partitions)
+    digests = PartitionSpill(spill_dir, 'digests', index, num_partitions) if exact_digests else None
+    domain_counts = Counter()
+    digest_seen = {}
+    summary = {
+        'records': 0, 'bytes_to_fetch': 0, 'host_keyed': 0,
+        'warc_files': set(), 'digests': HyperLogLog(), 'lengths': KLLSketch(seed=index),
+    }
+    for domain, digest, length, filename, from_host in iter_source_fields(source, spill_dir):
+        summary['records'] += 1
+        summary['bytes_to_fetch'] += length
+        summary['host_keyed'] += from_host
+        summary['warc_files'].add(filename)
+        summary['lengths'].update(length)
+        summary['digests'].add(digest)
+        domain_counts[domain] += 1
+        if len(domain_counts) >= max_domains:
+            domains.write(domain_counts)
+            domain_counts.clear()
+        if digests is not None:
+            digest_seen[digest] = 1
+            if len(digest_seen) >= max_domains:
+                digests.write(digest_seen)
+                digest_seen.clear()
+    domains.write(domain_counts)
+    if digests is not None:
+        digests.write(digest_seen)
+    summary['warc_files'].discard('')
+    return summary
+
+
+def iter_spill(partition_dir):
+    if not os.path.isdir(partition_dir):
+        return
+    for name in sorted(os.listdir(partition_dir)):
+        with open(os.path.join(partition_dir, name), 'r', encoding='utf-8') as f:
+            for line in f:
+                key, count = line.rstrip('\n').rsplit('\t', 1)
+                yield key, int(count)
+
+
+def reduce_domain_partition(partition_dir, top):
+    """Exact counts of one partition -> (histogram {pages: domains}, top domains)"""
+    counts = Counter()
+    for domain, count in iter_spill(partition_dir):
+        counts[domain] += count
+    histogram = Counter(counts.values())
+    return histogram, heapq.nlargest(top, counts.items(), key=lambda item: item[1])
+
+
+def reduce_digest_partition(partition_dir):
+    return len({digest for digest, _ in iter_spill(partition_dir)})
+
+
+def histogram_quantiles(histogram, qs):
+    """Exact quantiles (same rank rule as KLLSketch.quantiles) of a {value: count} histogram"""
+    total = sum(histogram.values())
+    items = sorted(histogram.items())
+    results = []
+    for q in qs:
+        cumulative = 0
+        value = None
+        for value, count in items:
+            cumulative += count
+            if cumulative >= q * total:
+                break
+        results.append(value)
+    return results
+
+
+def list_sources(inputs, s3=None):
+    """Local export files and (bucket, key, size) S3 objects for paths / s3:// prefixes"""
+    sources = []
+    for item in inputs:
+        if item.startswith('s3://'):
+            sources.extend(list_export_objects(s3, item))
+        else:
+            sources.extend(expand_paths([item]))
+    return sources
+
+
+def source_size(source):
+    return os.path.getsize(source) if isinstance(source, str) else source[2]
+
+
+class ExportReport:
+    def __init__(self, workers=None, num_partitions=64, max_domains=1_000_000,
+                 exact_digests=False, top=10, region=None, spill_dir=None):
+        self.workers = workers or os.cpu_count()
+        self.num_partitions = num_partitions
+        self.max_domains = max_domains
+        self.exact_digests = exact_digests
+        self.top = top
+        self.region = region
+        self.spill_dir = spill_dir
+
+    def run(self, sources, on_source=None):
+        """Summarize every source in parallel and return the report dict"""
+        start = time.time()
+        records = bytes_to_fetch = host_keyed = 0
+        warc_files = set()
+        digests = HyperLogLog()
+        lengths = KLLSketch()
+        work_dir = tempfile.mkdtemp(prefix='cdx-report-', dir=self.spill_dir)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                     initargs=(self.region,)) as pool:
+                # Largest files first so one big file does not finish last on its own
+                ordered = sorted(sources, key=lambda s: -source_size(s))
+                futures = {pool.submit(summarize_source, source, index, work_dir, self.num_partitions,
+                                       self.max_domains, self.exact_digests): source
+                           for index, source in enumerate(ordered)}
+                for future in futures:
+                    summary = future.result()
+                    records += summary['records']
+                    bytes_to_fetch += summary['bytes_to_fetch']
+                    host_keyed += summary['host_keyed']
+                    warc_files |= summary['warc_files']
+                    digests.merge(summary['digests'])
+                    lengths.merge(summary['lengths'])
+                    if on_source:
+                        on_source(futures[future], summary['records'])
+
+                histogram = Counter()
+                top = []
+                domain_dirs = [os.path.join(work_dir, f"domains-{p:04d}") for p in range(self.num_partitions)]
+                for part_histogram, part_top in pool.map(reduce_domain_partition, domain_dirs,
+                                                         [self.top] * len(domain_dirs)):
+                    histogram.update(part_histogram)
+                    top = heapq.nlargest(self.top, top + part_top, key=lambda item: item[1])
+
+                if self.exact_digests:
+                    distinct_digests = sum(pool.map(
+                        reduce_digest_partition,
+                        [os.path.join(work_dir, f"digests-{p:04d}") for p in range(self.num_partitions)]))
+                else:
+                    distinct_digests = digests.count()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        domain_quantiles = histogram_quantiles(histogram, QUANTILES.values()) if histogram else []
+        length_quantiles = lengths.quantiles(QUANTILES.values())
+        return {
+            'sources': len(sources),
+            'input_bytes': sum(source_size(s) for s in sources),
+            'records': records,
+            'distinct_digests': distinct_digests,
+            'distinct_digests_exact': self.exact_digests,
+            'warc_files': len(warc_files),
+            'bytes_to_fetch': bytes_to_fetch,
+            'domains': sum(histogram.values()),
+            'domain_key': 'host' if host_keyed == records else ('domain' if not host_keyed else 'mixed'),
+            'records_per_domain': dict(zip(QUANTILES, domain_quantiles),
+                                       max=max(histogram) if histogram else None),
+            'top_domains': top,
+            'record_length': dict(zip(QUANTILES, length_quantiles)),
+            'elapsed_s': round(time.time() - start, 1),
+        }
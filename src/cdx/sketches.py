@@ -0,0 +1,120 @@
+"""
+Small mergeable sketches for one-pass statistics over exports.
+
+- HyperLogLog: distinct count (e.g. content digests) in 2^p bytes, ~1.04/sqrt(2^p)
+  relative error (p=14: 16 KB, ~0.8%).
+- KLLSketch: quantiles of a stream in O(k log n) memory, rank error ~1/k.
+
+Both merge with sketches built by other workers, keeping the error bounds
+above for the combined stream (HLL registers merge exactly; KLL compacts the
+merged levels again), so files can be processed in parallel and combined at
+the end.
+"""
+
+import hashlib
+import math
+import random
+
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    def __init__(self, p=14):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, value):
+        h = hash64(value)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches of different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class KLLSketch:
+    """KLL quantile sketch (Karnin, Lang, Liberty 2016), compaction by level"""
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.compactors = [[]]
+        self.n = 0
+        self.random = random.Random(seed)
+        self.held = 0
+        self.limit = self.capacity(0)
+
+    def capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2.0 / 3.0) ** depth)))
+
+    def update(self, value):
+        self.compactors[0].append(value)
+        self.n += 1
+        self.held += 1
+        if self.held >= self.limit:
+            self.compress()
+
+    def compress(self):
+        """Lazy compaction: halve the lowest full level until the whole sketch fits"""
+        capacities = [self.capacity(level) for level in range(len(self.compactors))]
+        held = sum(len(items) for items in self.compactors)
+        while held >= sum(capacities):
+            for level, items in enumerate(self.compactors):
+                if len(items) >= capacities[level]:
+                    if level + 1 == len(self.compactors):
+                        self.compactors.append([])
+                        capacities = [self.capacity(lv) for lv in range(len(self.compactors))]
+                    items.sort()
+                    kept = items[self.random.randint(0, 1)::2]
+                    self.compactors[level + 1].extend(kept)
+                    self.compactors[level] = []
+                    held -= len(items) - len(kept)
+                    break
+        self.held = held
+        self.limit = sum(capacities)
+
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        for level, items in enumerate(other.compactors):
+            self.compactors[level].extend(items)
+        self.n += other.n
+        self.compress()
+        return self
+
+    def quantiles(self, qs):
+        """Values at ranks q*n for each q in `qs` (None when empty)"""
+        weighted = sorted((value, 1 << level)
+                          for level, items in enumerate(self.compactors) for value in items)
+        total = sum(weight for _, weight in weighted)
+        results = []
+        for q in qs:
+            if not weighted:
+                results.append(None)
+                continue
+            target = q * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            results.append(value)
+        return results
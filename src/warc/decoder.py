@@ -0,0 +1,199 @@
+"""
+Streaming WARC record decoder working on memoryview slices.
+
+Each WARC record from Common Crawl is its own gzip member. Members are
+decompressed incrementally (one zlib stream per member, fed in chunks), the
+WARC and HTTP header blocks are located in the decompressed buffer, and the
+body is exposed as a memoryview of that buffer - the only allocation per
+record is the decompressed buffer itself. HTTP headers are parsed lazily.
+"""
+
+import base64
+import hashlib
+import mmap
+import zlib
+from contextlib import contextmanager
+
+CHUNK_SIZE = 64 * 1024
+HEADER_END = b'\r\n\r\n'
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+
+class TruncatedMember(ValueError):
+    """The buffer ends inside a gzip member"""
+
+
+class WarcRecord:
+    """A decoded WARC record; `body` is a memoryview into the decompressed buffer"""
+    __slots__ = ('warc_headers', 'url', 'warc_type', 'status', 'body', 'digest_ok',
+                 '_http_header_block', '_headers')
+
+    def __init__(self, warc_headers, status, http_header_block, body):
+        self.warc_headers = warc_headers
+        self.url = warc_headers.get('warc-target-uri')
+        self.warc_type = warc_headers.get('warc-type')
+        self.status = status
+        self.body = body
+        self.digest_ok = None
+        self._http_header_block = http_header_block
+        self._headers = None
+
+    @property
+    def headers(self):
+        """HTTP response headers (lowercased names), parsed on first access"""
+        if self._headers is None:
+            self._headers = parse_header_lines(bytes(self._http_header_block))
+        return self._headers
+
+    @property
+    def payload_digest(self):
+        return self.warc_headers.get('warc-payload-digest')
+
+    def content_charset(self, default='utf-8'):
+        content_type = self.headers.get('content-type', '')
+        for part in content_type.split(';')[1:]:
+            name, _, value = part.strip().partition('=')
+            if name.lower() == 'charset' and value:
+                return value.strip('"\' ').lower()
+        return default
+
+
+def parse_header_lines(block):
+    """Parse 'Name: value' lines (first line skipped if it has no colon) into a dict"""
+    headers = {}
+    for line in block.split(b'\r\n'):
+        name, sep, value = line.partition(b':')
+        if sep:
+            headers[name.strip().decode('latin-1').lower()] = value.strip().decode('latin-1')
+    return headers
+
+
+def decompress_member(view, pos=0):
+    """Decompress the gzip member starting at view[pos]; return (data, next_pos)"""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    parts = []
+    end = len(view)
+    while pos < end and not decompressor.eof:
+        chunk = view[pos:pos + CHUNK_SIZE]
+        parts.append(decompressor.decompress(chunk))
+        pos += len(chunk)
+    if not decompressor.eof:
+        raise TruncatedMember("Truncated gzip member")
+    # Step back over bytes of the last chunk that belong to the next member
+    pos -= len(decompressor.unused_data)
+    data = parts[0] if len(parts) == 1 else b''.join(parts)
+    return data, pos
+
+
+def normalize_digest(digest):
+    """'sha1:ABC...' or 'ABC...' -> 'ABC...' (base32 SHA-1, as in the CDX export)"""
+    if digest is None:
+        return None
+    return digest.split(':', 1)[1] if ':' in digest else digest
+
+
+def payload_digest(body):
+    """Base32 SHA-1 of the HTTP payload, the form used by Common Crawl's CDX digest"""
+    return base64.b32encode(hashlib.sha1(body).digest()).decode('ascii')
+
+
+def parse_record(data, expected_digest=None):
+    """Parse a decompressed WARC record held in `data` (bytes)"""
+    view = memoryview(data)
+    warc_end = data.find(HEADER_END)
+    if warc_end < 0:
+        raise ValueError("Missing WARC header terminator")
+    warc_headers = parse_header_lines(data[:warc_end])
+    block_start = warc_end + len(HEADER_END)
+    block_end = block_start + int(warc_headers.get('content-length', len(data) - block_start))
+
+    status = None
+    http_header_block = view[0:0]
+    body = view[block_start:block_end]
+    if warc_headers.get('warc-type') == 'response' and data.startswith(b'HTTP/', block_start):
+        http_end = data.find(HEADER_END, block_start, block_end)
+        if http_end >= 0:
+            status_line_end = data.find(b'\r\n', block_start, http_end + 2)
+            status_line = data[block_start:status_line_end].split(b' ', 2)
+            status = int(status_line[1]) if len(status_line) > 1 and status_line[1].isdigit() else None
+            http_header_block = view[status_line_end + 2:http_end]
+            body = view[http_end + len(HEADER_END):block_end]
+
+    record = WarcRecord(warc_headers, status, http_header_block, body)
+    expected = normalize_digest(expected_digest or record.payload_digest)
+    if expected:
+        record.digest_ok = payload_digest(body) == expected
+    return record
+
+
+def decode_record(payload, expected_digest=None):
+    """Decode a single fetched record (one gzip member) from a bytes-like payload"""
+    data, _ = decompress_member(memoryview(payload))
+    return parse_record(data, expected_digest)
+
+
+def iter_records(payload):
+    """Yield every record of a buffer holding concatenated gzip members (a .warc.gz)"""
+    view = memoryview(payload)
+    pos = 0
+    while pos < len(view):
+        data, pos = decompress_member(view, pos)
+        yield parse_record(data)
+
+
+def find_member(view, pos):
+    """Offset of the next gzip header at or after view[pos] (-1 if none)"""
+    while pos < len(view):
+        found = bytes(view[pos:pos + CHUNK_SIZE + len(GZIP_MAGIC) - 1]).find(GZIP_MAGIC)
+        if found >= 0:
+            return pos + found
+        pos += CHUNK_SIZE
+    return -1
+
+
+def iter_members(payload):
+    """Like iter_records, but yield (record, error) and carry on past bad members.
+
+    A member that decompresses but does not parse yields (None, error); a
+    corrupt one yields (None, error) and decoding resumes at the next gzip
+    header. A member cut off by the end of the buffer raises TruncatedMember,
+    as nothing after it can be recovered.
+    """
+    view = memoryview(payload)
+    pos = 0
+    while pos < len(view):
+        try:
+            data, next_pos = decompress_member(view, pos)
+        except zlib.error as e:
+            next_pos = find_member(view, pos + 1)
+            yield None, e
+            if next_pos < 0:
+                return
+            pos = next_pos
+            continue
+        pos = next_pos
+        try:
+            yield parse_record(data), None
+        except ValueError as e:
+            yield None, e
+
+
+@contextmanager
+def mapped_file(path):
+    """memoryview of a local file, mapped instead of read into memory"""
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            yield memoryview(b'')
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def iter_warc_file(path):
+    """Yield records from a local .warc.gz file without reading it into memory"""
+    with mapped_file(path) as view:
+        yield from iter_records(view)
@@ -0,0 +1,278 @@
+"""
+HTML-to-text extraction stage running on a process pool.
+
+Text extraction is CPU-bound, so decoded records are sent in batches to a
+ProcessPoolExecutor sized to the machine's cores. Each worker process appends
+its results as gzip members to its own output shard (text-<pid>.jsonl.gz), so
+workers never contend on a file. The number of queued batches is bounded,
+which keeps memory flat however fast the fetcher is.
+"""
+
+import gzip
+import heapq
+import itertools
+import json
+import os
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from html.parser import HTMLParser
+
+from src.warc.decoder import TruncatedMember, decode_record, iter_members, mapped_file
+
+# Elements whose content is never page text
+SKIP_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'nav', 'header',
+             'footer', 'aside', 'form', 'button', 'select', 'iframe'}
+BLOCK_TAGS = {'p', 'div', 'section', 'article', 'main', 'li', 'ul', 'ol', 'table', 'tr',
+              'td', 'th', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'blockquote', 'br', 'dd', 'dt'}
+VOID_TAGS = {'br', 'img', 'hr', 'meta', 'link', 'input', 'source', 'wbr', 'area', 'base', 'col'}
+
+
+class TextExtractor(HTMLParser):
+    """Collect title, <html lang> and block text, dropping link-heavy (boilerplate) blocks"""
+
+    def __init__(self, max_link_density=0.5, min_block_chars=20):
+        super().__init__(convert_charrefs=True)
+        self.max_link_density = max_link_density
+        self.min_block_chars = min_block_chars
+        self.title = None
+        self.lang = None
+        self.blocks = []
+        self.skip_depth = 0
+        self.in_title = False
+        self.link_depth = 0
+        self.block = []
+        self.block_link_chars = 0
+        self.title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'html' and self.lang is None:
+            self.lang = dict(attrs).get('lang')
+        if tag in SKIP_TAGS and tag not in VOID_TAGS:
+            self.skip_depth += 1
+        elif tag == 'title':
+            self.in_title = True
+        elif tag == 'a':
+            self.link_depth += 1
+        if tag in BLOCK_TAGS:
+            self.flush_block()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag == 'title':
+            self.in_title = False
+            if self.title is None:
+                self.title = ' '.join(''.join(self.title_parts).split()) or None
+        elif tag == 'a' and self.link_depth:
+            self.link_depth -= 1
+        if tag in BLOCK_TAGS:
+            self.flush_block()
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+        elif not self.skip_depth:
+            self.block.append(data)
+            if self.link_depth:
+                self.block_link_chars += len(data.strip())
+
+    def flush_block(self):
+        text = ' '.join(''.join(self.block).split())
+        link_chars = self.block_link_chars
+        self.block = []
+        self.block_link_chars = 0
+        if not text:
+            return
+        # Boilerplate: menus and link lists are mostly anchor text
+        if link_chars / len(text) > self.max_link_density:
+            return
+        if len(text) < self.min_block_chars and link_chars:
+            return
+        self.blocks.append(text)
+
+    def close(self):
+        super().close()
+        self.flush_block()
+
+
+def extract_text(html, lang_hint=None):
+    """Return {'title', 'lang', 'text'} for an HTML document (str)"""
+    parser = TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        # Malformed markup: keep whatever was collected
+        parser.flush_block()
+    lang = parser.lang or lang_hint
+    if lang:
+        lang = lang.split(',')[0].strip().lower() or None
+    return {'title': parser.title, 'lang': lang, 'text': '\n'.join(parser.blocks)}
+
+
+def record_to_result(record, meta=None):
+    meta = meta or {}
+    charset = record.content_charset(default=meta.get('encoding') or 'utf-8')
+    try:
+        html = str(record.body, charset, errors='replace')
+    except LookupError:
+        html = str(record.body, 'utf-8', errors='replace')
+    result = extract_text(html, lang_hint=meta.get('languages'))
+    result.update({
+        'url': record.url,
+        'status': record.status,
+        'digest_ok': record.digest_ok,
+        'length': len(record.body),
+    })
+    return result
+
+
+def write_results(results, output_dir):
+    """Append results as one gzip member to this process's output shard"""
+    path = os.path.join(output_dir, f"text-{os.getpid()}.jsonl.gz")
+    with gzip.open(path, 'at', encoding='utf-8') as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False))
+            f.write('\n')
+    return path
+
+
+def extract_payloads(batch, output_dir):
+    """Worker: decode and extract a batch of (meta, compressed WARC member) pairs"""
+    results = []
+    errors = 0
+    for meta, payload in batch:
+        try:
+            record = decode_record(payload, meta.get('digest'))
+            if record.warc_type == 'response':
+                results.append(record_to_result(record, meta))
+        except (ValueError, OSError, zlib.error):
+            errors += 1
+    write_results(results, output_dir)
+    return len(results), errors, 0
+
+
+def extract_file(path, output_dir, batch_size=1000):
+    """Worker: extract every response record of a local .warc.gz file.
+
+    A record that fails to decode or extract counts as an error and the rest
+    of the file is still read; a file that ends inside a record counts as
+    truncated (the records before the cut are kept).
+    """
+    extracted = 0
+    errors = 0
+    truncated = 0
+    results = []
+    # Handled inside the mapping: a traceback would keep slices of it alive
+    with mapped_file(path) as view:
+        try:
+            for record, error in iter_members(view):
+                if error is not None:
+                    errors += 1
+                    continue
+                if record.warc_type == 'response':
+                    try:
+                        results.append(record_to_result(record))
+                    except (ValueError, OSError):
+                        errors += 1
+                if len(results) >= batch_size:
+                    write_results(results, output_dir)
+                    extracted += len(results)
+                    results = []
+        except TruncatedMember:
+            truncated = 1
+    write_results(results, output_dir)
+    return extracted + len(results), errors, truncated
+
+
+class ExtractionStage:
+    """Feed fetched records to a process pool in batches, with bounded queueing.
+
+    submit() is thread-safe so it can be used directly as the fetcher's
+    on_record callback; it blocks while `max_pending` batches are queued.
+    Records sit in memory until their batch is written, so the fetcher must
+    not checkpoint a range before that: pass on_range() and flush() to
+    WarcFetcher.fetch. A range's mark runs once every batch up to the one
+    holding its last record has been written (batches finish out of order,
+    and a range can span several).
+    """
+
+    def __init__(self, output_dir, workers=None, batch_size=256, max_pending=None):
+        self.output_dir = output_dir
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_pending = max_pending or 2 * self.workers
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.lock = threading.Lock()
+        self.batch = []
+        self.pending = {}  # future -> batch number
+        self.submitted = 0  # batches handed to the pool
+        self.finished = set()
+        self.written = 0  # batches 0..written-1 are all written
+        self.marks = []  # heap of (batches that must be written, order, mark)
+        self.order = itertools.count()
+        self.stats = {'batches': 0, 'extracted': 0, 'errors': 0, 'truncated_files': 0}
+        os.makedirs(output_dir, exist_ok=True)
+
+    def collect(self, limit):
+        """Take in finished batches, waiting until at most `limit` are pending (caller holds the lock)"""
+        while True:
+            finished = [future for future in self.pending if future.done()]
+            if not finished:
+                if len(self.pending) <= limit:
+                    break
+                finished, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                extracted, errors, truncated = future.result()
+                self.finished.add(self.pending.pop(future))
+                self.stats['batches'] += 1
+                self.stats['extracted'] += extracted
+                self.stats['errors'] += errors
+                self.stats['truncated_files'] += truncated
+            while self.written in self.finished:
+                self.finished.remove(self.written)
+                self.written += 1
+            while self.marks and self.marks[0][0] <= self.written:
+                heapq.heappop(self.marks)[2]()
+
+    def submit_work(self, fn, *args):
+        self.collect(self.max_pending - 1)
+        self.pending[self.pool.submit(fn, *args, self.output_dir)] = self.submitted
+        self.submitted += 1
+
+    def submit(self, meta, payload):
+        """Queue one fetched record (meta dict from the export + compressed payload)"""
+        with self.lock:
+            self.batch.append((meta, bytes(payload)))
+            if len(self.batch) >= self.batch_size:
+                batch, self.batch = self.batch, []
+                self.submit_work(extract_payloads, batch)
+
+    def on_range(self, mark):
+        """Fetcher callback after a range's records were submitted: mark it once they are written"""
+        with self.lock:
+            needed = self.submitted + (1 if self.batch else 0)
+            if needed <= self.written:
+                mark()
+            else:
+                heapq.heappush(self.marks, (needed, next(self.order), mark))
+
+    def submit_file(self, path):
+        """Queue a whole local .warc.gz file"""
+        with self.lock:
+            self.submit_work(extract_file, path)
+
+    def flush(self):
+        """Submit the open batch and wait until everything submitted is written"""
+        with self.lock:
+            if self.batch:
+                batch, self.batch = self.batch, []
+                self.submit_work(extract_payloads, batch)
+            self.collect(0)
+
+    def close(self):
+        """Flush the last batch, wait for all workers and return stats"""
+        self.flush()
+        self.pool.shutdown()
+        return self.stats
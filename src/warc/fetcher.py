@@ -0,0 +1,291 @@
+"""
+Fetch WARC records listed in a CDX export using HTTP Range requests.
+
+Records are grouped by WARC filename, sorted by offset, and neighbouring
+records are merged into one Range request when the gap between them is below
+`max_gap` bytes. Each worker thread keeps its own keep-alive connection, and
+every record is handed to the caller as a memoryview slice of the merged
+response buffer (no per-record copy).
+"""
+
+import http.client
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from urllib.parse import urlsplit
+
+DEFAULT_BASE_URL = 'https://data.commoncrawl.org/'
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+SKIP_CHUNK = 1024 * 1024
+
+
+def read_into(response, view):
+    """Fill `view` from the response; returns the number of bytes read"""
+    filled = 0
+    while filled < len(view):
+        n = response.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+class FetchRange:
+    """One HTTP Range request covering one or more records of the same WARC file"""
+    __slots__ = ('filename', 'start', 'end', 'records')
+
+    def __init__(self, filename, start, end, records):
+        self.filename = filename
+        self.start = start
+        self.end = end  # exclusive
+        self.records = records
+
+    @property
+    def key(self):
+        return f"{self.filename}:{self.start}-{self.end}"
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+
+def plan_ranges(records, max_gap=64 * 1024, max_span=16 * 1024 * 1024):
+    """Group records by filename, sort by offset, and merge nearby records into ranges.
+
+    Two records share a request when the gap between them is under `max_gap`
+    and the merged request stays under `max_span` bytes.
+    """
+    by_file = defaultdict(list)
+    for record in records:
+        by_file[record['filename']].append(record)
+
+    ranges = []
+    for filename in sorted(by_file):
+        current = None
+        for record in sorted(by_file[filename], key=lambda r: int(r['offset'])):
+            start = int(record['offset'])
+            end = start + int(record['length'])
+            if (current is not None
+                    and start - current.end < max_gap
+                    and max(end, current.end) - current.start <= max_span):
+                current.end = max(current.end, end)
+                current.records.append(record)
+            else:
+                current = FetchRange(filename, start, end, [record])
+                ranges.append(current)
+    return ranges
+
+
+def record_key(record):
+    return f"{record['filename']}:{int(record['offset'])}"
+
+
+class Checkpoint:
+    """Append-only log of fetched records, so an interrupted fetch can resume.
+
+    Each line holds one range's records as `filename:offset,offset,...`, so a
+    resumed fetch skips done records however they are merged into ranges this
+    time (another --max-gap, --max-span or batch size, or a grown export).
+    Lines of older checkpoints (`filename:start-end` ranges) still count for
+    the records inside that range.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()  # record_key() of every fetched record
+        self.spans = defaultdict(list)  # filename -> [(start, end)] from old checkpoints
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self.load_line(line.strip())
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+
+    def load_line(self, line):
+        filename, _, offsets = line.rpartition(':')
+        if not filename:
+            return
+        if '-' in offsets:
+            start, _, end = offsets.partition('-')
+            self.spans[filename].append((int(start), int(end)))
+        else:
+            self.done.update(f"{filename}:{offset}" for offset in offsets.split(','))
+
+    def __contains__(self, record):
+        if record_key(record) in self.done:
+            return True
+        start = int(record['offset'])
+        end = start + int(record['length'])
+        return any(s <= start and end <= e for s, e in self.spans.get(record['filename'], ()))
+
+    def mark(self, records):
+        """Log the records of one range (all from the same WARC file)"""
+        with self.lock:
+            self.done.update(record_key(record) for record in records)
+            if self.file:
+                offsets = ','.join(str(int(record['offset'])) for record in records)
+                self.file.write(f"{records[0]['filename']}:{offsets}\n")
+                self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class WarcFetcher:
+    def __init__(self, base_url=DEFAULT_BASE_URL, concurrency=16, max_gap=64 * 1024,
+                 max_span=16 * 1024 * 1024, max_retries=5, timeout=60, checkpoint_path=None):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip('/') + '/'
+        self.concurrency = concurrency
+        self.max_gap = max_gap
+        self.max_span = max_span
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.local = threading.local()
+
+    def connection(self):
+        """Per-thread keep-alive connection"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn_cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            conn = conn_cls(self.host, self.port, timeout=self.timeout)
+            self.local.conn = conn
+        return conn
+
+    def reset_connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+        self.local.conn = None
+
+    def fetch_range(self, fetch_range):
+        """GET one byte range into a preallocated buffer; returns a memoryview of it"""
+        path = self.base_path + fetch_range.filename.lstrip('/')
+        headers = {'Range': f"bytes={fetch_range.start}-{fetch_range.end - 1}"}
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                conn = self.connection()
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                if response.status in RETRY_STATUSES:
+                    response.read()
+                    raise IOError(f"HTTP {response.status} for {path}")
+                if response.status not in (200, 206):
+                    response.read()
+                    raise RuntimeError(f"HTTP {response.status} for {path} {headers['Range']}")
+                if response.status == 200:
+                    # Server ignored Range: stream past the bytes before our window and read
+                    # only the window; the rest of the file stays unread, so drop the connection
+                    self.local.conn = None
+                    scratch = memoryview(bytearray(min(SKIP_CHUNK, fetch_range.start) or 1))
+                    skipped = 0
+                    while skipped < fetch_range.start:
+                        n = read_into(response, scratch[:fetch_range.start - skipped])
+                        if not n:
+                            break
+                        skipped += n
+
+                view = memoryview(bytearray(fetch_range.size))
+                filled = read_into(response, view)
+                if response.status == 200:
+                    response.close()
+                    conn.close()
+                if filled != fetch_range.size:
+                    raise IOError(f"Short read for {path}: {filled}/{fetch_range.size} bytes")
+                return view
+            except (IOError, http.client.HTTPException) as e:
+                self.reset_connection()
+                if attempt == self.max_retries:
+                    raise
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"⚠️  Retrying {fetch_range.key} in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def process_range(self, fetch_range, on_record, on_range=None, on_discard=None):
+        view = self.fetch_range(fetch_range)
+        try:
+            for record in fetch_range.records:
+                start = int(record['offset']) - fetch_range.start
+                on_record(record, view[start:start + int(record['length'])])
+        except BaseException:
+            if on_discard is not None:
+                on_discard()
+            raise
+        mark = partial(self.checkpoint.mark, fetch_range.records)
+        if on_range is None:
+            mark()
+        else:
+            on_range(mark)
+        return fetch_range
+
+    def fetch(self, records, on_record, batch_size=1_000_000, on_range=None, flush=None,
+              on_discard=None):
+        """Fetch all records, calling on_record(record, memoryview) from worker threads.
+
+        Records are planned in batches of `batch_size` to bound memory; at most
+        2 x concurrency range requests are queued at any time.
+
+        A range is checkpointed once on_record has returned for its records,
+        which is only safe if on_record stores them durably. Buffering sinks
+        pass `on_range`: it is called with a `mark` callable after each range's
+        records and must call it once they are stored; `flush` is called when
+        fetching stops (also on errors), before the checkpoint is closed.
+        If on_record raises partway through a range, `on_discard` is called
+        from that worker thread so the sink can drop the range's records it
+        already took (the range is not checkpointed and will be fetched again).
+        """
+        stats = {'ranges': 0, 'skipped_records': 0, 'records': 0, 'bytes_fetched': 0, 'bytes_used': 0}
+        start_time = time.time()
+
+        try:
+            self.fetch_all(records, on_record, batch_size, on_range, on_discard, stats)
+        finally:
+            try:
+                if flush:
+                    flush()
+            finally:
+                self.checkpoint.close()
+        stats['seconds'] = time.time() - start_time
+        return stats
+
+    def fetch_all(self, records, on_record, batch_size, on_range, on_discard, stats):
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            in_flight = set()
+            batch = []
+
+            def drain(limit):
+                nonlocal in_flight
+                while len(in_flight) > limit:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        fetch_range = future.result()
+                        stats['ranges'] += 1
+                        stats['records'] += len(fetch_range.records)
+                        stats['bytes_fetched'] += fetch_range.size
+                        stats['bytes_used'] += sum(int(r['length']) for r in fetch_range.records)
+
+            def submit_batch():
+                todo = [record for record in batch if record not in self.checkpoint]
+                stats['skipped_records'] += len(batch) - len(todo)
+                for fetch_range in plan_ranges(todo, self.max_gap, self.max_span):
+                    drain(2 * self.concurrency)
+                    in_flight.add(pool.submit(self.process_range, fetch_range, on_record,
+                                                  on_range, on_discard))
+                batch.clear()
+
+            for record in records:
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    submit_batch()
+            submit_batch()
+            drain(0)